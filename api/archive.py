@@ -0,0 +1,176 @@
+"""
+Cold storage of finished cases.
+
+The archiver (`archiver.py`) moves cases that finished long ago out of the
+`cases`, `messages` and `evidence_snippets` tables into one compressed JSON
+document per case, at ARCHIVE_DIR/{user_id}/{case_id}.json.zst (or .json.gz
+when zstandard is not installed). ARCHIVE_DIR can be any mounted directory,
+e.g. a bucket mounted with a FUSE driver.
+
+A document holds the `get_case_full` payload of the case, the cursor of each
+of its messages and evidence snippets and its owner, so reads of archived
+cases return exactly what the hot tables returned.
+"""
+import gzip
+import heapq
+import os
+import re
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from dotenv import load_dotenv
+import serialization
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+load_dotenv()
+
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", "archive"))
+
+# zstd level of new documents. Archives are written once and rarely read,
+# so a higher level than zstd's default of 3 pays off
+ARCHIVE_ZSTD_LEVEL = int(os.getenv("ARCHIVE_ZSTD_LEVEL", "10"))
+
+# Version of the document layout. 2 added `evidence_cursors`
+FORMAT_VERSION = 2
+
+SUFFIXES = (".json.zst", ".json.gz")
+
+# Ids become path components, so anything else is never looked up
+_SAFE_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def compress(data: bytes) -> tuple[bytes, str]:
+    """Compress a document, returns the compressed bytes and the file suffix."""
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL).compress(data), ".json.zst"
+    return gzip.compress(data, compresslevel=9), ".json.gz"
+
+
+def decompress(data: bytes, suffix: str) -> bytes:
+    if suffix == ".json.zst":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read .json.zst archives")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def case_file(case_id: str, user_id: str) -> Optional[Path]:
+    """
+    Path of the archived document of a user's case, None if it is not archived.
+    Documents are only ever looked up in their owner's directory.
+    """
+    if not _SAFE_ID.match(case_id) or not _SAFE_ID.match(user_id):
+        return None
+    for suffix in SUFFIXES:
+        path = ARCHIVE_DIR / user_id / f"{case_id}{suffix}"
+        if path.exists():
+            return path
+    return None
+
+
+def write_case(user_id: str, case_full: dict, message_cursors: list[int], evidence_cursors: list[int]) -> Path:
+    """
+    Write the archived document of a case, replacing any previous one.
+    The file is synced to disk before this returns, so the hot rows can be deleted.
+    """
+    document = {
+        "format": FORMAT_VERSION,
+        "user_id": user_id,
+        "archived_at": datetime.utcnow().isoformat(),
+        "case": case_full,
+        "message_cursors": message_cursors,
+        "evidence_cursors": evidence_cursors,
+    }
+    data, suffix = compress(serialization.dumps(document))
+    directory = ARCHIVE_DIR / user_id
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{case_full['case_id']}{suffix}"
+
+    # Write to a temporary file and rename, so readers never see a partial document
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return path
+
+
+def read_case(case_id: str, user_id: str) -> Optional[dict]:
+    """The archived document of a user's case."""
+    path = case_file(case_id, user_id)
+    if path is None:
+        return None
+    suffix = "".join(path.suffixes[-2:])
+    return upgrade(serialization.loads(decompress(path.read_bytes(), suffix)), path)
+
+
+def upgrade(document: dict, path: Path) -> dict:
+    """Bring a document written by an older version to the current layout."""
+    if document["format"] > FORMAT_VERSION:
+        raise RuntimeError(f"{path} has format {document['format']}, this version reads up to {FORMAT_VERSION}")
+    if document["format"] < 2:
+        # Snippet ids were not recorded and their rows are gone: number the
+        # snippets in write order. These numbers are not the ids a client saw
+        # before the case was archived, see `load_case_events`
+        document["evidence_cursors"] = list(range(1, len(document["case"]["evidence_snippets"]) + 1))
+    return document
+
+
+def load_case(case_id: str, user_id: str, after: int = None) -> Optional[dict]:
+    """
+    `get_case_full` payload of an archived case, None if it is not archived.
+    With an `after` cursor only the messages inserted after it are included.
+    """
+    document = read_case(case_id, user_id)
+    if document is None:
+        return None
+    case_full = document["case"]
+    if after is not None:
+        cursors = document["message_cursors"]
+        case_full["messages"] = [
+            message for message, cursor in zip(case_full["messages"], cursors) if cursor > after
+        ]
+        case_full["next_cursor"] = cursors[-1] if cursors and cursors[-1] > after else after
+    return case_full
+
+
+def load_case_events(case_id: str, user_id: str, after: int = None, evidence_after: int = None) -> Optional[tuple[str, list[dict]]]:
+    """
+    Status of an archived case and its stream events after the `after` message
+    and `evidence_after` evidence cursors, None if it is not archived.
+    Documents of format 1 send all their snippets whatever `evidence_after`:
+    their snippet cursors cannot be compared with the ids of the hot tables.
+    """
+    document = read_case(case_id, user_id)
+    if document is None:
+        return None
+    if document["format"] < 2:
+        evidence_after = None
+    case_full = document["case"]
+    messages = [
+        (message["created_at"], 0, cursor, {"type": "message", "cursor": cursor, "data": message})
+        for message, cursor in zip(case_full["messages"], document["message_cursors"])
+        if after is None or cursor > after
+    ]
+    snippets = [
+        (snippet["created_at"], 1, cursor, {"type": "evidence", "cursor": cursor, "data": snippet})
+        for snippet, cursor in zip(case_full["evidence_snippets"], document["evidence_cursors"])
+        if evidence_after is None or cursor > evidence_after
+    ]
+    # Same order as database.merge_case_events
+    return case_full["status"], [event for *_, event in heapq.merge(messages, snippets, key=_event_order)]
+
+
+def _event_order(item: tuple) -> tuple:
+    created_at, kind, cursor, _ = item
+    return datetime.fromisoformat(created_at), kind, cursor
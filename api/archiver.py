@@ -0,0 +1,101 @@
+"""
+Moves cases that ended long ago from the database to the archive.
+
+Cases that have been COMPLETED or ERROR for more than ARCHIVE_AFTER_DAYS
+days are written to `archive` as compressed documents, then deleted from the
+`cases`, `messages` and `evidence_snippets` tables, which keeps those tables
+and their indexes sized to the recent cases. `get_case_full` and the case
+stream read archived cases from the archive.
+
+A case is only deleted once its document is on disk, and only if it was not
+updated and got no message or snippet in the meantime, so the job can be
+stopped and rerun at any time.
+
+Usage:
+    python archiver.py [--days 90] [--limit 1000] [--dry-run]
+"""
+import argparse
+import os
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from sqlmodel import Session
+import archive
+import database
+
+load_dotenv()
+
+# Days a case stays in the database after it ended
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+
+# Cases selected per database round-trip
+BATCH_SIZE = 100
+
+
+def archive_case(case_id: str, user_id: str, updated_at: datetime) -> bool:
+    """Archive one case and delete its rows. Returns whether it was archived."""
+    with Session(database.get_engine()) as db:
+        case_full = database.get_hot_case_full(db, case_id)
+        case_events = database.get_case_events(db, case_id)
+    message_cursors = [event["cursor"] for event in case_events if event["type"] == "message"]
+    evidence_cursors = sorted(event["cursor"] for event in case_events if event["type"] == "evidence")
+    if (
+        case_full is None
+        or len(message_cursors) != len(case_full["messages"])
+        or len(evidence_cursors) != len(case_full["evidence_snippets"])
+    ):
+        # Deleted or written to since it was selected
+        return False
+
+    path = archive.write_case(user_id, case_full, message_cursors, evidence_cursors)
+    with Session(database.get_engine()) as db:
+        if database.delete_case(db, case_id, updated_at, max(message_cursors, default=None), max(evidence_cursors, default=None)):
+            return True
+    # Written to since it was read, it stays in the database until it ends again
+    path.unlink(missing_ok=True)
+    return False
+
+
+def archive_cases(days: int = ARCHIVE_AFTER_DAYS, limit: int = None, dry_run: bool = False) -> int:
+    """
+    Archive up to `limit` cases (all if None) that ended more than `days` ago.
+    Returns the number archived, or that would be with `dry_run`.
+    """
+    finished_before = datetime.utcnow() - timedelta(days=days)
+    archived = 0
+    skipped = set()
+    while limit is None or archived < limit:
+        batch_size = BATCH_SIZE if limit is None else min(BATCH_SIZE, limit - archived)
+        with Session(database.get_engine()) as db:
+            # Skipped cases are still in the table, so ask for enough rows to get past them
+            rows = db.exec(database.archivable_cases_query(finished_before, batch_size + len(skipped))).all()
+        rows = [row for row in rows if row.case_id not in skipped]
+        if not rows:
+            break
+        for row in rows[:batch_size]:
+            if dry_run:
+                print(f"[Archiver] Would archive case {row.case_id} (ended {row.updated_at.isoformat()})")
+                archived += 1
+                skipped.add(row.case_id)
+            elif archive_case(row.case_id, row.user_id, row.updated_at):
+                archived += 1
+            else:
+                print(f"[Archiver] Skipped case {row.case_id}, it changed while being archived")
+                skipped.add(row.case_id)
+    return archived
+
+
+def main():
+    """Archive the cases that ended more than --days days ago."""
+    parser = argparse.ArgumentParser(description="Move cases that ended long ago to the archive")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="archive cases that ended more than this many days ago")
+    parser.add_argument("--limit", type=int, default=None, help="archive at most this many cases")
+    parser.add_argument("--dry-run", action="store_true", help="only list the cases that would be archived")
+    args = parser.parse_args()
+
+    print(f"[Archiver] Archiving cases that ended more than {args.days} days ago to {archive.ARCHIVE_DIR}")
+    archived = archive_cases(args.days, args.limit, args.dry_run)
+    print(f"[Archiver] Archived {archived} case(s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+"""
+Async database access for the FastAPI endpoints.
+
+Mirrors the helpers in `database` on an AsyncEngine (asyncpg for PostgreSQL,
+aiosqlite for SQLite) so queries no longer block the event loop. The models
+and query statements are shared with `database`; the RQ worker keeps using
+the sync API.
+"""
+import asyncio
+from datetime import datetime
+from typing import Optional, AsyncIterator
+from sqlalchemy import insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
+from sqlmodel.ext.asyncio.session import AsyncSession
+import database
+import events
+import serialization
+from db_pool import engine_options, retry_on_disconnect
+from database import ClinicalCase, Message, EvidenceSnippet
+
+
+def get_async_database_url(url: str) -> str:
+    """
+    Convert a sync DATABASE_URL into its async driver equivalent.
+
+    asyncpg does not understand libpq options, so `sslmode` is passed on as
+    asyncpg's `ssl` and `gssencmode` is dropped.
+    """
+    url = make_url(url)
+    if url.drivername in ("postgresql", "postgresql+psycopg2", "postgres"):
+        sslmode = url.query.get("sslmode")
+        url = url.set(drivername="postgresql+asyncpg").difference_update_query(["sslmode", "gssencmode"])
+        if sslmode:
+            url = url.update_query_dict({"ssl": sslmode})
+    elif url.drivername == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    return url.render_as_string(hide_password=False)
+
+
+_async_engine: Optional[AsyncEngine] = None
+_async_sessionmaker: Optional[async_sessionmaker] = None
+
+
+def get_async_engine() -> AsyncEngine:
+    """Shared async engine, created on first use."""
+    global _async_engine, _async_sessionmaker
+    if _async_engine is None:
+        if not database.database_url:
+            raise RuntimeError("DATABASE_URL is not set")
+        _async_engine = create_async_engine(get_async_database_url(database.database_url), **engine_options(is_async=True))
+        print("* created async database engine")
+        # Objects stay usable after commit, so no implicit refresh is awaited on attribute access
+        _async_sessionmaker = async_sessionmaker(_async_engine, class_=AsyncSession, expire_on_commit=False)
+    return _async_engine
+
+
+def async_session() -> AsyncSession:
+    """New session on the shared async engine, used as `async with async_session() as db`."""
+    get_async_engine()
+    return _async_sessionmaker()
+
+
+async def dispose_async_engine():
+    """Close the pooled connections of the async engine, if it was created."""
+    if _async_engine is not None:
+        await _async_engine.dispose()
+
+
+def __getattr__(name: str):
+    # `async_database.async_engine` is created on first access
+    if name == "async_engine":
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+async def create_case(db: AsyncSession, case_id: str, user_id: str, title: str = None) -> ClinicalCase:
+    """Create a new clinical case."""
+    case = ClinicalCase(
+        case_id=case_id,
+        user_id=user_id,
+        status="CREATED",
+        data_json={"title": title}
+    )
+    db.add(case)
+    await db.commit()
+    await db.refresh(case)
+    db.expunge(case)
+    await events.ainit_case(case_id, user_id)
+    return case
+
+
+async def create_cases_bulk(db: AsyncSession, user_id: str, cases: list[tuple[str, str]]) -> list[ClinicalCase]:
+    """
+    Create many clinical cases in a single multi-row INSERT and transaction.
+
+    Args:
+        cases: (case_id, title) pairs, in order
+    """
+    if not cases:
+        return []
+    created_at = datetime.utcnow()
+    rows = [
+        ClinicalCase(
+            case_id=case_id,
+            user_id=user_id,
+            status="CREATED",
+            data_json={"title": title},
+            created_at=created_at,
+            updated_at=created_at
+        )
+        for case_id, title in cases
+    ]
+    connection = await db.connection()
+    await connection.execute(insert(ClinicalCase.__table__), [row.model_dump(exclude={"id"}) for row in rows])
+    await db.commit()
+    await events.ainit_cases([row.case_id for row in rows], user_id)
+    return rows
+
+
+@retry_on_disconnect
+async def get_case(db: AsyncSession, case_id: str, user_id: str = None) -> Optional[ClinicalCase]:
+    """Get a clinical case by ID, optionally filtered by user_id."""
+    case = (await db.exec(database.case_query(case_id, user_id))).first()
+    if case:
+        db.expunge(case)
+    return case
+
+
+@retry_on_disconnect
+async def get_cases_by_id(db: AsyncSession, case_ids: list[str], user_id: str) -> list[ClinicalCase]:
+    """Get a user's cases by ID, in the order of `case_ids`, leaving out those that don't exist."""
+    cases = {case.case_id: case for case in (await db.exec(database.cases_by_id_query(case_ids, user_id))).all()}
+    for case in cases.values():
+        db.expunge(case)
+    return [cases[case_id] for case_id in case_ids if case_id in cases]
+
+
+async def update_case_status(db: AsyncSession, case_id: str, status: str):
+    """Update the status of a case."""
+    case = (await db.exec(database.case_query(case_id))).first()
+    if case:
+        case.status = status
+        case.updated_at = datetime.utcnow()
+        db.add(case)
+        await db.commit()
+        await events.apublish(case_id, {"type": "status", "status": status})
+
+
+async def add_message(db: AsyncSession, case_id: str, user_id: str, message_id: str, message_data: dict):
+    """Add a message to a case."""
+    message = Message(
+        message_id=message_id,
+        case_id=case_id,
+        user_id=user_id,
+        message_data_json=message_data
+    )
+    db.add(message)
+    await db.flush()
+    event = database.message_event(message)
+    await db.commit()
+    await events.apublish(case_id, event)
+
+
+async def add_evidence_snippet(db: AsyncSession, case_id: str, snippet_id: str, snippet_data: dict):
+    """Add an evidence snippet to a case, storing its source once across cases."""
+    source, data = database.split_snippet_data(snippet_data)
+    snippet = EvidenceSnippet(
+        snippet_id=snippet_id,
+        case_id=case_id,
+        source_hash=source["source_hash"] if source else None,
+        snippet_data_json=data
+    )
+    if source:
+        connection = await db.connection()
+        await connection.execute(database.source_upsert(connection.dialect.name), [source])
+    db.add(snippet)
+    await db.flush()
+    event = database.evidence_event(snippet, snippet_data)
+    await db.commit()
+    await events.apublish(case_id, event)
+
+
+@retry_on_disconnect
+async def get_case_full(db: AsyncSession, case_id: str, user_id: str = None, after: int = None, dedupe_sources: bool = False) -> Optional[dict]:
+    """
+    Get full case data including messages and evidence snippets, optionally filtered by user_id.
+    With an `after` cursor only the messages inserted after it are included.
+    With `dedupe_sources` each evidence source is included once, in `evidence_sources`.
+    Cases that were moved to the archive are read from there, given their `user_id`.
+    """
+    case_full = await get_hot_case_full(db, case_id, user_id, after, dedupe_sources)
+    if case_full is None:
+        case_full = await asyncio.to_thread(database.get_archived_case_full, case_id, user_id, after, dedupe_sources)
+    return case_full
+
+
+async def get_hot_case_full(db: AsyncSession, case_id: str, user_id: str = None, after: int = None, dedupe_sources: bool = False) -> Optional[dict]:
+    """`get_case_full` from the database tables only."""
+    if database.CASE_HYDRATION == "query":
+        dialect = db.bind.dialect.name
+        result = await db.exec(database.case_full_query(dialect, case_id, user_id, after, dedupe_sources))
+        return database.case_full_from_result(dialect, result, case_id, after, dedupe_sources)
+
+    case = (await db.exec(database.case_query(case_id, user_id))).first()
+    if not case:
+        return None
+
+    messages = (await db.exec(database.messages_query(case_id, user_id, after))).all()
+    snippets = (await db.exec(database.snippets_query(case_id))).all()
+    return database.build_case_full(case, messages, snippets, after, dedupe_sources)
+
+
+@retry_on_disconnect
+async def get_case_full_json(db: AsyncSession, case_id: str, user_id: str = None, after: int = None, dedupe_sources: bool = False) -> Optional[tuple[str, bytes]]:
+    """
+    Get the `get_case_full` payload already serialized, and the case status.
+    On PostgreSQL the JSON text is produced by the database and passed through.
+    """
+    if db.bind.dialect.name == "postgresql":
+        row = (await db.exec(database.case_full_text_query(case_id, user_id, after, dedupe_sources))).first()
+        if row:
+            return row.status, row.body.encode()
+        case_full = await asyncio.to_thread(database.get_archived_case_full, case_id, user_id, after, dedupe_sources)
+        return (case_full["status"], serialization.dumps(case_full)) if case_full else None
+
+    case_full = await get_case_full(db, case_id, user_id, after, dedupe_sources)
+    return (case_full["status"], serialization.dumps(case_full)) if case_full else None
+
+
+@retry_on_disconnect
+async def get_messages_after(db: AsyncSession, case_id: str, user_id: str = None, after: int = None) -> tuple[list, Optional[int]]:
+    """
+    Get the messages of a case inserted after the `after` cursor, optionally filtered by user_id.
+    Returns the messages and the cursor to pass on the next call.
+    """
+    messages = (await db.exec(database.messages_query(case_id, user_id, after))).all()
+    return [msg.to_dict() for msg in messages], database.next_cursor(messages, after)
+
+
+@retry_on_disconnect
+async def get_message_events(db: AsyncSession, case_id: str, user_id: str = None, after: int = None) -> list[dict]:
+    """Stream events for the messages of a case inserted after the `after` cursor."""
+    messages = (await db.exec(database.messages_query(case_id, user_id, after))).all()
+    return [database.message_event(msg) for msg in messages]
+
+
+@retry_on_disconnect
+async def get_case_events(db: AsyncSession, case_id: str, user_id: str = None, after: int = None, evidence_after: int = None) -> list[dict]:
+    """
+    Stream events for the messages inserted after the `after` cursor and the
+    evidence snippets inserted after the `evidence_after` cursor, in the order they were written.
+    """
+    messages = (await db.exec(database.messages_query(case_id, user_id, after))).all()
+    snippets = (await db.exec(database.snippets_query(case_id, evidence_after))).all()
+    return database.merge_case_events(messages, snippets)
+
+
+@retry_on_disconnect
+async def get_new_messages(db: AsyncSession, case_id: str, user_id: str = None, since_message_id: str = None) -> list:
+    """Get new messages for a case since a given message ID, optionally filtered by user_id."""
+    messages = (await db.exec(database.new_messages_query(case_id, user_id, since_message_id))).all()
+    return [msg.to_dict() for msg in messages]
+
+
+@retry_on_disconnect
+async def get_cases(db: AsyncSession, user_id: str = None, limit: int = 50) -> list[ClinicalCase]:
+    """Get a list of cases ordered by creation time, optionally filtered by user_id."""
+    cases = (await db.exec(database.cases_query(user_id, limit))).all()
+    return cases
+
+
+@retry_on_disconnect
+async def get_case_summaries(db: AsyncSession, user_id: str, limit: int = 50, cursor: str = None, statuses: list[str] = None) -> tuple[list[dict], Optional[str]]:
+    """
+    Get one page of a user's case summaries, newest first, optionally filtered by status.
+    Returns the summaries and the cursor of the next page (None on the last page).
+    """
+    rows = (await db.exec(database.case_summaries_query(user_id, limit, cursor, statuses))).all()
+    return database.build_case_summaries(rows, limit)
+
+
+async def export_cases(db: AsyncSession, user_id: str, statuses: list[str] = None, since: datetime = None, until: datetime = None, batch_size: int = 100) -> AsyncIterator[list[dict]]:
+    """
+    Yield a user's cases as `get_case_full` payloads, oldest first, in batches of `batch_size`.
+    See `database.export_cases`.
+    """
+    cases = await db.stream(database.export_cases_query(user_id, statuses, since, until).execution_options(yield_per=batch_size))
+    async for batch in cases.partitions():
+        case_ids = [case.case_id for case in batch]
+        messages = (await db.exec(database.cases_messages_query(case_ids))).all()
+        snippets = (await db.exec(database.cases_snippets_query(case_ids))).all()
+        yield database.build_export_batch(batch, messages, snippets)
+
+
+@retry_on_disconnect
+async def search(db: AsyncSession, user_id: str, q: str, limit: int = 20, cursor: str = None) -> tuple[list[dict], Optional[str]]:
+    """
+    Full-text search over a user's case titles, messages and evidence, best match first.
+    Returns one page of results and the cursor of the next page (None on the last page).
+    """
+    if not q.split():
+        return [], None
+    rows = (await db.exec(database.search_query(db.bind.dialect.name, user_id, q, limit, cursor))).all()
+    return database.build_search_results(rows, limit)
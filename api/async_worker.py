@@ -0,0 +1,348 @@
+"""
+Async worker that runs many cases concurrently in one process.
+
+The agent mostly waits on LLM and tool calls, so instead of one case per RQ
+worker process this worker pulls jobs from the `clinical_cases` queue and runs
+up to N of them at once on a single asyncio event loop.
+
+For a job `worker.process_case` it runs the coroutine `worker.process_case_async`
+when the module defines one. Otherwise the sync function runs on a thread of
+the worker, so that every case shares the process's database engine,
+connection pool and Redis clients, and writes through the same `database`
+helpers. Each case is bounded by its job's timeout. A timed out or failed
+case is marked ERROR through `database.update_case_status`.
+
+A thread cannot be stopped: a timed out sync job is failed at once, but
+keeps its slot until the function returns. With --processes (or
+WORKER_JOB_PROCESSES=1) sync functions run in a child process of their own
+instead, which is killed on timeout. Each child loads the application
+anew, so keep this for job functions that may hang for good.
+
+Dequeuing and recording job outcomes run on threads of their own, so they
+never wait behind the blocking calls of the running cases.
+
+On SIGTERM or SIGINT the worker stops pulling jobs and waits for the running
+cases to finish. A second signal cancels them.
+
+Usage:
+    python async_worker.py [--concurrency 20] [--burst] [--processes]
+"""
+import argparse
+import asyncio
+import functools
+import importlib
+import multiprocessing
+import os
+import signal
+import socket
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional
+from dotenv import load_dotenv
+from rq import Queue
+from rq.exceptions import DequeueTimeout
+from rq.executions import Execution
+from rq.job import Job, JobStatus
+from rq.registry import FinishedJobRegistry, FailedJobRegistry
+from sqlmodel import Session
+import database
+import events
+
+load_dotenv()
+
+QUEUE_NAME = 'clinical_cases'
+
+# Number of cases run at the same time by one worker process
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "20"))
+
+# Timeout of jobs enqueued without one, in seconds
+DEFAULT_JOB_TIMEOUT = 600
+
+# How long a blocking dequeue waits before checking for shutdown, in seconds
+DEQUEUE_TIMEOUT = 1
+
+# Results of finished jobs are kept this long, as by RQ workers, in seconds
+RESULT_TTL = 500
+
+# Run sync job functions in child processes rather than on threads of the worker
+WORKER_JOB_PROCESSES = os.getenv("WORKER_JOB_PROCESSES", "0") == "1"
+
+# Child processes of sync job functions are fresh interpreters: forking a
+# process that runs threads is unsafe
+PROCESS_CONTEXT = multiprocessing.get_context("spawn")
+
+
+class JobProcessError(Exception):
+    """A sync job function failed in its child process."""
+
+    def __init__(self, message: str, exc_string: str = None):
+        super().__init__(message)
+        self.exc_string = exc_string
+
+
+def resolve_job_function(job: Job):
+    """The coroutine function to run for a job, or None to run the sync `job.func`."""
+    module_name, _, function_name = job.func_name.rpartition('.')
+    module = importlib.import_module(module_name)
+    function = getattr(module, f"{function_name}_async", None)
+    return function if asyncio.iscoroutinefunction(function) else None
+
+
+def call_job_function(func_name: str, args: tuple, kwargs: dict, errors):
+    """Run a sync job function, in a child process. Its traceback is sent on `errors` if it raises."""
+    try:
+        module_name, _, function_name = func_name.rpartition('.')
+        getattr(importlib.import_module(module_name), function_name)(*args, **kwargs)
+    except BaseException:
+        errors.send(traceback.format_exc())
+        raise SystemExit(1)
+    finally:
+        errors.close()
+
+
+async def wait_process(process):
+    """Wait for a child process to exit without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    exited = loop.create_future()
+    loop.add_reader(process.sentinel, lambda: exited.done() or exited.set_result(None))
+    try:
+        await exited
+    finally:
+        loop.remove_reader(process.sentinel)
+    process.join()
+
+
+def mark_case_error(case_id: str, overwrite: bool = False):
+    """
+    Set a case that did not finish to ERROR, unless it already ended. With
+    `overwrite` a COMPLETED case is set to ERROR too: its job was given up.
+    """
+    with Session(database.get_engine()) as db:
+        case = database.get_case(db, case_id)
+        if case and case.status != 'ERROR' and (overwrite or case.status != 'COMPLETED'):
+            database.update_case_status(db, case_id, 'ERROR')
+
+
+class AsyncCaseWorker:
+    """
+    Pulls jobs from an RQ queue and runs up to `concurrency` of them at once.
+
+    Jobs go through the same registries as with a regular RQ worker (started,
+    finished, failed), so `rq info` and the API see their state. Sync job
+    functions run on threads of the worker, or with `processes` in child
+    processes.
+    """
+
+    def __init__(self, queue: Queue, concurrency: int = WORKER_CONCURRENCY, processes: bool = WORKER_JOB_PROCESSES):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.processes = processes
+        self.name = f"async-{socket.gethostname()}-{os.getpid()}"
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.stopping = asyncio.Event()
+        self.tasks: set[asyncio.Task] = set()
+        # Dequeuing and recording outcomes, apart from the threads of the running cases
+        self.bookkeeping = ThreadPoolExecutor(max_workers=4, thread_name_prefix="worker-bookkeeping")
+        # Sync job functions, one thread per slot
+        self.case_threads = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="worker-case")
+        # Ids of sync jobs given up while their thread runs on
+        self.abandoned: set[str] = set()
+
+    def request_stop(self):
+        """First call drains the running cases, the second cancels them."""
+        if not self.stopping.is_set():
+            print(f"[Worker] Stopping, waiting for {len(self.tasks)} running case(s)...")
+            self.stopping.set()
+        else:
+            print(f"[Worker] Cancelling {len(self.tasks)} running case(s)...")
+            for task in self.tasks:
+                task.cancel()
+
+    async def run(self, burst: bool = False):
+        """Process jobs until stopped, or until the queue is empty with `burst`."""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.request_stop)
+        # Blocking calls of coroutine jobs (`asyncio.to_thread`), one thread per slot
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.concurrency))
+
+        print(f"[Worker] {self.name} processing up to {self.concurrency} cases from '{self.queue.name}'")
+        while not self.stopping.is_set():
+            await self.semaphore.acquire()
+            if self.stopping.is_set():
+                self.semaphore.release()
+                break
+
+            dequeued = await self.bookkeep(self.dequeue)
+            if dequeued is None:
+                self.semaphore.release()
+                if burst and not self.tasks:
+                    break
+                continue
+
+            task = asyncio.create_task(self.perform(*dequeued))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+        # Cases given up while draining leave a task waiting for their thread
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.bookkeeping.shutdown()
+        self.case_threads.shutdown(wait=False)
+        print(f"[Worker] {self.name} stopped")
+
+    async def bookkeep(self, function, *args):
+        """Run a blocking queue operation on the bookkeeping threads."""
+        return await asyncio.get_running_loop().run_in_executor(self.bookkeeping, functools.partial(function, *args))
+
+    def dequeue(self) -> Optional[tuple[Job, Execution]]:
+        """Wait briefly for the next job, marking it started in the same round-trip."""
+        try:
+            result = Queue.dequeue_any([self.queue], DEQUEUE_TIMEOUT, connection=self.queue.connection)
+        except DequeueTimeout:
+            return None
+        if result is None:
+            return None
+        job, _ = result
+        with self.queue.connection.pipeline() as pipeline:
+            # Adds the job to the started registry until the timeout has passed
+            execution = Execution.create(job, self.job_timeout(job) + 60, pipeline=pipeline)
+            job.prepare_for_execution(self.name, pipeline)
+            pipeline.execute()
+        return job, execution
+
+    def job_function(self, job: Job):
+        """The coroutine function to run for a job, or None to run the sync `job.func`."""
+        return resolve_job_function(job)
+
+    def job_timeout(self, job: Job) -> int:
+        return job.timeout if job.timeout and job.timeout > 0 else DEFAULT_JOB_TIMEOUT
+
+    async def perform(self, job: Job, execution: Execution):
+        """Run one job within its timeout and record the outcome."""
+        try:
+            print(f"[Worker] Starting job {job.id}")
+            function = self.job_function(job)
+            if function is not None:
+                call = function(*job.args, **job.kwargs)
+            elif self.processes:
+                call = self.run_in_process(job)
+            else:
+                call = self.run_in_thread(job)
+            await asyncio.wait_for(call, timeout=self.job_timeout(job))
+        except asyncio.TimeoutError:
+            await self.failed(job, execution, f"Job exceeded its timeout of {self.job_timeout(job)}s")
+        except asyncio.CancelledError:
+            await self.failed(job, execution, "Job was cancelled by worker shutdown")
+        except JobProcessError as e:
+            await self.failed(job, execution, str(e), e.exc_string)
+        except Exception as e:
+            await self.failed(job, execution, f"{type(e).__name__}: {e}".splitlines()[0], traceback.format_exc())
+        else:
+            await self.bookkeep(self.finished, job, execution)
+            print(f"[Worker] Finished job {job.id}")
+        finally:
+            if job.id in self.abandoned:
+                # The thread gives the slot back once it returns
+                self.abandoned.discard(job.id)
+            else:
+                self.semaphore.release()
+
+    async def run_in_thread(self, job: Job):
+        """
+        Run the sync function of a job on a case thread of this process. If
+        the job is cancelled (on timeout or shutdown) it is failed at once,
+        while the thread runs on and holds the slot until the function
+        returns. The case is then marked ERROR again, in case the function
+        set a status of its own in the meantime.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.case_threads, functools.partial(job.func, *job.args, **job.kwargs))
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self.abandoned.add(job.id)
+            task = asyncio.create_task(self.release_abandoned(job, future))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            raise
+
+    async def release_abandoned(self, job: Job, future: asyncio.Future):
+        """Wait for the thread of a given up sync job, then free its slot."""
+        try:
+            await asyncio.gather(future, return_exceptions=True)
+            print(f"[Worker] Thread of given up job {job.id} returned")
+            case_id = job.kwargs.get('case_id')
+            if case_id:
+                await self.bookkeep(mark_case_error, case_id, True)
+        finally:
+            self.semaphore.release()
+
+    async def run_in_process(self, job: Job):
+        """
+        Run the sync function of a job in a child process. The process is
+        killed if the job is cancelled (on timeout or shutdown), and only
+        once it has exited does the case give up its slot.
+        """
+        receiver, sender = PROCESS_CONTEXT.Pipe(duplex=False)
+        process = PROCESS_CONTEXT.Process(
+            target=call_job_function, args=(job.func_name, job.args, job.kwargs, sender), daemon=True
+        )
+        process.start()
+        sender.close()
+        try:
+            await wait_process(process)
+        except asyncio.CancelledError:
+            process.kill()
+            process.join()
+            raise
+        finally:
+            exc_string = receiver.recv() if process.exitcode and receiver.poll() else None
+            receiver.close()
+        if process.exitcode:
+            reason = exc_string.strip().splitlines()[-1] if exc_string else f"Job process exited with code {process.exitcode}"
+            raise JobProcessError(reason, exc_string)
+
+    def finished(self, job: Job, execution: Execution):
+        job.ended_at = datetime.now(timezone.utc)
+        with self.queue.connection.pipeline() as pipeline:
+            execution.delete(job, pipeline=pipeline)
+            job.set_status(JobStatus.FINISHED, pipeline=pipeline)
+            job.save(pipeline=pipeline, include_meta=False)
+            FinishedJobRegistry(queue=self.queue).add(job, RESULT_TTL, pipeline=pipeline)
+            pipeline.execute()
+
+    async def failed(self, job: Job, execution: Execution, reason: str, exc_string: str = None):
+        print(f"[Worker] Job {job.id} failed: {reason}")
+
+        def record():
+            job.ended_at = datetime.now(timezone.utc)
+            with self.queue.connection.pipeline() as pipeline:
+                execution.delete(job, pipeline=pipeline)
+                job.set_status(JobStatus.FAILED, pipeline=pipeline)
+                job.save(pipeline=pipeline, include_meta=False)
+                FailedJobRegistry(queue=self.queue).add(job, job.failure_ttl, exc_string or reason, pipeline=pipeline)
+                pipeline.execute()
+            case_id = job.kwargs.get('case_id')
+            if case_id:
+                mark_case_error(case_id)
+
+        await self.bookkeep(record)
+
+
+def main():
+    """Run the async worker on the clinical_cases queue."""
+    parser = argparse.ArgumentParser(description="Run many clinical cases concurrently in one process")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="cases run at the same time")
+    parser.add_argument("--burst", action="store_true", help="exit once the queue is empty")
+    parser.add_argument("--processes", action="store_true", default=WORKER_JOB_PROCESSES,
+                        help="run sync job functions in child processes, killed on timeout")
+    args = parser.parse_args()
+
+    queue = Queue(QUEUE_NAME, connection=events.get_redis())
+    asyncio.run(AsyncCaseWorker(queue, args.concurrency, args.processes).run(burst=args.burst))
+
+
+if __name__ == '__main__':
+    main()
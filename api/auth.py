@@ -2,6 +2,12 @@
 JWT authentication middleware for Supabase.
 """
 import os
+import hashlib
+import json
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
 import jwt
 from typing import Optional
 from fastapi import HTTPException, Security, Depends
@@ -13,12 +19,207 @@ load_dotenv()
 # Supabase JWT secret for verifying tokens
 SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "")
 
+# Optional JWKS for asymmetric (RS/ES) signing keys, an http(s) URL or a local file path.
+# Verifying these keys requires the `cryptography` package (pip install "pyjwt[crypto]").
+SUPABASE_JWKS_URL = os.getenv("SUPABASE_JWKS_URL", "")
+JWKS_REFRESH_SECONDS = float(os.getenv("JWKS_REFRESH_SECONDS", "600"))
+
+# First retry of a failed JWKS load, in seconds, doubling up to JWKS_REFRESH_SECONDS
+JWKS_RETRY_SECONDS = float(os.getenv("JWKS_RETRY_SECONDS", "5"))
+
+# Longest a token with an unknown key id waits for the JWKS to reload, in seconds
+JWKS_WAIT_SECONDS = 2.0
+
+# Cache of verified tokens, so repeated requests with the same token skip jwt.decode
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+JWT_CACHE_TTL_SECONDS = float(os.getenv("JWT_CACHE_TTL_SECONDS", "300"))
+
 security = HTTPBearer()
 
 
+class TokenCache:
+    """
+    Bounded LRU of verified token payloads keyed on the token's SHA-256 digest.
+
+    An entry expires after the cache TTL or at the token's own `exp`, whichever
+    comes first, so a cached token is never accepted past its expiry.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[bytes, tuple[float, dict]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest: bytes) -> Optional[dict]:
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self.entries[digest]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(digest)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, digest: bytes, payload: dict):
+        expires_at = time.time() + self.ttl
+        if "exp" in payload:
+            expires_at = min(expires_at, float(payload["exp"]))
+        with self.lock:
+            self.entries[digest] = (expires_at, payload)
+            self.entries.move_to_end(digest)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+
+class JWKSKeySet:
+    """
+    Parsed JWKS kept in memory and reloaded from its URL or file by a
+    background thread every `refresh_seconds`, so verifying a token never
+    waits on the network. A failed reload keeps the last good keys and is
+    retried with exponential backoff, up to `refresh_seconds` apart.
+
+    A token naming an unknown key id (key rotation, or the first token
+    before the initial load) wakes the thread, at most once a minute, and
+    waits up to JWKS_WAIT_SECONDS for the reload.
+    """
+
+    def __init__(self, source: str, refresh_seconds: float):
+        self.source = source
+        self.refresh_seconds = refresh_seconds
+        self.keys: dict[str, jwt.PyJWK] = {}
+        self.loaded_at = 0.0  # monotonic time of the last good load, 0 before the first
+        self.failures = 0  # Failed loads since the last good one
+        self.last_attempt: Optional[float] = None
+        self.attempts = 0
+        self.lock = threading.Lock()
+        self.attempted = threading.Condition(self.lock)
+        self.wake = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def fetch(self) -> dict[str, jwt.PyJWK]:
+        """Read and parse the key set, by key id."""
+        if self.source.startswith(("http://", "https://")):
+            with urllib.request.urlopen(self.source, timeout=10) as response:
+                data = json.load(response)
+        else:
+            with open(self.source) as f:
+                data = json.load(f)
+        key_set = jwt.PyJWKSet.from_dict(data)
+        return {key.key_id: key for key in key_set.keys}
+
+    def refresh(self):
+        """Reload the key set, keeping the current keys when that fails."""
+        try:
+            keys = self.fetch()
+        except Exception as e:
+            with self.lock:
+                self.failures += 1
+                self.attempts += 1
+                self.attempted.notify_all()
+            print(f"* failed to load JWKS from {self.source}, keeping {len(self.keys)} keys: {e}")
+            return
+        with self.lock:
+            self.keys = keys
+            self.loaded_at = time.monotonic()
+            self.failures = 0
+            self.attempts += 1
+            self.attempted.notify_all()
+        print(f"* loaded {len(keys)} JWKS keys from {self.source}")
+
+    def retry_delay(self) -> float:
+        """Seconds until the next reload: the refresh period, or a backoff after failures."""
+        if not self.failures:
+            return self.refresh_seconds
+        return min(self.refresh_seconds, JWKS_RETRY_SECONDS * 2 ** (self.failures - 1))
+
+    def run(self):
+        while True:
+            with self.lock:
+                self.last_attempt = time.monotonic()
+            self.refresh()
+            self.wake.wait(self.retry_delay())
+            self.wake.clear()
+
+    def start(self):
+        """Start the refresh thread, once."""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="jwks-refresh", daemon=True)
+                self.thread.start()
+
+    def get_key(self, kid: Optional[str]) -> jwt.PyJWK:
+        if self.thread is None:
+            self.start()
+        with self.lock:
+            if kid not in self.keys:
+                now = time.monotonic()
+                # The first load is under way, or a rotation may have added the key
+                if not self.attempts or now - self.last_attempt > 60:
+                    attempts = self.attempts
+                    if self.attempts:
+                        self.last_attempt = now
+                        self.wake.set()
+                    self.attempted.wait_for(lambda: self.attempts > attempts, timeout=JWKS_WAIT_SECONDS)
+            key = self.keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key: {kid}")
+        return key
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self.keys),
+            "age_seconds": time.monotonic() - self.loaded_at if self.loaded_at else None,
+            "failures": self.failures,
+        }
+
+
+token_cache = TokenCache(JWT_CACHE_SIZE, JWT_CACHE_TTL_SECONDS)
+jwks = JWKSKeySet(SUPABASE_JWKS_URL, JWKS_REFRESH_SECONDS) if SUPABASE_JWKS_URL else None
+
+
+def get_token_cache_stats() -> dict:
+    """Hit/miss counters and size of the verified token cache."""
+    return token_cache.stats()
+
+
+def get_jwks_stats() -> Optional[dict]:
+    """Keys, age of the last good load and failed loads since of the JWKS, None without one."""
+    return jwks.stats() if jwks is not None else None
+
+
+def decode_jwt_token(token: str) -> dict:
+    """
+    Decode and verify a token without the cache.
+    HS256 tokens are checked against the JWT secret, asymmetric ones against the JWKS.
+    """
+    header = jwt.get_unverified_header(token)
+    if header.get("alg") == "HS256" or jwks is None:
+        # Supabase legacy tokens use HS256 algorithm
+        key, algorithm = SUPABASE_JWT_SECRET, "HS256"
+    else:
+        signing_key = jwks.get_key(header.get("kid"))
+        key, algorithm = signing_key.key, signing_key.algorithm_name
+
+    return jwt.decode(
+        token,
+        key,
+        algorithms=[algorithm],
+        audience="authenticated"
+    )
+
+
 def verify_jwt_token(token: str) -> Optional[dict]:
     """
     Verify a Supabase JWT token and return the payload.
+    Verified tokens are cached until they expire.
 
     Args:
         token: The JWT token string
@@ -26,15 +227,14 @@ def verify_jwt_token(token: str) -> Optional[dict]:
     Returns:
         The decoded token payload if valid, None otherwise
     """
+    digest = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(digest)
+    if payload is not None:
+        return payload
+
     try:
-        # Decode and verify the JWT token
-        # Supabase uses HS256 algorithm
-        payload = jwt.decode(
-            token,
-            SUPABASE_JWT_SECRET,
-            algorithms=["HS256"],
-            audience="authenticated"
-        )
+        payload = decode_jwt_token(token)
+        token_cache.put(digest, payload)
         return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
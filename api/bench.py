@@ -0,0 +1,1998 @@
+"""
+Load test and benchmark harness for the API, with local stand-ins.
+
+Boots `server.app` in process with uvicorn on a local port, against a
+scratch database (a fresh SQLite file by default, or --database-url for a
+local Postgres) and fakeredis (or --redis-url for a local redis-server).
+Cases are processed by the async worker running a fake agent, which writes
+messages and evidence snippets through `database.add_message` and
+`database.add_evidence_snippet` at a fixed rate.
+
+A run has three phases:
+- startup: time to import `server` and to serve the first requests, in
+  fresh child processes (`cold_start`, `import_times`)
+- streams: idle streams are opened on waiting cases to measure the memory
+  held per open stream on the server side
+- load: for --duration seconds, bursts of create_case, concurrent /stream
+  clients following the new cases, /api/cases listing and full-case opens.
+  With --flooders, that many clients of one more user create cases and
+  open streams as fast as the server lets them, to check that admission
+  control (`limits.py`) keeps the latency of the other users flat
+- export: with --export-cases, that many finished cases of one more user
+  are written, then exported by `export.py` in a child process, as NDJSON
+  and as gzip-compressed NDJSON, measuring rows per second and peak RSS.
+  Opening the same cases one GET /api/cases/{case_id} at a time (through
+  `get_case_full`) is timed on up to 100 of them for comparison
+
+With --scenario, one focused measurement runs instead, see SCENARIOS.
+
+The report is one JSON document (stdout, or --output) with throughput,
+p50/p95/p99 latency and SQL statements per request for every operation,
+so runs can be compared over time.
+
+The benchmark writes to the database it is given: never point it at a
+database holding real cases.
+
+Usage:
+    pip install "api[bench]"
+    python bench.py [--duration 30] [--streams 50] [--database-url postgresql://...]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import httpx
+import jwt
+import uvicorn
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+# The application modules read their settings on import, so they are only
+# imported once `configure` has set up the environment
+
+# Operations of the load phase and the routes whose SQL statements they are charged
+ROUTES = {
+    "create_case": "/api/create_case",
+    "list_cases": "/api/cases",
+    "open_case": "/api/cases/{case_id}",
+    "stream": "/api/cases/{case_id}/stream",
+}
+
+# User of the --flooders clients
+FLOODER = "bench-flooder"
+
+# User of the --export-cases cases
+EXPORT_USER = "bench-export"
+
+# Cases written per transaction when seeding the export
+EXPORT_SEED_BATCH = 1000
+
+# Signing secret of the tokens used by the simulated users
+JWT_SECRET = "bench-secret-" + uuid.uuid4().hex
+
+# Words the fake agent writes with
+WORDS = (
+    "patient presents with fever cough fatigue dyspnea chest pain history of hypertension diabetes "
+    "treatment dose response trial cohort randomized placebo outcome risk ratio evidence guideline"
+).split()
+
+
+def percentiles(values: list[float]) -> dict:
+    """p50, p95, p99 and max of durations in seconds, in milliseconds."""
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+    return {"p50": rank(0.50), "p95": rank(0.95), "p99": rank(0.99), "max": round(ordered[-1] * 1000, 2)}
+
+
+def make_token(user_id: str) -> str:
+    return jwt.encode(
+        {"sub": user_id, "aud": "authenticated", "exp": int(time.time()) + 86400},
+        JWT_SECRET,
+        algorithm="HS256",
+    )
+
+
+class Recorder:
+    """Latencies and errors per operation."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+
+    async def timed(self, operation: str, request):
+        """Await a request, recording its latency, or an error for a failed or 4xx/5xx response."""
+        start = time.perf_counter()
+        try:
+            response = await request
+        except Exception:
+            self.errors[operation] += 1
+            return None
+        if response.status_code >= 400:
+            self.errors[operation] += 1
+            return None
+        self.latencies[operation].append(time.perf_counter() - start)
+        return response
+
+
+class FakeAgent:
+    """
+    Stands in for the agent: writes the messages and evidence snippets of a
+    case at a fixed rate through a `write_buffer.CaseWriteBuffer`, as the
+    worker should, or with `buffered=False` one transaction per row through
+    the sync database helpers.
+    """
+
+    def __init__(self, messages: int, snippets: int, rate: float, sources: int, seed: int, buffered: bool = True):
+        self.messages = messages
+        self.buffered = buffered
+        self.snippets = snippets
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.random = random.Random(seed)
+        # Cases cite overlapping sources, as real cases do
+        self.sources = [
+            {
+                "source_id": f"PMID{10000000 + i}",
+                "text": self.text(120),
+                "source_type": "pubmed",
+                "source_url": f"https://pubmed.ncbi.nlm.nih.gov/{10000000 + i}/",
+                "source_citation": f"Author et al. Journal. 20{i % 25:02d}.",
+            }
+            for i in range(sources)
+        ]
+        self.cases_completed = 0
+        self.messages_written = 0
+        self.snippets_written = 0
+
+    def text(self, words: int) -> str:
+        return " ".join(self.random.choice(WORDS) for _ in range(words))
+
+    def write(self, function, *args):
+        import database
+        from sqlmodel import Session
+        with Session(database.get_engine()) as db:
+            function(db, *args)
+
+    async def run(self, case_id: str, user_id: str, question: str):
+        """Process one case, as `worker.process_case_async` would."""
+        from write_buffer import CaseWriteBuffer
+        writes = CaseWriteBuffer(case_id, user_id) if self.buffered else UnbufferedWrites(case_id, user_id)
+        await asyncio.to_thread(writes.update_case_status, "PROCESSING")
+        # Snippets are spread over the messages
+        every = max(1, self.messages // self.snippets) if self.snippets else 0
+        snippets = 0
+        for i in range(self.messages):
+            await asyncio.sleep(self.interval)
+            message = {"text": self.text(self.random.randint(20, 200)), "stage": "thinking", "message_type": "AGENT"}
+            await asyncio.to_thread(writes.add_message, f"{case_id}-m{i}", message)
+            self.messages_written += 1
+            if every and i % every == every - 1 and snippets < self.snippets:
+                snippet = {**self.random.choice(self.sources), "index": snippets}
+                await asyncio.to_thread(writes.add_evidence_snippet, f"{case_id}-s{snippets}", snippet)
+                snippets += 1
+                self.snippets_written += 1
+        await asyncio.to_thread(writes.update_case_status, "COMPLETED")
+        self.cases_completed += 1
+
+
+class UnbufferedWrites:
+    """The interface of `write_buffer.CaseWriteBuffer`, writing every row in its own transaction."""
+
+    def __init__(self, case_id: str, user_id: str):
+        self.case_id = case_id
+        self.user_id = user_id
+
+    def add_message(self, message_id: str, message_data: dict):
+        import database
+        from sqlmodel import Session
+        with Session(database.get_engine()) as db:
+            database.add_message(db, self.case_id, self.user_id, message_id, message_data)
+
+    def add_evidence_snippet(self, snippet_id: str, snippet_data: dict):
+        import database
+        from sqlmodel import Session
+        with Session(database.get_engine()) as db:
+            database.add_evidence_snippet(db, self.case_id, snippet_id, snippet_data)
+
+    def update_case_status(self, status: str):
+        import database
+        from sqlmodel import Session
+        with Session(database.get_engine()) as db:
+            database.update_case_status(db, self.case_id, status)
+
+    def close(self):
+        pass
+
+
+def write_case(db, agent: FakeAgent, case_id: str, user_id: str, messages: int, snippets: int):
+    """Write a finished case with the bulk helpers."""
+    import database
+    database.create_case(db, case_id, user_id, agent.text(8))
+    database.add_messages_bulk(db, case_id, user_id, [
+        (f"{case_id}-m{j}", {"text": agent.text(100), "stage": "thinking", "message_type": "AGENT"})
+        for j in range(messages)
+    ])
+    database.add_evidence_snippets_bulk(db, case_id, [
+        (f"{case_id}-s{j}", {**agent.random.choice(agent.sources), "index": j})
+        for j in range(snippets)
+    ])
+    database.update_case_status(db, case_id, "COMPLETED")
+
+
+def make_worker(queue, concurrency: int, agent: FakeAgent):
+    import async_worker
+
+    class FakeAgentWorker(async_worker.AsyncCaseWorker):
+        """Async worker running the fake agent for every job."""
+
+        def job_function(self, job):
+            return agent.run
+
+    return FakeAgentWorker(queue, concurrency)
+
+
+class Benchmark:
+    """One benchmark run against an in-process server."""
+
+    def __init__(self, args, http, recorder: Recorder, agent: FakeAgent):
+        self.args = args
+        self.http = http
+        self.recorder = recorder
+        self.agent = agent
+        self.users = [f"bench-user-{i}" for i in range(args.users)]
+        self.tokens = {user_id: make_token(user_id) for user_id in [*self.users, FLOODER]}
+        self.random = random.Random(args.seed)
+        # (case_id, user_id) of every case that can be opened
+        self.cases: list[tuple[str, str]] = []
+        # Cases created during the load phase, for the stream clients to follow
+        self.created: asyncio.Queue = asyncio.Queue()
+        self.stopping = asyncio.Event()
+        self.streams_completed = 0
+        self.stream_events = Counter()
+        self.stream_bytes = 0
+        # Responses to the flooders by request and status code, e.g. "create_case 429"
+        self.flood_responses = Counter()
+        self.flood_cases: list[str] = []
+
+    def headers(self, user_id: str) -> dict:
+        return {"Authorization": f"Bearer {self.tokens[user_id]}"}
+
+    async def create_case(self, user_id: str) -> Optional[str]:
+        response = await self.recorder.timed("create_case", self.http.post(
+            "/api/create_case",
+            json={"question": self.agent.text(30)},
+            headers=self.headers(user_id),
+        ))
+        if response is None:
+            return None
+        case_id = response.json()["case_id"]
+        self.cases.append((case_id, user_id))
+        return case_id
+
+    def seed(self, count: int):
+        """Write finished cases directly, so listing and opening have data from the start."""
+        import database
+        from sqlmodel import Session
+        with Session(database.get_engine()) as db:
+            for i in range(count):
+                user_id = self.users[i % len(self.users)]
+                case_id = f"bench-seed-{uuid.uuid4()}"
+                write_case(db, self.agent, case_id, user_id, self.agent.messages, self.agent.snippets)
+                self.cases.append((case_id, user_id))
+
+    async def measure_stream_memory(self, count: int) -> dict:
+        """
+        Open `count` streams on cases waiting in the queue and measure the
+        memory they hold on the server side. Allocations made by the HTTP
+        client in this process are left out.
+        """
+        # One waiting case per user, the worker processes them first once it starts
+        waiting = []
+        for user_id in self.users[:count]:
+            case_id = await self.create_case(user_id)
+            if case_id:
+                waiting.append((case_id, user_id))
+
+        opened = asyncio.Semaphore(0)
+
+        async def hold(case_id: str, user_id: str, release: asyncio.Event):
+            async with self.http.stream("GET", f"/api/cases/{case_id}/stream", params={"token": self.tokens[user_id]}) as response:
+                async for line in response.aiter_lines():
+                    if line.startswith("data: "):
+                        opened.release()
+                        break
+                await release.wait()
+
+        tracemalloc.start(25)
+        client_side = [
+            tracemalloc.Filter(False, "*httpx*", all_frames=True),
+            tracemalloc.Filter(False, "*httpcore*", all_frames=True),
+            tracemalloc.Filter(False, __file__, all_frames=True),
+        ]
+        try:
+            before = tracemalloc.take_snapshot().filter_traces(client_side)
+            release = asyncio.Event()
+            tasks = [
+                asyncio.create_task(hold(*waiting[i % len(waiting)], release))
+                for i in range(count)
+            ]
+            for _ in range(count):
+                await asyncio.wait_for(opened.acquire(), timeout=30)
+            await asyncio.sleep(0.5)
+            after = tracemalloc.take_snapshot().filter_traces(client_side)
+        finally:
+            tracemalloc.stop()
+        held = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+        release.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return {"streams": count, "bytes_per_stream": round(held / count) if count else None}
+
+    async def creator(self):
+        """Bursts of create_case, spread over the users."""
+        while not self.stopping.is_set():
+            users = [self.random.choice(self.users) for _ in range(self.args.burst_size)]
+            created = await asyncio.gather(*(self.create_case(user_id) for user_id in users))
+            for case_id, user_id in zip(created, users):
+                if case_id:
+                    self.created.put_nowait((case_id, user_id))
+            await self.pause(self.args.burst_interval)
+
+    async def stream_client(self):
+        """Follow new cases on /stream until they are done, one after the other."""
+        while not self.stopping.is_set():
+            try:
+                case_id, user_id = await asyncio.wait_for(self.created.get(), timeout=1.0)
+            except asyncio.TimeoutError:
+                continue
+            start = time.perf_counter()
+            first_message = False
+            try:
+                async with self.http.stream("GET", f"/api/cases/{case_id}/stream", params={"token": self.tokens[user_id]}) as response:
+                    if response.status_code >= 400:
+                        self.recorder.errors["stream"] += 1
+                        continue
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data: "):
+                            continue
+                        self.stream_bytes += len(line) + 1
+                        event_type = json.loads(line[6:])["type"]
+                        self.stream_events[event_type] += 1
+                        if event_type == "message" and not first_message:
+                            first_message = True
+                            self.recorder.latencies["stream_first_message"].append(time.perf_counter() - start)
+                        if event_type in ("done", "timeout", "error"):
+                            break
+            except Exception:
+                self.recorder.errors["stream"] += 1
+                continue
+            self.recorder.latencies["stream"].append(time.perf_counter() - start)
+            self.streams_completed += 1
+
+    async def lister(self):
+        """Page through a user's cases, as the case list does."""
+        while not self.stopping.is_set():
+            user_id = self.random.choice(self.users)
+            await self.recorder.timed("list_cases", self.http.get("/api/cases", headers=self.headers(user_id)))
+            await self.pause(self.args.think_time)
+
+    async def opener(self):
+        """Open full cases, finished or running."""
+        while not self.stopping.is_set():
+            if self.cases:
+                case_id, user_id = self.random.choice(self.cases)
+                await self.recorder.timed("open_case", self.http.get(f"/api/cases/{case_id}", headers=self.headers(user_id)))
+            await self.pause(self.args.think_time)
+
+    async def flooder(self):
+        """Create cases and open streams on them without pause, holding every stream let through."""
+        held = []
+        try:
+            while not self.stopping.is_set():
+                try:
+                    response = await self.http.post(
+                        "/api/create_case", json={"question": self.agent.text(30)}, headers=self.headers(FLOODER)
+                    )
+                except Exception:
+                    self.flood_responses["create_case error"] += 1
+                    continue
+                self.flood_responses[f"create_case {response.status_code}"] += 1
+                if response.status_code == 201:
+                    self.flood_cases.append(response.json()["case_id"])
+                if self.flood_cases:
+                    held.append(asyncio.create_task(self.flood_stream(self.random.choice(self.flood_cases))))
+                    # Rejected streams end at once, held ones at the end of the run
+                    await asyncio.sleep(0)
+                    held = [task for task in held if not task.done()]
+        finally:
+            for task in held:
+                task.cancel()
+            await asyncio.gather(*held, return_exceptions=True)
+
+    async def flood_stream(self, case_id: str):
+        try:
+            async with self.http.stream("GET", f"/api/cases/{case_id}/stream", params={"token": self.tokens[FLOODER]}) as response:
+                self.flood_responses[f"stream {response.status_code}"] += 1
+                if response.status_code >= 400:
+                    return
+                async for line in response.aiter_lines():
+                    if line.startswith("data: ") and json.loads(line[6:])["type"] in ("done", "timeout", "error", "replaced"):
+                        self.flood_responses[f"stream {json.loads(line[6:])['type']}"] += 1
+                        break
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.flood_responses["stream error"] += 1
+
+    async def pause(self, seconds: float):
+        try:
+            await asyncio.wait_for(self.stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def load(self, duration: float) -> float:
+        """Run the mixed traffic for `duration` seconds. Returns the elapsed time."""
+        tasks = [asyncio.create_task(self.creator())]
+        tasks += [asyncio.create_task(self.stream_client()) for _ in range(self.args.streams)]
+        tasks += [asyncio.create_task(self.lister()) for _ in range(self.args.listers)]
+        tasks += [asyncio.create_task(self.opener()) for _ in range(self.args.openers)]
+        tasks += [asyncio.create_task(self.flooder()) for _ in range(self.args.flooders)]
+        start = time.perf_counter()
+        await asyncio.sleep(duration)
+        self.stopping.set()
+        elapsed = time.perf_counter() - start
+        # Streams following a case are cut at the grace period
+        await asyncio.wait(tasks, timeout=self.args.grace)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return elapsed
+
+
+def seed_export(agent: FakeAgent, count: int) -> int:
+    """Write `count` finished cases of EXPORT_USER with multi-row INSERTs. Returns the rows written."""
+    import database
+    from sqlalchemy import insert
+    from sqlmodel import Session
+    written = 0
+    started_at = datetime.utcnow()
+    with Session(database.get_engine()) as db:
+        for start in range(0, count, EXPORT_SEED_BATCH):
+            cases, messages, sources, snippets = [], [], [], []
+            for i in range(start, min(count, start + EXPORT_SEED_BATCH)):
+                case_id = f"bench-export-{i}"
+                created_at = started_at + timedelta(microseconds=i)
+                cases.append({
+                    "case_id": case_id, "user_id": EXPORT_USER, "status": "COMPLETED",
+                    "data_json": {"title": agent.text(8)}, "created_at": created_at, "updated_at": created_at,
+                })
+                messages += [
+                    {
+                        "message_id": f"{case_id}-m{j}", "case_id": case_id, "user_id": EXPORT_USER,
+                        "message_data_json": {"text": agent.text(100), "stage": "thinking", "message_type": "AGENT"},
+                        "created_at": created_at,
+                    }
+                    for j in range(agent.messages)
+                ]
+                for j in range(agent.snippets):
+                    source, data = database.split_snippet_data({**agent.random.choice(agent.sources), "index": j})
+                    sources.append(source)
+                    snippets.append({
+                        "snippet_id": f"{case_id}-s{j}", "case_id": case_id, "source_hash": source["source_hash"],
+                        "snippet_data_json": data, "created_at": created_at,
+                    })
+            db.execute(insert(database.ClinicalCase), cases)
+            if messages:
+                db.execute(insert(database.Message), messages)
+            if snippets:
+                db.connection().execute(database.source_upsert(db.bind.dialect.name), database.unique_sources(sources))
+                db.execute(insert(database.EvidenceSnippet), snippets)
+            db.commit()
+            written += len(cases) + len(messages) + len(snippets)
+    return written
+
+
+def measure_export(cases: int, rows: int) -> dict:
+    """Export the EXPORT_USER cases with `export.py` in child processes, and time per-case reads for comparison."""
+    import database
+    from sqlmodel import Session
+    report = {"cases": cases, "rows": rows}
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "export.py")
+    with tempfile.TemporaryDirectory(prefix="bench-export-") as directory:
+        for name, filename in (("ndjson", "cases.ndjson"), ("ndjson_gzip", "cases.ndjson.gz")):
+            path = os.path.join(directory, filename)
+            start = time.perf_counter()
+            process = subprocess.Popen([sys.executable, script, "--user", EXPORT_USER, "--output", path], stdout=sys.stderr)
+            # wait4 gives the resource usage of this child alone
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            elapsed = time.perf_counter() - start
+            if process.returncode != 0:
+                raise RuntimeError(f"export.py exited with {process.returncode}")
+            report[name] = {
+                # Including the start of the interpreter
+                "seconds": round(elapsed, 2),
+                "cases_per_second": round(cases / elapsed, 1),
+                "rows_per_second": round(rows / elapsed, 1),
+                "bytes": os.path.getsize(path),
+                "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+            }
+
+    sample = [f"bench-export-{i}" for i in range(min(cases, 100))]
+    start = time.perf_counter()
+    with Session(database.get_engine()) as db:
+        for case_id in sample:
+            database.get_case_full(db, case_id, EXPORT_USER)
+    elapsed = time.perf_counter() - start
+    report["get_case_full_per_case"] = {"cases": len(sample), "cases_per_second": round(len(sample) / elapsed, 1)}
+    return report
+
+
+def import_times() -> dict:
+    """
+    `python -X importtime -c "import server"` in a child process: the
+    cumulative import time of `server`, and the modules' own import time
+    summed by top-level package, largest first.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=directory, capture_output=True, text=True, check=True,
+    )
+    server_us = None
+    packages = Counter()
+    for line in result.stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        name = name.strip()
+        packages[name.split(".")[0]] += int(self_us)
+        if name == "server":
+            server_us = int(cumulative_us)
+    return {
+        "import_server_ms": round(server_us / 1000, 1),
+        "self_ms_by_package": {name: round(us / 1000, 1) for name, us in packages.most_common(10)},
+    }
+
+
+def cold_start() -> dict:
+    """
+    Milliseconds from starting `uvicorn server:app` in a fresh process to its
+    first /api/health response and its first GET /api/cases (the first one
+    using the database), then to the exit of `python -c "import server"`.
+    The child inherits the benchmark's database and Redis settings.
+    """
+    import socket
+    directory = os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import server"], cwd=directory, check=True)
+    report = {"import_server_process_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=directory, stdout=sys.stderr,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}") as http:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with {process.returncode}")
+                try:
+                    http.get("/api/health").raise_for_status()
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.005)
+            report["first_health_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            http.get("/api/cases", headers={"Authorization": f"Bearer {make_token('bench-user-0')}"}).raise_for_status()
+            report["first_cases_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    finally:
+        process.terminate()
+        process.wait()
+    return report
+
+
+def db_queries(routes) -> dict:
+    """Sum and count of SQL statements per request, per route, from the server's metrics."""
+    import metrics
+    return {
+        route: (
+            metrics.registry.get_sample_value("http_request_db_queries_sum", {"route": route}) or 0.0,
+            metrics.registry.get_sample_value("http_request_db_queries_count", {"route": route}) or 0.0,
+        )
+        for route in routes
+    }
+
+
+def configure(args):
+    """Point the application modules at the benchmark's database and Redis."""
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["SUPABASE_JWT_SECRET"] = JWT_SECRET
+    os.environ["SUPABASE_JWKS_URL"] = ""
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+    elif fakeredis is None:
+        sys.exit("fakeredis is not installed: pip install fakeredis, or pass --redis-url")
+
+
+def connect_redis(args):
+    """Redis clients of the publishers, the streams and the job queue."""
+    import events
+    import server
+    from redis import Redis
+    if args.redis_url:
+        server._redis_conn = Redis.from_url(args.redis_url)
+        return server._redis_conn
+    fake_server = fakeredis.FakeServer()
+    events._redis = fakeredis.FakeRedis(server=fake_server)
+    events._async_redis = fakeredis.FakeAsyncRedis(server=fake_server)
+    server._redis_conn = fakeredis.FakeRedis(server=fake_server)
+    return server._redis_conn
+
+
+@contextlib.asynccontextmanager
+async def serve(args):
+    """Run `server.app` with uvicorn on a local port, and yield an HTTP client of it."""
+    import server
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+    http_server = uvicorn.Server(config)
+    # The harness stops the server itself
+    http_server.install_signal_handlers = lambda: None
+    serving = asyncio.create_task(http_server.serve())
+    while not http_server.started:
+        if serving.done():
+            serving.result()
+        await asyncio.sleep(0.01)
+    port = http_server.servers[0].sockets[0].getsockname()[1]
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=httpx.Timeout(60.0)) as http:
+            yield http
+    finally:
+        http_server.should_exit = True
+        await serving
+
+
+def config_report(args) -> dict:
+    """Settings of a run, for its report."""
+    import database
+    return {
+        **{key: value for key, value in vars(args).items() if key not in ("database_url", "redis_url", "output")},
+        "database": database.database_dialect,
+        "redis": "redis" if args.redis_url else "fakeredis",
+        "python": platform.python_version(),
+    }
+
+
+async def run(args) -> dict:
+    started_at = datetime.now(timezone.utc).isoformat()
+    import server
+    import database
+    database.init_db()
+    connect_redis(args)
+    # In child processes: this one has imported everything already
+    startup = {**await asyncio.to_thread(cold_start), **await asyncio.to_thread(import_times)}
+
+    recorder = Recorder()
+    agent = FakeAgent(args.messages, args.snippets, args.message_rate, args.sources, args.seed, not args.unbuffered)
+    async with serve(args) as http:
+        await http.get("/api/health")
+
+        bench = Benchmark(args, http, recorder, agent)
+        await asyncio.to_thread(bench.seed, args.seed_cases)
+        memory = await bench.measure_stream_memory(args.memory_streams) if args.memory_streams else None
+
+        # Only the load phase counts
+        recorder.latencies.clear()
+        recorder.errors.clear()
+        queries_before = db_queries(ROUTES.values())
+
+        worker = make_worker(server.get_job_queue(), args.concurrency, agent)
+        working = asyncio.create_task(worker.run())
+        elapsed = await bench.load(args.duration)
+        worker.stopping.set()
+        for task in worker.tasks:
+            task.cancel()
+        await asyncio.gather(working, return_exceptions=True)
+        queries_after = db_queries(ROUTES.values())
+
+    export = None
+    if args.export_cases:
+        rows = await asyncio.to_thread(seed_export, agent, args.export_cases)
+        export = await asyncio.to_thread(measure_export, args.export_cases, rows)
+
+    operations = {}
+    for operation in ("create_case", "list_cases", "open_case", "stream", "stream_first_message"):
+        latencies = recorder.latencies.get(operation, [])
+        route = ROUTES.get(operation)
+        report = {
+            "count": len(latencies),
+            "errors": recorder.errors.get(operation, 0),
+            "throughput_per_second": round(len(latencies) / elapsed, 2),
+            "latency_ms": percentiles(latencies),
+        }
+        if route:
+            queries = queries_after[route][0] - queries_before[route][0]
+            requests = queries_after[route][1] - queries_before[route][1]
+            report["db_queries_per_request"] = round(queries / requests, 2) if requests else None
+        operations[operation] = report
+
+    return {
+        "started_at": started_at,
+        "config": config_report(args),
+        "startup": startup,
+        "stream_memory": memory,
+        "load": {
+            "duration_seconds": round(elapsed, 2),
+            "requests_per_second": round(sum(len(recorder.latencies.get(op, [])) for op in ("create_case", "list_cases", "open_case")) / elapsed, 2),
+            "operations": operations,
+            "streams": {
+                "clients": args.streams,
+                "completed": bench.streams_completed,
+                "events": dict(bench.stream_events),
+                "bytes": bench.stream_bytes,
+            },
+            "worker": {
+                "cases_completed": agent.cases_completed,
+                "messages_written": agent.messages_written,
+                "snippets_written": agent.snippets_written,
+            },
+            "flooders": {
+                "clients": args.flooders,
+                "cases_created": len(bench.flood_cases),
+                "responses": dict(sorted(bench.flood_responses.items())),
+            },
+        },
+        "export": export,
+    }
+
+
+# Focused measurements, run with --scenario instead of the load test
+SCENARIOS = {}
+
+
+def scenario(function):
+    """Register an async function of the parsed arguments returning its report, as a scenario."""
+    SCENARIOS[function.__name__.removeprefix("scenario_").replace("_", "-")] = function
+    return function
+
+
+async def follow_stream(http, case_id: str, token: str, opened: asyncio.Semaphore, frames: Optional[Counter] = None) -> Counter:
+    """
+    Read a case stream to its end. Returns its frames by type, keepalives as
+    "keepalive", and "bytes", counted into `frames` if given as they arrive.
+    """
+    frames = Counter() if frames is None else frames
+    async with http.stream("GET", f"/api/cases/{case_id}/stream", params={"token": token}) as response:
+        async for line in response.aiter_lines():
+            frames["bytes"] += len(line) + 1
+            if line.startswith(": keepalive"):
+                frames["keepalive"] += 1
+            if not line.startswith("data: "):
+                continue
+            event_type = json.loads(line[6:])["type"]
+            if not frames["status"]:
+                opened.release()
+            frames[event_type] += 1
+            if event_type in ("done", "timeout", "error", "replaced"):
+                break
+    return frames
+
+
+async def open_streams(http, cases: list[tuple[str, str]], frames: Optional[list[Counter]] = None) -> list[asyncio.Task]:
+    """
+    Open one stream per (case_id, user_id) and wait until each got its first
+    frame. The frames of the i-th stream are counted into frames[i] if given.
+    """
+    opened = asyncio.Semaphore(0)
+    tasks = [
+        asyncio.create_task(follow_stream(http, case_id, make_token(user_id), opened, frames[i] if frames else None))
+        for i, (case_id, user_id) in enumerate(cases)
+    ]
+    for _ in tasks:
+        await asyncio.wait_for(opened.acquire(), timeout=30)
+    return tasks
+
+
+def unlimited_streams():
+    """Lift the stream caps of `limits`, so a scenario can open many streams as one user."""
+    import limits
+    limits.STREAM_USER_LIMIT = limits.STREAM_GLOBAL_LIMIT = 0
+    limits.STREAM_OPEN_RATE = 0
+
+
+@scenario
+async def scenario_stream_queries(args) -> dict:
+    """
+    SQL statements per stream client while cases are written by the fake
+    agent: with events pushed through Redis pub/sub, and with the streams
+    polling the database as they did before pub/sub (the fallback used when
+    subscribing fails). --streams cases are written at once, each followed
+    by one client.
+    """
+    import database
+    import events
+    import server
+    from redis import asyncio as aioredis
+    unlimited_streams()
+    agent = FakeAgent(args.messages, args.snippets, args.message_rate, args.sources, args.seed)
+    route = ROUTES["stream"]
+    report = {}
+    async with serve(args) as http:
+        for mode in ("pubsub", "polling"):
+            subscriber = events._async_redis
+            if mode == "polling":
+                # Subscribing fails on a closed port, publishing still goes to the benchmark's Redis
+                events._async_redis = aioredis.from_url("redis://127.0.0.1:1/0")
+            cases = [(f"bench-{mode}-{uuid.uuid4()}", f"bench-user-{i}") for i in range(args.streams)]
+            for case_id, user_id in cases:
+                await asyncio.to_thread(agent.write, database.create_case, case_id, user_id, agent.text(8))
+                # An active job keeps the streams open, no worker runs it
+                server.get_job_queue().enqueue("worker.process_case", job_id=case_id, case_id=case_id, user_id=user_id, question="")
+            before = db_queries([route])[route]
+            start = time.perf_counter()
+            clients = await open_streams(http, cases)
+            await asyncio.gather(*(agent.run(case_id, user_id, "") for case_id, user_id in cases))
+            frames = await asyncio.gather(*clients)
+            elapsed = time.perf_counter() - start
+            after = db_queries([route])[route]
+            events._async_redis = subscriber
+            report[mode] = {
+                "clients": len(cases),
+                "seconds": round(elapsed, 2),
+                "frames_per_client": round(sum(sum(f[t] for t in f if t != "bytes") for f in frames) / len(cases), 1),
+                "db_queries_per_request": round((after[0] - before[0]) / (after[1] - before[1]), 2),
+            }
+    return report
+
+
+@scenario
+async def scenario_idle_streams(args) -> dict:
+    """
+    Cost of streams that wait: --streams streams held open for --duration
+    seconds on cases whose job is queued but never runs, with events pushed
+    through Redis pub/sub and with the streams polling the database. Frames,
+    bytes and SQL statements per stream-minute, counted from the moment
+    every stream got its first frame.
+    """
+    import database
+    import events
+    import server
+    from redis import asyncio as aioredis
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    unlimited_streams()
+    agent = FakeAgent(args.messages, args.snippets, args.message_rate, args.sources, args.seed)
+    statements = 0
+
+    def count_statement(*_):
+        nonlocal statements
+        statements += 1
+
+    report = {"keepalive_seconds": server.STREAM_KEEPALIVE_SECONDS}
+    async with serve(args) as http:
+        for mode in ("pubsub", "polling"):
+            subscriber = events._async_redis
+            if mode == "polling":
+                # Subscribing fails on a closed port, publishing still goes to the benchmark's Redis
+                events._async_redis = aioredis.from_url("redis://127.0.0.1:1/0")
+            cases = [(f"bench-idle-{mode}-{uuid.uuid4()}", f"bench-user-{i}") for i in range(args.streams)]
+            for case_id, user_id in cases:
+                await asyncio.to_thread(agent.write, database.create_case, case_id, user_id, agent.text(8))
+                # An active job keeps the streams open, no worker runs it
+                server.get_job_queue().enqueue("worker.process_case", job_id=case_id, case_id=case_id, user_id=user_id, question="")
+            frames = [Counter() for _ in cases]
+            clients = await open_streams(http, cases, frames)
+
+            opened = sum(frames, Counter())
+            statements = 0
+            event.listen(Engine, "after_cursor_execute", count_statement)
+            await asyncio.sleep(args.duration)
+            event.remove(Engine, "after_cursor_execute", count_statement)
+            idle = sum(frames, Counter())
+            idle.subtract(opened)
+            idle_statements = statements
+
+            for case_id, _ in cases:
+                await asyncio.to_thread(agent.write, database.update_case_status, case_id, "COMPLETED")
+            await asyncio.gather(*clients)
+            events._async_redis = subscriber
+            stream_minutes = len(cases) * args.duration / 60
+            report[mode] = {
+                "streams": len(cases),
+                "seconds": args.duration,
+                "frames_per_stream_minute": round(sum(idle[t] for t in idle if t != "bytes") / stream_minutes, 2),
+                "bytes_per_stream_minute": round(idle["bytes"] / stream_minutes, 1),
+                "db_queries_per_stream_minute": round(idle_statements / stream_minutes, 2),
+            }
+    return report
+
+
+async def measure_loop_lag(stopping: asyncio.Event, interval: float = 0.01) -> list[float]:
+    """How late a timer of `interval` seconds fires on the event loop, until `stopping` is set."""
+    lags = []
+    loop = asyncio.get_running_loop()
+    while not stopping.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - expected))
+    return lags
+
+
+@scenario
+async def scenario_event_loop_lag(args) -> dict:
+    """
+    Event loop lag and full-case open latency over --duration seconds of
+    --openers concurrent clients, with the database read through the async
+    engine as GET /api/cases/{case_id} does, and with the sync session used
+    directly in the async endpoint as before the async database layer (served
+    on a route added for the benchmark).
+    """
+    import database
+    import serialization
+    import server
+    from fastapi import Response
+    from sqlmodel import Session
+
+    async def sync_get_case(case_id: str, user_id: str = "bench-user-0"):
+        with Session(database.get_engine()) as db:
+            case_full = database.get_case_full(db, case_id, user_id)
+        return Response(serialization.dumps(case_full), media_type="application/json")
+
+    server.app.add_api_route("/bench/sync/cases/{case_id}", sync_get_case)
+    agent = FakeAgent(args.messages, args.snippets, args.message_rate, args.sources, args.seed)
+    bench = Benchmark(args, None, Recorder(), agent)
+    bench.users = bench.users[:1]
+    await asyncio.to_thread(bench.seed, args.seed_cases)
+    report = {}
+    async with serve(args) as http:
+        for mode, path in (("async", "/api/cases/{case_id}"), ("sync", "/bench/sync/cases/{case_id}")):
+            recorder = Recorder()
+            stopping = asyncio.Event()
+
+            async def opener():
+                while not stopping.is_set():
+                    case_id, user_id = bench.random.choice(bench.cases)
+                    await recorder.timed(mode, http.get(path.format(case_id=case_id), headers=bench.headers(user_id)))
+
+            lag = asyncio.create_task(measure_loop_lag(stopping))
+            openers = [asyncio.create_task(opener()) for _ in range(args.openers)]
+            await asyncio.sleep(args.duration)
+            stopping.set()
+            await asyncio.gather(*openers)
+            latencies = recorder.latencies[mode]
+            report[mode] = {
+                "requests_per_second": round(len(latencies) / args.duration, 1),
+                "errors": recorder.errors[mode],
+                "latency_ms": percentiles(latencies),
+                "loop_lag_ms": percentiles(await lag),
+            }
+    return report
+
+
+def time_calls(function, repeat: int) -> float:
+    """Median seconds of `repeat` calls of `function`."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return sorted(durations)[len(durations) // 2]
+
+
+@scenario
+async def scenario_hydration(args) -> dict:
+    """
+    `get_case_full` of cases of 10 to 10,000 messages (and a tenth as many
+    snippets) with CASE_HYDRATION=query and =orm: median time over 5 reads,
+    and whether both return the same document, with and without dedupe_sources.
+    """
+    import database
+    from sqlmodel import Session
+    agent = FakeAgent(args.messages, args.snippets, args.message_rate, args.sources, args.seed)
+    hydration = database.CASE_HYDRATION
+    report = {}
+    with Session(database.get_engine()) as db:
+        for messages in (10, 100, 1000, 10000):
+            case_id = f"bench-hydration-{uuid.uuid4()}"
+            write_case(db, agent, case_id, "bench-user-0", messages, messages // 10)
+            outputs = {}
+            timings = {}
+            for mode in ("query", "orm"):
+                database.CASE_HYDRATION = mode
+                outputs[mode] = [database.get_case_full(db, case_id, "bench-user-0", dedupe_sources=dedupe) for dedupe in (False, True)]
+                timings[mode] = time_calls(lambda: database.get_case_full(db, case_id, "bench-user-0"), 5)
+            database.CASE_HYDRATION = hydration
+            report[str(messages)] = {
+                "query_ms": round(timings["query"] * 1000, 2),
+                "orm_ms": round(timings["orm"] * 1000, 2),
+                "speedup": round(timings["orm"] / timings["query"], 2),
+                "identical": outputs["query"] == outputs["orm"],
+            }
+    return report
+
+
+@scenario
+async def scenario_pagination(args) -> dict:
+    """
+    Time to read a page of 50 case summaries at increasing depths of one
+    user's --size cases (default 1,000,000): by keyset, as GET /api/cases
+    does, and with OFFSET as the list was paged before. Median of 5 reads.
+    """
+    import database
+    from sqlalchemy import insert
+    from sqlmodel import Session
+    count = args.size or 1_000_000
+    user_id = "bench-pagination"
+    limit = 50
+    created = datetime.utcnow()
+    with Session(database.get_engine()) as db:
+        for start in range(0, count, 10_000):
+            db.execute(insert(database.ClinicalCase), [
+                {
+                    "case_id": f"bench-page-{i}", "user_id": user_id, "status": "COMPLETED",
+                    "data_json": {"title": f"case {i}"},
+                    "created_at": created + timedelta(milliseconds=i), "updated_at": created,
+                }
+                for i in range(start, min(count, start + 10_000))
+            ])
+            db.commit()
+
+        report = {}
+        for depth in sorted({0, 1_000, 10_000, 100_000, count // 2, count - limit}):
+            if depth < 0 or depth > count - limit:
+                continue
+            offset_query = database.case_summaries_query(user_id, limit).offset(depth)
+            offset_page = time_calls(lambda: db.exec(offset_query).all(), 5)
+            cursor = None
+            if depth:
+                last = db.exec(database.case_summaries_query(user_id, 1).offset(depth - 1)).first()
+                cursor = database.encode_cases_cursor(last.created_at, last.id)
+            keyset_query = database.case_summaries_query(user_id, limit, cursor)
+            keyset_page = time_calls(lambda: db.exec(keyset_query).all(), 5)
+            assert [row.case_id for row in db.exec(offset_query).all()] == [row.case_id for row in db.exec(keyset_query).all()]
+            report[str(depth)] = {
+                "keyset_ms": round(keyset_page * 1000, 2),
+                "offset_ms": round(offset_page * 1000, 2),
+            }
+    return {"cases": count, "page_size": limit, "depths": report}
+
+
+@scenario
+async def scenario_auth(args) -> dict:
+    """
+    Microseconds per `verify_jwt_token` call over 2,000 tokens: for tokens
+    found in the verified token cache, and for new HS256 and RS256 (JWKS)
+    tokens, which are decoded and verified. RS256 needs `cryptography`.
+    """
+    import auth
+
+    def per_call(tokens: list[str]) -> float:
+        start = time.perf_counter()
+        for token in tokens:
+            auth.verify_jwt_token(token)
+        return round((time.perf_counter() - start) / len(tokens) * 1e6, 1)
+
+    count = 2000
+    hs256 = [make_token(f"bench-auth-{uuid.uuid4()}") for _ in range(count)]
+    report = {"hs256_uncached_us": per_call(hs256), "cached_us": per_call(hs256)}
+    try:
+        from cryptography.hazmat.primitives.asymmetric import rsa
+    except ImportError:
+        report["rs256_uncached_us"] = None
+        return report
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    with tempfile.NamedTemporaryFile("w", suffix=".json") as jwks_file:
+        json.dump({"keys": [{**public, "kid": "bench", "alg": "RS256", "use": "sig"}]}, jwks_file)
+        jwks_file.flush()
+        auth.jwks = auth.JWKSKeySet(jwks_file.name, auth.JWKS_REFRESH_SECONDS)
+        rs256 = [
+            jwt.encode(
+                {"sub": f"bench-auth-{uuid.uuid4()}", "aud": "authenticated", "exp": int(time.time()) + 3600},
+                private_key, algorithm="RS256", headers={"kid": "bench"},
+            )
+            for _ in range(count)
+        ]
+        report["rs256_uncached_us"] = per_call(rs256)
+        report["rs256_cached_us"] = per_call(rs256)
+    return report
+
+
+@scenario
+async def scenario_write_buffer(args) -> dict:
+    """
+    Rows per second written for one case, --size messages (default 2,000)
+    and a tenth as many snippets as fast as possible: one transaction per
+    row, and through `CaseWriteBuffer` with its default batching.
+    """
+    import database
+    from sqlmodel import Session
+    from write_buffer import CaseWriteBuffer
+    agent = FakeAgent(args.messages, args.snippets, args.message_rate, args.sources, args.seed)
+    count = args.size or 2000
+    rows = [({"text": agent.text(100), "stage": "thinking", "message_type": "AGENT"}, {**agent.random.choice(agent.sources), "index": i}) for i in range(count)]
+    report = {}
+    for mode in ("single_row", "batched"):
+        case_id = f"bench-writes-{uuid.uuid4()}"
+        await asyncio.to_thread(agent.write, database.create_case, case_id, "bench-user-0", agent.text(8))
+        writes = CaseWriteBuffer(case_id, "bench-user-0") if mode == "batched" else UnbufferedWrites(case_id, "bench-user-0")
+
+        def write_all():
+            for i, (message, snippet) in enumerate(rows):
+                writes.add_message(f"{case_id}-m{i}", message)
+                if i % 10 == 9:
+                    writes.add_evidence_snippet(f"{case_id}-s{i}", snippet)
+            writes.update_case_status("COMPLETED")
+
+        start = time.perf_counter()
+        await asyncio.to_thread(write_all)
+        elapsed = time.perf_counter() - start
+        with Session(database.get_engine()) as db:
+            written = len(database.get_case_events(db, case_id))
+        report[mode] = {"rows": written, "seconds": round(elapsed, 2), "rows_per_second": round(written / elapsed, 1)}
+    return report
+
+
+@scenario
+async def scenario_case_reopen(args) -> dict:
+    """
+    GET /api/cases/{case_id} of --seed-cases finished cases, opened once
+    each per pass: uncached, from the Redis tier, from the local tier, and
+    revalidated with If-None-Match (304). Latency, bytes received and the
+    response cache counters of each pass.
+    """
+    from cache import case_cache
+    agent = FakeAgent(args.messages, args.snippets, args.message_rate, args.sources, args.seed)
+    bench = Benchmark(args, None, Recorder(), agent)
+    await asyncio.to_thread(bench.seed, args.seed_cases)
+    etags = {}
+    report = {}
+    async with serve(args) as http:
+        for mode in ("uncached", "redis", "local", "not_modified"):
+            if mode == "redis":
+                with case_cache.lock:
+                    case_cache.local.clear()
+            before = case_cache.stats()
+            recorder = Recorder()
+            received = 0
+            statuses = Counter()
+            for case_id, user_id in bench.cases:
+                headers = bench.headers(user_id)
+                if mode == "not_modified":
+                    headers["If-None-Match"] = etags[case_id]
+                response = await recorder.timed(mode, http.get(f"/api/cases/{case_id}", headers=headers))
+                if response is None:
+                    continue
+                statuses[response.status_code] += 1
+                received += len(response.content)
+                etags[case_id] = response.headers["etag"]
+            after = case_cache.stats()
+            report[mode] = {
+                "latency_ms": percentiles(recorder.latencies[mode]),
+                "errors": recorder.errors[mode],
+                "statuses": dict(statuses),
+                "bytes_received": received,
+                **{key: after[key] - before[key] for key in ("local_hits", "redis_hits", "etag_hits", "misses")},
+            }
+    report["hit_rate"] = round(case_cache.stats()["hit_rate"], 3)
+    return report
+
+
+@scenario
+async def scenario_serialization(args) -> dict:
+    """
+    Encoding the response of a case of --size messages (default 1,000) and
+    a tenth as many snippets, as GET /api/cases/{case_id} does: validated
+    through `CaseResponse` (the default), and written directly with json
+    and with orjson (FAST_SERIALIZATION=1). Median time over 20 encodings,
+    peak memory allocated by one, and size of the output.
+    """
+    import database
+    import serialization
+    import server
+    from sqlmodel import Session
+    agent = FakeAgent(args.messages, args.snippets, args.message_rate, args.sources, args.seed)
+    count = args.size or 1000
+    case_id = f"bench-serialization-{uuid.uuid4()}"
+    with Session(database.get_engine()) as db:
+        write_case(db, agent, case_id, "bench-user-0", count, count // 10)
+        case_full = database.get_case_full(db, case_id, "bench-user-0")
+
+    fast = serialization.FAST_SERIALIZATION
+
+    def dumps_with(fast_serialization: bool):
+        def dumps():
+            serialization.FAST_SERIALIZATION = fast_serialization
+            try:
+                return serialization.dumps(case_full)
+            finally:
+                serialization.FAST_SERIALIZATION = fast
+        return dumps
+
+    encoders = {
+        "validated": lambda: server.CaseResponse.model_validate(case_full).model_dump_json(exclude_unset=True).encode(),
+        "json": dumps_with(False),
+    }
+    if serialization.orjson is not None:
+        encoders["orjson"] = dumps_with(True)
+    report = {"messages": count, "snippets": count // 10}
+    expected = json.loads(encoders["json"]())
+    for name, encode in encoders.items():
+        tracemalloc.start()
+        body = encode()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report[name] = {
+            "ms": round(time_calls(encode, 20) * 1000, 2),
+            "peak_alloc_kb": round(peak / 1024, 1),
+            "bytes": len(body),
+            "identical": json.loads(body) == expected,
+        }
+    return report
+
+
+@scenario
+async def scenario_instrumentation(args) -> dict:
+    """
+    Overhead of the Prometheus instrumentation: --seed-cases finished cases
+    are listed (GET /api/cases) and opened with `dedupe_sources`, which
+    bypasses the response cache, one request at a time, with the metrics
+    middleware and SQL statement listeners in place and with both removed.
+    The modes alternate over 3 rounds. Median latency and process CPU time
+    per request, and the time to render /api/metrics.
+    """
+    import metrics
+    import server
+    from sqlalchemy.engine import Engine
+    agent = FakeAgent(args.messages, args.snippets, args.message_rate, args.sources, args.seed)
+    bench = Benchmark(args, None, Recorder(), agent)
+    bench.users = bench.users[:1]
+    await asyncio.to_thread(bench.seed, args.seed_cases)
+    middleware = next(m for m in server.app.user_middleware if m.cls is metrics.MetricsMiddleware)
+    position = server.app.user_middleware.index(middleware)
+
+    def instrument(enabled: bool):
+        if enabled:
+            server.app.user_middleware.insert(position, middleware)
+            metrics.instrument_engine(Engine)
+        else:
+            server.app.user_middleware.remove(middleware)
+            metrics.uninstrument_engine(Engine)
+        # Rebuilt on the next request
+        server.app.middleware_stack = None
+
+    latencies = defaultdict(list)
+    cpu = Counter()
+    async with serve(args) as http:
+        for _ in range(3):
+            for mode in ("instrumented", "bare"):
+                if mode == "bare":
+                    instrument(False)
+                cpu_start = time.process_time()
+                for case_id, user_id in bench.cases:
+                    for path, params in (("/api/cases", {}), (f"/api/cases/{case_id}", {"dedupe_sources": "true"})):
+                        start = time.perf_counter()
+                        response = await http.get(path, params=params, headers=bench.headers(user_id))
+                        response.raise_for_status()
+                        latencies[mode].append(time.perf_counter() - start)
+                cpu[mode] += time.process_time() - cpu_start
+                if mode == "bare":
+                    instrument(True)
+
+    report = {"requests": len(latencies["bare"])}
+    for mode, values in latencies.items():
+        report[mode] = {
+            "latency_ms": percentiles(values),
+            "cpu_us_per_request": round(cpu[mode] / len(values) * 1e6, 1),
+        }
+    report["overhead_us_per_request"] = round(
+        (cpu["instrumented"] - cpu["bare"]) / len(latencies["bare"]) * 1e6, 1
+    )
+    report["render_metrics_ms"] = round(time_calls(metrics.render, 20) * 1000, 2)
+    return report
+
+
+@scenario
+async def scenario_bulk_create(args) -> dict:
+    """
+    Cases created per second, --size cases (default 1,000) one request at a
+    time: one POST /api/create_case per case, and POST /api/create_cases
+    with 100 cases per request and an Idempotency-Key. The creation rate
+    limit is lifted. SQL statements per case, from the server's metrics.
+    """
+    import limits
+    limits.CREATE_CASE_RATE = 0
+    agent = FakeAgent(args.messages, args.snippets, args.message_rate, args.sources, args.seed)
+    count = args.size or 1000
+    batch = 100
+    headers = {"Authorization": f"Bearer {make_token('bench-user-0')}"}
+    routes = {"single": "/api/create_case", "bulk": "/api/create_cases"}
+    questions = [agent.text(30) for _ in range(count)]
+    report = {"cases": count, "batch_size": batch}
+    async with serve(args) as http:
+        for mode, route in routes.items():
+            before = db_queries([route])[route]
+            start = time.perf_counter()
+            if mode == "single":
+                for question in questions:
+                    response = await http.post(route, json={"question": question}, headers=headers)
+                    response.raise_for_status()
+            else:
+                for i in range(0, count, batch):
+                    response = await http.post(
+                        route,
+                        json={"cases": [{"question": question} for question in questions[i:i + batch]]},
+                        headers={**headers, "Idempotency-Key": str(uuid.uuid4())},
+                    )
+                    response.raise_for_status()
+            elapsed = time.perf_counter() - start
+            after = db_queries([route])[route]
+            report[mode] = {
+                "seconds": round(elapsed, 2),
+                "cases_per_second": round(count / elapsed, 1),
+                "db_queries_per_case": round((after[0] - before[0]) / count, 3),
+            }
+    return report
+
+
+def serve_mock_llm(port: int, seconds: float):
+    """
+    Serve a mock OpenAI-compatible LLM on a local port: POST
+    /v1/chat/completions answers after `seconds` with 20 to 200 words.
+    """
+    from fastapi import FastAPI
+    app = FastAPI()
+    words = random.Random(port)
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(body: dict):
+        await asyncio.sleep(seconds)
+        content = " ".join(words.choice(WORDS) for _ in range(words.randint(20, 200)))
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        }
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+
+
+@contextlib.contextmanager
+def helper_process(target, *args):
+    """
+    Run `target(port, *args)` in a child process serving on a free local
+    port. Yields the port and the child's pid once it accepts connections.
+    """
+    import multiprocessing
+    import socket
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = multiprocessing.get_context("spawn").Process(target=target, args=(port, *args), daemon=True)
+    process.start()
+    try:
+        while True:
+            if not process.is_alive():
+                raise RuntimeError(f"{target.__name__} exited with {process.exitcode}")
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.01)
+        yield port, process.pid
+    finally:
+        process.kill()
+        process.join()
+
+
+def llm_request(question: str, i: int) -> dict:
+    return {"model": "mock", "messages": [{"role": "user", "content": f"{question} (step {i})"}]}
+
+
+def llm_source(case_id: str, index: int, text: str) -> dict:
+    """An evidence snippet citing one of 50 sources, quoting the LLM's answer."""
+    source = random.Random(f"{case_id}-{index}").randrange(50)
+    return {
+        "source_id": f"PMID{10000000 + source}", "text": text, "source_type": "pubmed",
+        "source_url": f"https://pubmed.ncbi.nlm.nih.gov/{10000000 + source}/", "index": index,
+    }
+
+
+def llm_case(case_id: str, user_id: str, question: str, llm_url: str, messages: int, snippets: int):
+    """
+    Job of a sync agent, as `worker.process_case` is: asks the mock LLM
+    for every message of the case with blocking calls, and writes its
+    output through a `write_buffer.CaseWriteBuffer`.
+    """
+    from write_buffer import CaseWriteBuffer
+    every = max(1, messages // snippets) if snippets else 0
+    with httpx.Client(base_url=llm_url, timeout=60.0) as llm, CaseWriteBuffer(case_id, user_id) as writes:
+        writes.update_case_status("PROCESSING")
+        for i in range(messages):
+            response = llm.post("/v1/chat/completions", json=llm_request(question, i))
+            text = response.raise_for_status().json()["choices"][0]["message"]["content"]
+            writes.add_message(f"{case_id}-m{i}", {"text": text, "stage": "thinking", "message_type": "AGENT"})
+            if every and i % every == every - 1 and i // every < snippets:
+                writes.add_evidence_snippet(f"{case_id}-s{i // every}", llm_source(case_id, i // every, text[:500]))
+        writes.update_case_status("COMPLETED")
+
+
+def async_llm_case(case_id: str, user_id: str, question: str, llm_url: str, messages: int, snippets: int):
+    """The job of `async_llm_case_async` for workers without coroutine support."""
+    llm_case(case_id, user_id, question, llm_url, messages, snippets)
+
+
+async def async_llm_case_async(case_id: str, user_id: str, question: str, llm_url: str, messages: int, snippets: int):
+    """`llm_case` as a coroutine, as `worker.process_case_async` would be."""
+    from write_buffer import CaseWriteBuffer
+    every = max(1, messages // snippets) if snippets else 0
+    writes = CaseWriteBuffer(case_id, user_id)
+    async with httpx.AsyncClient(base_url=llm_url, timeout=60.0) as llm:
+        try:
+            await asyncio.to_thread(writes.update_case_status, "PROCESSING")
+            for i in range(messages):
+                response = await llm.post("/v1/chat/completions", json=llm_request(question, i))
+                text = response.raise_for_status().json()["choices"][0]["message"]["content"]
+                await asyncio.to_thread(writes.add_message, f"{case_id}-m{i}", {"text": text, "stage": "thinking", "message_type": "AGENT"})
+                if every and i % every == every - 1 and i // every < snippets:
+                    await asyncio.to_thread(writes.add_evidence_snippet, f"{case_id}-s{i // every}", llm_source(case_id, i // every, text[:500]))
+            await asyncio.to_thread(writes.update_case_status, "COMPLETED")
+        finally:
+            await asyncio.to_thread(writes.close)
+
+
+def process_tree(pid: int) -> list[int]:
+    """A process and all its descendants, Linux only."""
+    pids = [pid]
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{tid}/children") as children:
+                for child in children.read().split():
+                    pids += process_tree(int(child))
+        except FileNotFoundError:
+            pass
+    return pids
+
+
+def memory_pss(pids: list[int]) -> int:
+    """
+    Proportional set size of processes in bytes, Linux only: pages shared
+    between them are counted once in total, not once per process.
+    """
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/smaps_rollup") as rollup:
+                total += next(int(line.split()[1]) * 1024 for line in rollup if line.startswith("Pss:"))
+        except (FileNotFoundError, ProcessLookupError):
+            # Exited since it was listed
+            pass
+    return total
+
+
+async def measure_density(args, func_name: str, processes: bool, concurrency: int, llm_url: str) -> dict:
+    """Run --size cases through an async worker and measure its throughput and memory."""
+    import async_worker
+    import database
+    import server
+    from rq import Queue
+    from rq.registry import FinishedJobRegistry
+    from sqlmodel import Session
+    count = args.size or 200
+    queue = Queue(f"bench-density-{uuid.uuid4().hex}", connection=server.get_redis_conn())
+    case_ids = [f"bench-density-{uuid.uuid4()}" for _ in range(count)]
+
+    def create_cases():
+        with Session(database.get_engine()) as db:
+            for i, case_id in enumerate(case_ids):
+                database.create_case(db, case_id, f"bench-user-{i % args.users}", "density")
+
+    await asyncio.to_thread(create_cases)
+    for i, case_id in enumerate(case_ids):
+        queue.enqueue(func_name, job_id=case_id, case_id=case_id, user_id=f"bench-user-{i % args.users}",
+                      question="density", llm_url=llm_url, messages=args.messages, snippets=args.snippets)
+
+    def worker_memory() -> int:
+        return memory_pss(process_tree(os.getpid()))
+
+    stopping = asyncio.Event()
+
+    async def sample_memory() -> int:
+        peak = await asyncio.to_thread(worker_memory)
+        while not stopping.is_set():
+            await asyncio.sleep(0.1)
+            peak = max(peak, await asyncio.to_thread(worker_memory))
+        return peak
+
+    baseline = await asyncio.to_thread(worker_memory)
+    sampling = asyncio.create_task(sample_memory())
+    start = time.perf_counter()
+    await async_worker.AsyncCaseWorker(queue, concurrency, processes).run(burst=True)
+    elapsed = time.perf_counter() - start
+    stopping.set()
+    peak = await sampling
+    completed = FinishedJobRegistry(queue=queue).count
+    cases_per_minute = completed / elapsed * 60
+    return {
+        "completed": completed,
+        "seconds": round(elapsed, 2),
+        "cases_per_minute": round(cases_per_minute, 1),
+        "peak_memory_mb": round(peak / 2**20, 1),
+        "memory_growth_mb": round((peak - baseline) / 2**20, 1),
+        "cases_per_minute_per_gb": round(cases_per_minute / (peak / 2**30), 1),
+    }
+
+
+def density_run(args, func_name: str, processes: bool, concurrency: int, llm_url: str, results):
+    """`measure_density` in a fresh process, so that earlier runs do not add to its memory. Sends the report on `results`."""
+    # Logs go to stderr, as in the benchmark's own process
+    sys.stdout = sys.stderr
+    connect_redis(args)
+    results.send(asyncio.run(measure_density(args, func_name, processes, concurrency, llm_url)))
+    results.close()
+
+
+@scenario
+async def scenario_worker_density(args) -> dict:
+    """
+    Cases per minute per GB of worker memory: --size cases (default 200)
+    processed by the async worker at a concurrency of 10, 50 and 200. Each
+    case asks a mock LLM server, which answers after 1/--message-rate
+    seconds, for each of its --messages messages. Three kinds of job go
+    through `async_worker.resolve_job_function` as `worker.process_case`
+    would: a coroutine, a sync function on the worker's threads, and with
+    --redis-url a sync function in child processes (--processes, at 10 and
+    50 only: one interpreter per case), which cannot share fakeredis.
+    Each run has a fresh worker process. Memory is its proportional set size
+    with its children, sampled every 100 ms (Linux). The mock LLM runs in a
+    process of its own.
+    """
+    import multiprocessing
+    context = multiprocessing.get_context("spawn")
+    report = {"cases": args.size or 200, "seconds_per_case": round(args.messages / args.message_rate, 2)}
+    modes = {
+        "coroutine": ("bench.async_llm_case", False, (10, 50, 200)),
+        "thread": ("bench.llm_case", False, (10, 50, 200)),
+        "process": ("bench.llm_case", True, (10, 50)),
+    }
+    with helper_process(serve_mock_llm, 1 / args.message_rate) as (llm_port, _):
+        for mode, (func_name, processes, concurrencies) in modes.items():
+            if processes and not args.redis_url:
+                report[mode] = {"skipped": "child processes cannot share fakeredis, pass --redis-url"}
+                continue
+            report[mode] = {}
+            for concurrency in concurrencies:
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(
+                    target=density_run, args=(args, func_name, processes, concurrency, f"http://127.0.0.1:{llm_port}", sender)
+                )
+                process.start()
+                sender.close()
+                try:
+                    report[mode][str(concurrency)] = await asyncio.to_thread(receiver.recv)
+                finally:
+                    receiver.close()
+                    process.join()
+    return report
+
+
+@scenario
+async def scenario_time_to_start(args) -> dict:
+    """
+    Seconds from submission to the start of a case, by lane, with cases
+    enqueued straight onto the job queue and through the scheduler: one user
+    submits --size batch cases (default 500) at once, then the --users users
+    create 20 interactive cases, one every 0.5 s. The scheduler's dispatcher
+    runs in process. Each mode ends once every interactive case has started.
+    """
+    import database
+    import scheduler
+    import server
+    from rq import Queue
+    agent = FakeAgent(args.messages, args.snippets, args.message_rate, args.sources, args.seed, buffered=not args.unbuffered)
+    count = args.size or 500
+    interactive = 20
+    report = {
+        "batch_cases": count,
+        "interactive_cases": interactive,
+        "concurrency": args.concurrency,
+        "seconds_per_case": round(args.messages / args.message_rate, 2),
+        "user_inflight": scheduler.SCHEDULER_USER_INFLIGHT,
+        "interactive_inflight": scheduler.SCHEDULER_INTERACTIVE_INFLIGHT,
+    }
+    for mode in ("queue", "scheduler"):
+        queue = Queue(f"bench-time-to-start-{mode}", connection=server.get_redis_conn())
+        case_scheduler = scheduler.Scheduler(queue)
+        submitted, started = {}, {}
+
+        class StartTimes:
+            async def run(self, case_id: str, user_id: str, question: str):
+                started[case_id] = time.perf_counter()
+                await agent.run(case_id, user_id, question)
+
+        async def submit(lane: str, user_id: str, case_ids: list[str]):
+            for case_id in case_ids:
+                await asyncio.to_thread(agent.write, database.create_case, case_id, user_id, "")
+            now = time.perf_counter()
+            submitted.update((case_id, (lane, now)) for case_id in case_ids)
+            if mode == "scheduler":
+                await asyncio.to_thread(case_scheduler.submit, lane, user_id, [(case_id, "") for case_id in case_ids])
+            else:
+                for case_id in case_ids:
+                    queue.enqueue("worker.process_case", job_id=case_id, case_id=case_id, user_id=user_id, question="",
+                                  job_timeout=scheduler.JOB_TIMEOUT)
+
+        stopping = asyncio.Event()
+
+        async def dispatch():
+            while not stopping.is_set():
+                await asyncio.to_thread(case_scheduler.release_ended)
+                await asyncio.to_thread(case_scheduler.dispatch)
+                await asyncio.sleep(scheduler.DISPATCH_INTERVAL)
+
+        await submit(scheduler.BATCH, FLOODER, [f"bench-batch-{uuid.uuid4()}" for _ in range(count)])
+        worker = make_worker(queue, args.concurrency, StartTimes())
+        working = asyncio.create_task(worker.run())
+        dispatching = asyncio.create_task(dispatch()) if mode == "scheduler" else None
+        interactive_ids = [f"bench-interactive-{uuid.uuid4()}" for _ in range(interactive)]
+        for i, case_id in enumerate(interactive_ids):
+            await submit(scheduler.INTERACTIVE, f"bench-user-{i % args.users}", [case_id])
+            await asyncio.sleep(0.5)
+        while not all(case_id in started for case_id in interactive_ids):
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - submitted[interactive_ids[0]][1]
+
+        stopping.set()
+        worker.stopping.set()
+        for task in worker.tasks:
+            task.cancel()
+        await asyncio.gather(working, *([dispatching] if dispatching else []), return_exceptions=True)
+        waits = {scheduler.INTERACTIVE: [], scheduler.BATCH: []}
+        for case_id, start in started.items():
+            lane, at = submitted[case_id]
+            waits[lane].append(start - at)
+        report[mode] = {
+            "seconds": round(elapsed, 2),
+            **{lane: {"started": len(values), "time_to_start_ms": percentiles(values)} for lane, values in waits.items()},
+        }
+    return report
+
+
+@scenario
+async def scenario_evidence_storage(args) -> dict:
+    """
+    Storage and payload size of evidence with sources stored once: --size
+    cases (default 200) citing 30 snippets each from --sources sources, picked
+    with Zipf-like popularity as guidelines and landmark trials are. Compares
+    the snippet and source JSON stored with what inline snippets would take,
+    and the GET /api/cases/{id} payloads with and without dedupe_sources.
+    """
+    import database
+    from sqlmodel import Session, select
+    agent = FakeAgent(args.messages, args.snippets, args.message_rate, args.sources, args.seed)
+    count = args.size or 200
+    per_case = 30
+    weights = [1 / (rank + 1) for rank in range(len(agent.sources))]
+    case_ids = [f"bench-evidence-{uuid.uuid4()}" for _ in range(count)]
+
+    def seed():
+        with Session(database.get_engine()) as db:
+            for case_id in case_ids:
+                database.create_case(db, case_id, "bench-user-0", agent.text(8))
+                sources = agent.random.choices(agent.sources, weights=weights, k=per_case)
+                database.add_evidence_snippets_bulk(db, case_id, [
+                    (f"{case_id}-s{j}", {**source, "index": j}) for j, source in enumerate(sources)
+                ])
+
+    def measure() -> dict:
+        def size(value) -> int:
+            return len(json.dumps(value).encode())
+
+        with Session(database.get_engine()) as db:
+            snippets = db.exec(
+                select(database.EvidenceSnippet).where(database.EvidenceSnippet.case_id.in_(case_ids))
+            ).all()
+            hashes = {snippet.source_hash for snippet in snippets}
+            sources = db.exec(
+                select(database.EvidenceSource).where(database.EvidenceSource.source_hash.in_(hashes))
+            ).all()
+            # Before sources were shared, every snippet held the source fields
+            inline = sum(size({**snippet.source.source_data_json, **snippet.snippet_data_json}) for snippet in snippets)
+            shared = (
+                sum(size(snippet.snippet_data_json) + len(snippet.source_hash) for snippet in snippets)
+                + sum(size(source.source_data_json) + len(source.source_hash) for source in sources)
+            )
+            payloads = {
+                mode: sum(size(database.get_case_full(db, case_id, "bench-user-0", dedupe_sources=dedupe)) for case_id in case_ids)
+                for mode, dedupe in (("default", False), ("dedupe_sources", True))
+            }
+            unique_per_case = len({(snippet.case_id, snippet.source_hash) for snippet in snippets}) / count
+            report = {
+                "cases": count,
+                "snippets": len(snippets),
+                "sources": len(sources),
+                "unique_sources_per_case": round(unique_per_case, 1),
+                "evidence_json_mb": {
+                    "inline": round(inline / 2**20, 2),
+                    "shared": round(shared / 2**20, 2),
+                    "ratio": round(shared / inline, 3),
+                },
+                "payload_mb": {mode: round(total / 2**20, 2) for mode, total in payloads.items()},
+                "payload_ratio": round(payloads["dedupe_sources"] / payloads["default"], 3),
+            }
+            if database.database_dialect == "postgresql":
+                from sqlalchemy import text
+                report["table_mb"] = {
+                    table: round(db.exec(text(f"SELECT pg_total_relation_size('{table}')")).scalar() / 2**20, 2)
+                    for table in ("evidence_snippets", "evidence_sources")
+                }
+            return report
+
+    await asyncio.to_thread(seed)
+    return await asyncio.to_thread(measure)
+
+
+@scenario
+async def scenario_search(args) -> dict:
+    """
+    GET /api/search latency at scale: --size cases (default 100,000) of
+    --messages messages each (100 for 10M messages), spread over --users
+    users. Messages are 20 words of the fake agent's vocabulary, so every
+    word of it matches about half of them, plus one of 10,000 rare terms.
+    Times the first and the fifth page of one user's results for a rare term,
+    a common word and a two-word query, in process.
+    """
+    import database
+    from sqlalchemy import insert
+    from sqlmodel import Session
+    agent = FakeAgent(args.messages, args.snippets, args.message_rate, args.sources, args.seed)
+    count = args.size or 100_000
+    batch = 100
+    users = [f"bench-search-{i}" for i in range(args.users)]
+    started_at = datetime.utcnow()
+
+    def seed() -> float:
+        start = time.perf_counter()
+        with Session(database.get_engine()) as db:
+            for first in range(0, count, batch):
+                cases, messages = [], []
+                for i in range(first, min(count, first + batch)):
+                    case_id, user_id = f"bench-search-{i}", users[i % len(users)]
+                    created_at = started_at + timedelta(microseconds=i)
+                    cases.append({
+                        "case_id": case_id, "user_id": user_id, "status": "COMPLETED",
+                        "data_json": {"title": agent.text(8)}, "created_at": created_at, "updated_at": created_at,
+                    })
+                    messages += [
+                        {
+                            "message_id": f"{case_id}-m{j}", "case_id": case_id, "user_id": user_id,
+                            "message_data_json": {
+                                "text": f"{agent.text(20)} term{agent.random.randrange(10_000)}",
+                                "stage": "thinking", "message_type": "AGENT",
+                            },
+                            "created_at": created_at,
+                        }
+                        for j in range(args.messages)
+                    ]
+                db.execute(insert(database.ClinicalCase), cases)
+                db.execute(insert(database.Message), messages)
+                db.commit()
+        return time.perf_counter() - start
+
+    def measure(q: str, repeat: int = 5) -> dict:
+        timings = {"first_page": [], "fifth_page": []}
+        with Session(database.get_engine()) as db:
+            dialect = db.bind.dialect.name
+            for _ in range(repeat):
+                cursor = None
+                for page in range(5):
+                    start = time.perf_counter()
+                    rows = db.exec(database.search_query(dialect, users[0], q, 20, cursor)).all()
+                    _, cursor = database.build_search_results(rows, 20)
+                    if page == 0:
+                        timings["first_page"].append(time.perf_counter() - start)
+                    if page == 4:
+                        timings["fifth_page"].append(time.perf_counter() - start)
+                    if cursor is None:
+                        break
+        return {page: percentiles(values) for page, values in timings.items()}
+
+    seconds = await asyncio.to_thread(seed)
+    if database.database_dialect == "postgresql":
+        with database.get_engine().begin() as connection:
+            connection.exec_driver_sql("ANALYZE")
+    queries = {"rare": "term42", "common": "fever", "two_words": "chest pain"}
+    return {
+        "cases": count,
+        "messages": count * args.messages,
+        "users": len(users),
+        "seed_seconds": round(seconds, 1),
+        "queries": {name: {"q": q, **await asyncio.to_thread(measure, q)} for name, q in queries.items()},
+    }
+
+
+@scenario
+async def scenario_cold_start(args) -> dict:
+    """
+    Startup of fresh processes, --size runs (default 5): the exit of
+    `python -c "import server"`, the first /api/health and GET /api/cases
+    responses of `uvicorn server:app`, and `-X importtime` of `server` with
+    the modules' own import time by package (from the last run).
+    """
+    runs = args.size or 5
+    samples = defaultdict(list)
+    for _ in range(runs):
+        for key, value in {**await asyncio.to_thread(cold_start), **await asyncio.to_thread(import_times)}.items():
+            samples[key].append(value)
+    report = {"runs": runs}
+    for key, values in samples.items():
+        if key == "self_ms_by_package":
+            report[key] = values[-1]
+        else:
+            ordered = sorted(values)
+            report[key] = {"median": ordered[len(ordered) // 2], "min": ordered[0], "max": ordered[-1]}
+    return report
+
+
+@scenario
+async def scenario_generated_columns(args) -> dict:
+    """
+    PostgreSQL only. Median time over 5 reads of `messages_by_stage_query`
+    (one stage of a case) and `snippets_by_source_query` (a source across
+    all of a user's cases) over --size cases (default 1,000) of --messages
+    messages and --snippets snippets: filtering on the indexed generated
+    columns, and on the same fields extracted from the JSON blobs.
+    """
+    import database
+    from sqlmodel import Session
+    if database.database_dialect != "postgresql":
+        return {"skipped": "generated columns only exist on PostgreSQL"}
+
+    def json_field(model, name: str):
+        json_column, key, integer = database.HOT_FIELDS[(model, name)]
+        value = getattr(model, json_column)[key]
+        return value.as_integer() if integer else value.as_string()
+
+    agent = FakeAgent(args.messages, args.snippets, args.message_rate, args.sources, args.seed)
+    count = args.size or 1000
+    user_id = f"bench-generated-{uuid.uuid4()}"
+    stages = ("planning", "searching", "thinking", "writing", "review")
+    with Session(database.get_engine()) as db:
+        for i in range(count):
+            case_id = f"{user_id}-{i}"
+            database.create_case(db, case_id, user_id, agent.text(8))
+            database.add_messages_bulk(db, case_id, user_id, [
+                (f"{case_id}-m{j}", {"text": agent.text(50), "stage": stages[j % len(stages)], "message_type": "AGENT"})
+                for j in range(args.messages)
+            ])
+            database.add_evidence_snippets_bulk(db, case_id, [
+                (f"{case_id}-s{j}", {**agent.random.choice(agent.sources), "index": j})
+                for j in range(args.snippets)
+            ])
+        db.connection().exec_driver_sql("ANALYZE")
+
+        case_id = f"{user_id}-{count // 2}"
+        source_id = agent.sources[0]["source_id"]
+        report = {"cases": count, "messages": count * args.messages, "snippets": count * args.snippets}
+        hot_field = database.hot_field
+        queries = {
+            "messages_by_stage": lambda: database.messages_by_stage_query(case_id, "review", user_id),
+            "snippets_by_source": lambda: database.snippets_by_source_query(user_id, source_id),
+        }
+        for name, build in queries.items():
+            generated = build()
+            try:
+                database.hot_field = json_field
+                extracted = build()
+            finally:
+                database.hot_field = hot_field
+            rows = {}
+            timings = {}
+            for mode, statement in (("generated", generated), ("json", extracted)):
+                rows[mode] = [row.id for row in db.exec(statement).unique().all()]
+                timings[mode] = time_calls(lambda: db.exec(statement).unique().all(), 5)
+            report[name] = {
+                "rows": len(rows["generated"]),
+                "generated_ms": round(timings["generated"] * 1000, 2),
+                "json_ms": round(timings["json"] * 1000, 2),
+                "speedup": round(timings["json"] / timings["generated"], 2),
+                "identical": rows["generated"] == rows["json"],
+            }
+    return report
+
+
+async def run_scenario(args) -> dict:
+    import database
+    started_at = datetime.now(timezone.utc).isoformat()
+    database.init_db()
+    connect_redis(args)
+    return {
+        "started_at": started_at,
+        "scenario": args.scenario,
+        "config": config_report(args),
+        "result": await SCENARIOS[args.scenario](args),
+    }
+
+
+def main():
+    """Run the benchmark and print its JSON report."""
+    parser = argparse.ArgumentParser(description="Benchmark the API under mixed traffic with local stand-ins")
+    parser.add_argument("--database-url", default=None, help="scratch database, default: a new SQLite file")
+    parser.add_argument("--redis-url", default=None, help="local redis-server, default: fakeredis")
+    parser.add_argument("--port", type=int, default=0, help="port of the server, default: any free port")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of mixed traffic")
+    parser.add_argument("--grace", type=float, default=5.0, help="seconds given to open streams after the load phase")
+    parser.add_argument("--users", type=int, default=20, help="simulated users")
+    parser.add_argument("--seed-cases", type=int, default=200, help="finished cases written before the load phase")
+    parser.add_argument("--burst-size", type=int, default=10, help="cases created per burst")
+    parser.add_argument("--burst-interval", type=float, default=2.0, help="seconds between bursts")
+    parser.add_argument("--streams", type=int, default=50, help="concurrent /stream clients")
+    parser.add_argument("--listers", type=int, default=5, help="concurrent /api/cases clients")
+    parser.add_argument("--openers", type=int, default=10, help="concurrent full-case clients")
+    parser.add_argument("--flooders", type=int, default=0, help="clients of one user creating cases and opening streams without pause")
+    parser.add_argument("--export-cases", type=int, default=0, help="finished cases written and exported after the load phase, 0 to skip")
+    parser.add_argument("--think-time", type=float, default=0.1, help="seconds between requests of a listing or opening client")
+    parser.add_argument("--memory-streams", type=int, default=100, help="idle streams opened to measure memory per stream, 0 to skip")
+    parser.add_argument("--concurrency", type=int, default=50, help="cases processed at once by the fake worker")
+    parser.add_argument("--messages", type=int, default=30, help="messages per case")
+    parser.add_argument("--snippets", type=int, default=10, help="evidence snippets per case")
+    parser.add_argument("--message-rate", type=float, default=10.0, help="messages per second written per case")
+    parser.add_argument("--unbuffered", action="store_true", help="write each row of the fake agent in its own transaction, without the write buffer")
+    parser.add_argument("--sources", type=int, default=500, help="distinct evidence sources cited across cases")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    parser.add_argument("--size", type=int, default=None, help="scale of the scenario, see its description")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default=None, help="run this focused measurement instead of the load test")
+    parser.add_argument("--output", default=None, help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    scratch = None
+    if args.database_url is None:
+        scratch = tempfile.mkdtemp(prefix="bench-")
+        args.database_url = f"sqlite:///{os.path.join(scratch, 'bench.db')}"
+    configure(args)
+
+    # Logs of the server and the worker go to stderr, the report to stdout
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            report = asyncio.run(run_scenario(args) if args.scenario else run(args))
+    finally:
+        if scratch is not None:
+            shutil.rmtree(scratch, ignore_errors=True)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"[Bench] Report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Read-through cache of serialized case responses.
+
+Finished cases (COMPLETED or ERROR) no longer change, but users reopen them
+constantly, and each open rebuilds and serializes the whole case. Their
+serialized `CaseResponse` is cached in two tiers:
+
+- Redis, shared by all uvicorn workers, holding the body, its ETag and owner.
+- An in-process LRU holding bodies by ETag, so a hit costs one small HMGET
+  instead of transferring the body.
+
+Writes to a case delete its Redis entry in the same round-trip that
+publishes the event (see `events`), which also invalidates every local tier
+since they are always validated against the ETag in Redis.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+from redis import RedisError
+import events
+
+CASE_CACHE_LOCAL_SIZE = int(os.getenv("CASE_CACHE_LOCAL_SIZE", "256"))
+# Upper bound on staleness should an invalidation be lost
+CASE_CACHE_TTL_SECONDS = int(os.getenv("CASE_CACHE_TTL_SECONDS", "3600"))
+
+# Only cases in these statuses are cached
+CACHEABLE_STATUSES = ("COMPLETED", "ERROR")
+
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag of a response body."""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Whether an If-None-Match header matches an ETag, by the weak comparison
+    RFC 9110 prescribes for it: `*` matches anything, the header may list
+    several tags, and a `W/` prefix on either side is ignored.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+class CaseResponseCache:
+    """Two-tier (local LRU + Redis) cache of serialized case responses."""
+
+    def __init__(self, local_size: int, ttl: int):
+        self.local_size = local_size
+        self.ttl = ttl
+        self.local: OrderedDict[str, tuple[str, bytes]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.local_hits = 0
+        self.redis_hits = 0
+        # Requests answered with a 304 from the cached ETag alone
+        self.etag_hits = 0
+        self.misses = 0
+
+    async def get_etag(self, case_id: str, user_id: str) -> Optional[str]:
+        """ETag of the cached response of a case owned by user_id, None on a miss."""
+        try:
+            etag, owner = await events.get_async_redis().hmget(events.case_response_key(case_id), "etag", "user_id")
+        except RedisError as e:
+            print(f"* case cache unavailable: {e}")
+            return None
+        if etag is None or owner.decode() != user_id:
+            self.misses += 1
+            return None
+        return etag.decode()
+
+    async def get_body(self, case_id: str, etag: str) -> Optional[bytes]:
+        """Cached body of a case with the given ETag, from the local tier if possible."""
+        with self.lock:
+            entry = self.local.get(case_id)
+            if entry is not None and entry[0] == etag:
+                self.local.move_to_end(case_id)
+                self.local_hits += 1
+                return entry[1]
+
+        try:
+            body = await events.get_async_redis().hget(events.case_response_key(case_id), "body")
+        except RedisError as e:
+            print(f"* case cache unavailable: {e}")
+            return None
+        if body is None:
+            self.misses += 1
+            return None
+        self.redis_hits += 1
+        self._put_local(case_id, etag, body)
+        return body
+
+    async def put(self, case_id: str, user_id: str, etag: str, body: bytes):
+        """Cache the serialized response of a finished case."""
+        self._put_local(case_id, etag, body)
+        try:
+            key = events.case_response_key(case_id)
+            pipeline = events.get_async_redis().pipeline(transaction=False)
+            pipeline.hset(key, mapping={"etag": etag, "user_id": user_id, "body": body})
+            pipeline.expire(key, self.ttl)
+            await pipeline.execute()
+        except RedisError as e:
+            print(f"* case cache unavailable: {e}")
+
+    def count_etag_hit(self):
+        """Count a request answered with a 304 from the ETag returned by `get_etag`."""
+        self.etag_hits += 1
+
+    def stats(self) -> dict:
+        """Hit/miss counters and hit rate of the cache."""
+        hits = self.local_hits + self.redis_hits + self.etag_hits
+        lookups = hits + self.misses
+        return {
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "etag_hits": self.etag_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "local_size": len(self.local),
+        }
+
+    def _put_local(self, case_id: str, etag: str, body: bytes):
+        with self.lock:
+            self.local[case_id] = (etag, body)
+            self.local.move_to_end(case_id)
+            while len(self.local) > self.local_size:
+                self.local.popitem(last=False)
+
+
+case_cache = CaseResponseCache(CASE_CACHE_LOCAL_SIZE, CASE_CACHE_TTL_SECONDS)
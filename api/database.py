@@ -1,13 +1,28 @@
 """
 Database models and connection for clinical case tracking.
 Uses SQLModel (SQLAlchemy + Pydantic) with PostgreSQL (Supabase).
+
+This module is synchronous and is used by the RQ worker. The API server
+goes through `async_database`, which runs the same queries on an async engine.
 """
+import base64
+import hashlib
+import html
+import heapq
+from collections import defaultdict
 from datetime import datetime
-from typing import Optional, Annotated, Any
-from sqlalchemy import Column, JSON
+from typing import Optional, Annotated, Any, Iterator
+from sqlalchemy import BigInteger, Column, Computed, Float, JSON, Index, Integer, String, Text, and_, case, cast, column, delete, extract, func, insert, literal, literal_column, null, or_, table, tuple_, union_all, update
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR, aggregate_order_by, insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import joinedload
 from sqlmodel import SQLModel, Field, Relationship, create_engine, Session, select
 import os
 from dotenv import load_dotenv
+import archive
+import events
+from db_pool import engine_options, retry_on_disconnect
 
 # Load environment variables
 load_dotenv()
@@ -15,15 +30,42 @@ load_dotenv()
 # Get database URL
 database_url = os.getenv("DATABASE_URL")
 
-engine = create_engine(
-    database_url,
-    echo=False,  # Set to True for debugging
-    pool_pre_ping=True,  # Test connections before using them
-    pool_size=5,  # Number of connections to maintain
-    max_overflow=10,  # Maximum number of connections to create beyond pool_size
-    pool_recycle=3600,  # Recycle connections after 1 hour
-)
-print("* created database engine")
+# How get_case_full loads a case: "query" fetches the case, its messages and
+# snippets in one round-trip without building ORM objects, "orm" loads models
+CASE_HYDRATION = os.getenv("CASE_HYDRATION", "query")
+
+# Dialect of DATABASE_URL, known without creating the engine
+database_dialect = make_url(database_url).get_backend_name() if database_url else None
+
+_engine: Optional[Engine] = None
+
+
+def get_engine() -> Engine:
+    """Shared sync engine, created on first use. Pool sizing and pooler compatibility are configured in `db_pool`."""
+    global _engine
+    if _engine is None:
+        if not database_url:
+            raise RuntimeError("DATABASE_URL is not set")
+        _engine = create_engine(database_url, **engine_options())
+        print("* created database engine")
+    return _engine
+
+
+def dispose_engine():
+    """Close the pooled connections of the sync engine, if it was created."""
+    if _engine is not None:
+        _engine.dispose()
+
+
+def __getattr__(name: str):
+    # `database.engine` is created on first access
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# JSON blobs are stored as JSONB on PostgreSQL, so they can be indexed and
+# fields extracted from them without re-parsing the text
+JSONType = JSON().with_variant(JSONB(), "postgresql")
 
 
 class ClinicalCase(SQLModel, table=True):
@@ -34,7 +76,7 @@ class ClinicalCase(SQLModel, table=True):
     case_id: str = Field(unique=True, index=True)
     user_id: str = Field(index=True)  # Supabase user ID
     status: str = Field(default="CREATED")  # CREATED, PROCESSING, COMPLETED, ERROR
-    data_json: dict = Field(default_factory=dict, sa_column=Column(JSON))  # Contains: title, etc.
+    data_json: dict = Field(default_factory=dict, sa_column=Column(JSONType))  # Contains: title, etc.
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -52,15 +94,24 @@ class ClinicalCase(SQLModel, table=True):
         }
 
 
+# Keyset pagination of a user's cases, newest first
+Index(
+    "ix_cases_user_id_created_at_id",
+    ClinicalCase.user_id, ClinicalCase.created_at.desc(), ClinicalCase.id.desc(),
+)
+
+
 class Message(SQLModel, table=True):
     """Model for tracking a message in a case."""
     __tablename__ = "messages"
+    # Incremental fetches are a range scan on the autoincrement id within a case
+    __table_args__ = (Index("ix_messages_case_id_id", "case_id", "id"),)
 
     id: Optional[int] = Field(default=None, primary_key=True)
     message_id: str = Field(unique=True, index=True)
     case_id: str = Field(foreign_key="cases.case_id", index=True)
     user_id: str = Field(index=True)  # Supabase user ID
-    message_data_json: dict = Field(default_factory=dict, sa_column=Column(JSON))  # Contains: from_id, message_type, text, payload_json, stage
+    message_data_json: dict = Field(default_factory=dict, sa_column=Column(JSONType))  # Contains: from_id, message_type, text, payload_json, stage
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
     # Relationships
@@ -79,6 +130,21 @@ class Message(SQLModel, table=True):
         }
 
 
+class EvidenceSource(SQLModel, table=True):
+    """
+    Model for the shared content of evidence snippets.
+
+    Guidelines and abstracts are cited by many cases, so their text is stored
+    once, keyed by `evidence_source_hash` of the source id and every shared
+    field. Rows are only ever inserted, never updated.
+    """
+    __tablename__ = "evidence_sources"
+
+    source_hash: str = Field(primary_key=True)
+    source_data_json: dict = Field(default_factory=dict, sa_column=Column(JSONType))  # Contains: source_id, text, source_type, source_url, source_citation
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
 class EvidenceSnippet(SQLModel, table=True):
     """Model for tracking evidence snippets in a case."""
     __tablename__ = "evidence_snippets"
@@ -86,29 +152,899 @@ class EvidenceSnippet(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     snippet_id: str = Field(unique=True, index=True)
     case_id: str = Field(foreign_key="cases.case_id", index=True)
-    snippet_data_json: dict = Field(default_factory=dict, sa_column=Column(JSON))  # Contains: text, source_id, source_type, source_url, source_citation, index
+    # None for snippets without text, and for rows written before sources were shared
+    source_hash: Optional[str] = Field(default=None, foreign_key="evidence_sources.source_hash", index=True)
+    snippet_data_json: dict = Field(default_factory=dict, sa_column=Column(JSONType))  # Contains: index, source_id, and the source fields when source_hash is None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
     # Relationships
     case: Optional[ClinicalCase] = Relationship(back_populates="evidence_snippets")
+    source: Optional[EvidenceSource] = Relationship()
 
     def to_dict(self) -> dict:
-        return {
-            "snippet_id": self.snippet_id,
-            "case_id": self.case_id,
-            "index": self.snippet_data_json.get("index", 0) if isinstance(self.snippet_data_json, dict) else 0,
-            "text": self.snippet_data_json.get("text") if isinstance(self.snippet_data_json, dict) else None,
-            "source_id": self.snippet_data_json.get("source_id") if isinstance(self.snippet_data_json, dict) else None,
-            "source_type": self.snippet_data_json.get("source_type") if isinstance(self.snippet_data_json, dict) else None,
-            "source_url": self.snippet_data_json.get("source_url") if isinstance(self.snippet_data_json, dict) else None,
-            "source_citation": self.snippet_data_json.get("source_citation") if isinstance(self.snippet_data_json, dict) else None,
-            "created_at": self.created_at.isoformat(),
-        }
+        data = self.snippet_data_json if isinstance(self.snippet_data_json, dict) else {}
+        if self.source_hash is not None and self.source is not None:
+            data = {**self.source.source_data_json, **data}
+        return snippet_dict(self.snippet_id, self.case_id, data, self.created_at)
+
+
+# Snippet fields stored on the shared source rather than on each snippet
+SOURCE_FIELDS = ("text", "source_type", "source_url", "source_citation")
+
+
+def message_dict(message_id: str, case_id: str, data: dict, created_at: datetime) -> dict:
+    """API representation of a message from its data."""
+    return {
+        "message_id": message_id,
+        "case_id": case_id,
+        "from_id": data.get("from_id"),
+        "message_type": data.get("message_type"),
+        "text": data.get("text"),
+        "payload_json": data.get("payload_json"),
+        "stage": data.get("stage"),
+        "created_at": created_at.isoformat(),
+    }
+
+
+def snippet_dict(snippet_id: str, case_id: str, data: dict, created_at: datetime) -> dict:
+    """API representation of a snippet from its full (source fields included) data."""
+    return {
+        "snippet_id": snippet_id,
+        "case_id": case_id,
+        "index": data.get("index", 0),
+        "text": data.get("text"),
+        "source_id": data.get("source_id"),
+        "source_type": data.get("source_type"),
+        "source_url": data.get("source_url"),
+        "source_citation": data.get("source_citation"),
+        "created_at": created_at.isoformat(),
+    }
+
+
+def shared_snippet_dict(snippet_id: str, case_id: str, source_hash: Optional[str], data: dict, created_at: datetime) -> dict:
+    """
+    API representation of a snippet in a response listing its sources once, in
+    `evidence_sources`. Snippets without a source row keep their source fields.
+    """
+    if source_hash is None:
+        return {**snippet_dict(snippet_id, case_id, data, created_at), "source_hash": None}
+    return {
+        "snippet_id": snippet_id,
+        "case_id": case_id,
+        "index": data.get("index", 0),
+        "source_id": data.get("source_id"),
+        "source_hash": source_hash,
+        "created_at": created_at.isoformat(),
+    }
+
+
+def evidence_source_hash(source_data: dict) -> str:
+    """
+    Content address of an evidence source: its id and all of SOURCE_FIELDS, so
+    that the same text cited with another URL or citation is another source.
+    """
+    values = ("" if source_data.get(key) is None else str(source_data[key]) for key in ("source_id", *SOURCE_FIELDS))
+    return hashlib.sha256("\x1f".join(values).encode()).hexdigest()
+
+
+def split_snippet_data(snippet_data: dict) -> tuple[Optional[dict], dict]:
+    """
+    Split the data of a new snippet into an `evidence_sources` row and the
+    case-specific data left on the snippet. Snippets without text have no
+    source row and keep all their data.
+    """
+    if not isinstance(snippet_data, dict) or snippet_data.get("text") is None:
+        return None, snippet_data
+    source_data = {"source_id": snippet_data.get("source_id")}
+    source_data.update((key, snippet_data.get(key)) for key in SOURCE_FIELDS)
+    source = {
+        "source_hash": evidence_source_hash(source_data),
+        "source_data_json": source_data,
+        "created_at": datetime.utcnow(),
+    }
+    return source, {key: value for key, value in snippet_data.items() if key not in SOURCE_FIELDS}
+
+
+def source_upsert(dialect: str):
+    """INSERT of `evidence_sources` rows that skips the sources already stored."""
+    dialect_insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+    return dialect_insert(EvidenceSource.__table__).on_conflict_do_nothing(index_elements=["source_hash"])
+
+
+def unique_sources(sources: list[Optional[dict]]) -> list[dict]:
+    """The distinct source rows of a batch, in first-seen order."""
+    unique = {}
+    for source in sources:
+        if source is not None:
+            unique.setdefault(source["source_hash"], source)
+    return list(unique.values())
+
+
+# Fields inside the JSON blobs that are filtered and sorted on in SQL, as
+# (model, column name) -> (JSON column, key, is integer). On PostgreSQL they
+# are stored generated columns with indexes; on other databases `hot_field`
+# extracts them from the JSON on the fly.
+HOT_FIELDS = {
+    (ClinicalCase, "title"): ("data_json", "title", False),
+    (Message, "message_type"): ("message_data_json", "message_type", False),
+    (Message, "stage"): ("message_data_json", "stage", False),
+    (Message, "from_id"): ("message_data_json", "from_id", False),
+    (EvidenceSnippet, "source_id"): ("snippet_data_json", "source_id", False),
+    (EvidenceSnippet, "snippet_index"): ("snippet_data_json", "index", True),
+}
+
+
+def _generated_expression(json_column: str, key: str, integer: bool) -> str:
+    if integer:
+        # Non-numeric values must not fail the insert, they just aren't indexed
+        return (
+            f"CASE WHEN jsonb_typeof({json_column} -> '{key}') = 'number' "
+            f"THEN ({json_column} ->> '{key}')::numeric::bigint END"
+        )
+    return f"{json_column} ->> '{key}'"
+
+
+if database_dialect == "postgresql":
+    # Added to the tables only, not mapped on the models: the ORM never writes them
+    for (model, name), (json_column, key, integer) in HOT_FIELDS.items():
+        model.__table__.append_column(Column(
+            name,
+            BigInteger if integer else Text,
+            Computed(_generated_expression(json_column, key, integer), persisted=True),
+        ))
+    Index("ix_cases_user_id_title", ClinicalCase.__table__.c.user_id, ClinicalCase.__table__.c.title)
+    Index("ix_messages_case_id_stage", Message.__table__.c.case_id, Message.__table__.c.stage)
+    Index("ix_messages_case_id_message_type", Message.__table__.c.case_id, Message.__table__.c.message_type)
+    Index("ix_evidence_snippets_source_id", EvidenceSnippet.__table__.c.source_id)
+    Index("ix_evidence_snippets_case_id_snippet_index", EvidenceSnippet.__table__.c.case_id, EvidenceSnippet.__table__.c.snippet_index)
+
+
+# Text searched by /api/search, as table -> SQL expression. On PostgreSQL each
+# table gets a stored generated tsvector column with a GIN index. On SQLite
+# the text is copied into an FTS5 table by triggers (see `init_search_index`).
+SEARCH_TEXT = {
+    "cases": "coalesce(data_json ->> 'title', '')",
+    "messages": "coalesce(message_data_json ->> 'text', '')",
+    "evidence_sources": "coalesce(source_data_json ->> 'text', '') || ' ' || coalesce(source_data_json ->> 'source_citation', '')",
+}
+SEARCH_CONFIG = "english"
+# Longer texts are only indexed up to this length, a tsvector is limited to 1MB
+SEARCH_MAX_CHARS = 100000
+
+if database_dialect == "postgresql":
+    for model in (ClinicalCase, Message, EvidenceSource):
+        model.__table__.append_column(Column(
+            "search_vector",
+            TSVECTOR,
+            Computed(
+                f"to_tsvector('{SEARCH_CONFIG}'::regconfig, left({SEARCH_TEXT[model.__tablename__]}, {SEARCH_MAX_CHARS}))",
+                persisted=True,
+            ),
+        ))
+        Index(f"ix_{model.__tablename__}_search_vector", model.__table__.c.search_vector, postgresql_using="gin")
+
+
+def hot_field(model, name: str):
+    """SQL expression of a hot JSON field: the generated column if there is one, else a JSON extraction."""
+    if name in model.__table__.c:
+        return model.__table__.c[name]
+    json_column, key, integer = HOT_FIELDS[(model, name)]
+    value = getattr(model, json_column)[key]
+    return value.as_integer() if integer else value.as_string()
 
 
 def init_db():
     """Initialize database tables."""
+    engine = get_engine()
     SQLModel.metadata.create_all(engine, checkfirst=True)
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as connection:
+            init_search_index(connection)
+
+
+# FTS5 tables mirroring SEARCH_TEXT, as table -> (FTS table, key, indexed SQLite expression).
+# The key is the rowid where it aliases an INTEGER PRIMARY KEY, otherwise the
+# primary key itself, stored unindexed: a bare rowid can change on VACUUM.
+SQLITE_SEARCH_TABLES = {
+    "cases": ("cases_fts", "rowid", "json_extract({row}.data_json, '$.title')"),
+    "messages": ("messages_fts", "rowid", "json_extract({row}.message_data_json, '$.text')"),
+    "evidence_sources": (
+        "evidence_sources_fts",
+        "source_hash",
+        "coalesce(json_extract({row}.source_data_json, '$.text'), '') || ' ' || "
+        "coalesce(json_extract({row}.source_data_json, '$.source_citation'), '')",
+    ),
+}
+
+
+def fts_columns(key: str) -> str:
+    """Columns of an FTS5 search table keyed by `key`, the indexed text last."""
+    return "body" if key == "rowid" else f"{key} UNINDEXED, body"
+
+
+def init_search_index(connection):
+    """
+    Create the SQLite FTS5 search tables, keyed as in SQLITE_SEARCH_TABLES and
+    kept up to date by triggers. New tables are filled from the existing rows,
+    and tables created with another layout are rebuilt.
+    """
+    for table_name, (fts_table, key, expression) in SQLITE_SEARCH_TABLES.items():
+        create = f"CREATE VIRTUAL TABLE {fts_table} USING fts5({fts_columns(key)}, tokenize = 'porter unicode61')"
+        existing = connection.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,)
+        ).scalar()
+        if existing == create:
+            continue
+        if existing is not None:
+            for trigger in ("insert", "delete", "update"):
+                connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {fts_table}_{trigger}")
+            connection.exec_driver_sql(f"DROP TABLE {fts_table}")
+        connection.exec_driver_sql(create)
+        new, old = expression.format(row="new"), expression.format(row="old")
+        connection.exec_driver_sql(f"""
+            CREATE TRIGGER {fts_table}_insert AFTER INSERT ON {table_name} BEGIN
+                INSERT INTO {fts_table} ({key}, body) VALUES (new.{key}, {new});
+            END""")
+        connection.exec_driver_sql(f"""
+            CREATE TRIGGER {fts_table}_delete AFTER DELETE ON {table_name} BEGIN
+                DELETE FROM {fts_table} WHERE {key} = old.{key};
+            END""")
+        connection.exec_driver_sql(f"""
+            CREATE TRIGGER {fts_table}_update AFTER UPDATE ON {table_name} WHEN {new} IS NOT {old} BEGIN
+                DELETE FROM {fts_table} WHERE {key} = old.{key};
+                INSERT INTO {fts_table} ({key}, body) VALUES (new.{key}, {new});
+            END""")
+        connection.exec_driver_sql(
+            f"INSERT INTO {fts_table} ({key}, body) SELECT {key}, {expression.format(row=table_name)} FROM {table_name}"
+        )
+        print(f"* {'rebuilt' if existing else 'created'} search index {fts_table}")
+
+
+def case_query(case_id: str, user_id: str = None):
+    """Statement selecting a case by ID, optionally filtered by user_id."""
+    statement = select(ClinicalCase).where(ClinicalCase.case_id == case_id)
+    if user_id:
+        statement = statement.where(ClinicalCase.user_id == user_id)
+    return statement
+
+
+def cases_by_id_query(case_ids: list[str], user_id: str):
+    """Statement selecting a user's cases among the given IDs."""
+    return select(ClinicalCase).where(ClinicalCase.case_id.in_(case_ids), ClinicalCase.user_id == user_id)
+
+
+def messages_query(case_id: str, user_id: str = None, after: int = None):
+    """
+    Statement selecting the messages of a case in insertion order.
+
+    `after` is a cursor (a `Message.id`): only messages inserted after it are
+    selected. Ids are monotonic, so unlike timestamps they never tie.
+    """
+    statement = select(Message).where(Message.case_id == case_id)
+    if user_id:
+        statement = statement.where(Message.user_id == user_id)
+    if after is not None:
+        statement = statement.where(Message.id > after)
+    return statement.order_by(Message.id)
+
+
+def new_messages_query(case_id: str, user_id: str = None, since_message_id: str = None):
+    """Statement selecting the messages inserted after the message `since_message_id`."""
+    statement = messages_query(case_id, user_id)
+    if since_message_id:
+        # Resolve the message id in the same statement; unknown ids select everything
+        since_id = select(Message.id).where(Message.message_id == since_message_id).scalar_subquery()
+        statement = statement.where(Message.id > func.coalesce(since_id, 0))
+    return statement
+
+
+def next_cursor(messages: list[Message], after: int = None) -> Optional[int]:
+    """Cursor to resume from after `messages`, unchanged when there are none."""
+    return messages[-1].id if messages else after
+
+
+def snippets_query(case_id: str, after: int = None):
+    """Statement selecting the evidence snippets of a case in insertion order, after an optional cursor."""
+    query = (
+        select(EvidenceSnippet)
+        .options(joinedload(EvidenceSnippet.source))
+        .where(EvidenceSnippet.case_id == case_id)
+    )
+    if after is not None:
+        query = query.where(EvidenceSnippet.id > after)
+    return query.order_by(EvidenceSnippet.id)
+
+
+def cases_query(user_id: str = None, limit: int = 50):
+    """Statement selecting the most recent cases, optionally filtered by user_id."""
+    statement = select(ClinicalCase)
+    if user_id:
+        statement = statement.where(ClinicalCase.user_id == user_id)
+    return statement.order_by(ClinicalCase.created_at.desc()).limit(limit)
+
+
+def encode_cases_cursor(created_at: datetime, id: int) -> str:
+    """Opaque cursor pointing just after the case (created_at, id) in the case list."""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{id}".encode()).decode()
+
+
+def decode_cases_cursor(cursor: str) -> tuple[datetime, int]:
+    """Decode a cursor from `encode_cases_cursor`, raises ValueError if it is malformed."""
+    try:
+        created_at, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(id)
+    except (UnicodeError, ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def case_summaries_query(user_id: str, limit: int = 50, cursor: str = None, statuses: list[str] = None):
+    """
+    Statement selecting one page of a user's case summaries, newest first.
+
+    Only the columns the case list shows are selected (the title is extracted
+    in SQL instead of loading `data_json`), and pages are resolved by keyset on
+    (created_at, id) so deep pages cost the same as the first one. One extra
+    row is selected to tell whether there is a next page.
+    """
+    statement = select(
+        ClinicalCase.id,
+        ClinicalCase.case_id,
+        ClinicalCase.status,
+        hot_field(ClinicalCase, "title").label("title"),
+        ClinicalCase.created_at,
+        ClinicalCase.updated_at,
+    ).where(ClinicalCase.user_id == user_id)
+    if statuses:
+        statement = statement.where(ClinicalCase.status.in_(statuses))
+    if cursor:
+        created_at, id = decode_cases_cursor(cursor)
+        statement = statement.where(tuple_(ClinicalCase.created_at, ClinicalCase.id) < tuple_(created_at, id))
+    return statement.order_by(ClinicalCase.created_at.desc(), ClinicalCase.id.desc()).limit(limit + 1)
+
+
+def build_case_summaries(rows: list, limit: int) -> tuple[list[dict], Optional[str]]:
+    """Case list items from `case_summaries_query` rows, and the cursor of the next page."""
+    summaries = [
+        {
+            "case_id": row.case_id,
+            "status": row.status,
+            "title": row.title,
+            "created_at": row.created_at.isoformat(),
+            "updated_at": row.updated_at.isoformat(),
+        }
+        for row in rows[:limit]
+    ]
+    cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        cursor = encode_cases_cursor(last.created_at, last.id)
+    return summaries, cursor
+
+
+def build_case_full(case: ClinicalCase, messages: list[Message], snippets: list[EvidenceSnippet], after: int = None, dedupe_sources: bool = False) -> dict:
+    """
+    Assemble the full case payload from the loaded rows (snippets with their source).
+    With `dedupe_sources` each source is sent once, in `evidence_sources`.
+    """
+    case_full = {
+        "case_id": case.case_id,
+        "status": case.status,
+        "title": case.data_json.get("title") if isinstance(case.data_json, dict) else None,
+        "messages": [msg.to_dict() for msg in messages],
+        "evidence_snippets": [snip.to_dict() for snip in snippets],
+        "created_at": case.created_at.isoformat(),
+        "updated_at": case.updated_at.isoformat(),
+        "next_cursor": next_cursor(messages, after),
+    }
+    if dedupe_sources:
+        case_full["evidence_snippets"] = [
+            shared_snippet_dict(snip.snippet_id, snip.case_id, snip.source_hash, snip.snippet_data_json, snip.created_at)
+            for snip in snippets
+        ]
+        case_full["evidence_sources"] = {
+            snip.source_hash: snip.source.source_data_json for snip in snippets if snip.source_hash is not None
+        }
+    return case_full
+
+
+def _json_field(column, key: str):
+    """`column -> 'key'` on a JSON column, with the key inlined."""
+    return column.op("->", return_type=JSON)(literal_column(f"'{key}'"))
+
+
+def _json_object(**fields):
+    """Postgres `json_build_object` over keyword fields, keeping their order."""
+    args = []
+    for key, value in fields.items():
+        args += [literal_column(f"'{key}'"), value]
+    return func.json_build_object(*args, type_=JSON)
+
+
+def _isoformat(column):
+    """Render a timestamp in SQL exactly like `datetime.isoformat()` does."""
+    return func.to_char(column, 'YYYY-MM-DD"T"HH24:MI:SS', type_=String) + case(
+        (cast(extract("microseconds", column), Integer) % 1000000 == 0, ""),
+        else_=func.to_char(column, ".US", type_=String),
+    )
+
+
+def _message_filters(case_id: str, user_id: str = None, after: int = None) -> list:
+    filters = [Message.case_id == case_id]
+    if user_id:
+        filters.append(Message.user_id == user_id)
+    if after is not None:
+        filters.append(Message.id > after)
+    return filters
+
+
+def _case_full_json_query(case_id: str, user_id: str = None, after: int = None, as_text: bool = False, dedupe_sources: bool = False):
+    """
+    Postgres statement assembling the whole `build_case_full` payload as a
+    single JSON value with json_agg, so the case is read in one round-trip.
+    With `as_text` the payload is returned serialized, next to the case status.
+    """
+    message_filters = _message_filters(case_id, user_id, after)
+    message_data = Message.message_data_json
+    message_json = _json_object(
+        message_id=Message.message_id,
+        case_id=Message.case_id,
+        from_id=_json_field(message_data, "from_id"),
+        message_type=_json_field(message_data, "message_type"),
+        text=_json_field(message_data, "text"),
+        payload_json=_json_field(message_data, "payload_json"),
+        stage=_json_field(message_data, "stage"),
+        created_at=_isoformat(Message.created_at),
+    )
+    snippet_data = EvidenceSnippet.snippet_data_json
+    source_data = EvidenceSource.source_data_json
+
+    def snippet_field(key: str):
+        # Fields on the snippet win over its source, as in `EvidenceSnippet.to_dict`
+        return func.coalesce(_json_field(snippet_data, key), _json_field(source_data, key))
+
+    snippet_index = func.coalesce(_json_field(snippet_data, "index"), literal_column("'0'::jsonb"))
+    snippet_json = _json_object(
+        snippet_id=EvidenceSnippet.snippet_id,
+        case_id=EvidenceSnippet.case_id,
+        index=snippet_index,
+        text=snippet_field("text"),
+        source_id=snippet_field("source_id"),
+        source_type=snippet_field("source_type"),
+        source_url=snippet_field("source_url"),
+        source_citation=snippet_field("source_citation"),
+        created_at=_isoformat(EvidenceSnippet.created_at),
+    )
+    if dedupe_sources:
+        # Same shape as `shared_snippet_dict`
+        inline_json = _json_object(
+            snippet_id=EvidenceSnippet.snippet_id,
+            case_id=EvidenceSnippet.case_id,
+            index=snippet_index,
+            text=_json_field(snippet_data, "text"),
+            source_id=_json_field(snippet_data, "source_id"),
+            source_type=_json_field(snippet_data, "source_type"),
+            source_url=_json_field(snippet_data, "source_url"),
+            source_citation=_json_field(snippet_data, "source_citation"),
+            created_at=_isoformat(EvidenceSnippet.created_at),
+            source_hash=EvidenceSnippet.source_hash,
+        )
+        shared_json = _json_object(
+            snippet_id=EvidenceSnippet.snippet_id,
+            case_id=EvidenceSnippet.case_id,
+            index=snippet_index,
+            source_id=_json_field(snippet_data, "source_id"),
+            source_hash=EvidenceSnippet.source_hash,
+            created_at=_isoformat(EvidenceSnippet.created_at),
+        )
+        snippet_json = case((EvidenceSnippet.source_hash.is_(None), inline_json), else_=shared_json)
+    empty = literal_column("'[]'::json")
+    messages = select(
+        func.coalesce(func.json_agg(aggregate_order_by(message_json, Message.id)), empty)
+    ).where(*message_filters).scalar_subquery()
+    snippets = select(
+        func.coalesce(func.json_agg(aggregate_order_by(snippet_json, EvidenceSnippet.id)), empty)
+    ).where(EvidenceSnippet.case_id == case_id)
+    if not dedupe_sources:
+        snippets = snippets.outerjoin(EvidenceSource, EvidenceSource.source_hash == EvidenceSnippet.source_hash)
+    snippets = snippets.scalar_subquery()
+    last_message_id = select(func.max(Message.id)).where(*message_filters).scalar_subquery()
+
+    fields = dict(
+        case_id=ClinicalCase.case_id,
+        status=ClinicalCase.status,
+        title=_json_field(ClinicalCase.data_json, "title"),
+        messages=messages,
+        evidence_snippets=snippets,
+        created_at=_isoformat(ClinicalCase.created_at),
+        updated_at=_isoformat(ClinicalCase.updated_at),
+        next_cursor=func.coalesce(last_message_id, literal(after, Integer)),
+    )
+    if dedupe_sources:
+        fields["evidence_sources"] = select(
+            func.coalesce(
+                func.json_object_agg(EvidenceSource.source_hash, EvidenceSource.source_data_json),
+                literal_column("'{}'::json"),
+            )
+        ).where(EvidenceSource.source_hash.in_(_case_source_hashes(case_id))).scalar_subquery()
+    payload = _json_object(**fields)
+    if as_text:
+        statement = select(cast(payload, Text).label("body"), ClinicalCase.status)
+    else:
+        statement = select(payload)
+    statement = statement.where(ClinicalCase.case_id == case_id)
+    if user_id:
+        statement = statement.where(ClinicalCase.user_id == user_id)
+    return statement
+
+
+def _case_source_hashes(case_id: str):
+    return select(EvidenceSnippet.source_hash).where(EvidenceSnippet.case_id == case_id, EvidenceSnippet.source_hash.is_not(None))
+
+
+def _case_full_rows_query(case_id: str, user_id: str = None, after: int = None):
+    """
+    Portable statement returning the case, its messages, the sources of its
+    snippets and its snippets as plain columns of one UNION ALL, tagged by
+    kind (0 case, 1 message, 2 source, 3 snippet). Each source is returned
+    once however many snippets cite it, and before them.
+    """
+    case_rows = select(
+        literal(0).label("kind"), ClinicalCase.id.label("row_id"), ClinicalCase.case_id.label("key"),
+        ClinicalCase.status, ClinicalCase.data_json.label("data"), ClinicalCase.created_at, ClinicalCase.updated_at,
+    ).where(ClinicalCase.case_id == case_id)
+    if user_id:
+        case_rows = case_rows.where(ClinicalCase.user_id == user_id)
+    message_rows = select(
+        literal(1), Message.id, Message.message_id,
+        null(), Message.message_data_json, Message.created_at, null(),
+    ).where(*_message_filters(case_id, user_id, after))
+    source_rows = select(
+        literal(2), literal(0), EvidenceSource.source_hash,
+        null(), EvidenceSource.source_data_json, EvidenceSource.created_at, null(),
+    ).where(EvidenceSource.source_hash.in_(_case_source_hashes(case_id)))
+    # The status column carries the source hash of snippet rows
+    snippet_rows = select(
+        literal(3), EvidenceSnippet.id, EvidenceSnippet.snippet_id,
+        EvidenceSnippet.source_hash, EvidenceSnippet.snippet_data_json, EvidenceSnippet.created_at, null(),
+    ).where(EvidenceSnippet.case_id == case_id)
+    return union_all(case_rows, message_rows, source_rows, snippet_rows).order_by("kind", "row_id")
+
+
+def case_full_query(dialect: str, case_id: str, user_id: str = None, after: int = None, dedupe_sources: bool = False):
+    """Single round-trip statement loading a full case on the given SQL dialect."""
+    if dialect == "postgresql":
+        return _case_full_json_query(case_id, user_id, after, dedupe_sources=dedupe_sources)
+    return _case_full_rows_query(case_id, user_id, after)
+
+
+def case_full_text_query(case_id: str, user_id: str = None, after: int = None, dedupe_sources: bool = False):
+    """Postgres statement returning the full case payload already serialized as JSON text, and the case status."""
+    return _case_full_json_query(case_id, user_id, after, as_text=True, dedupe_sources=dedupe_sources)
+
+
+def case_full_from_result(dialect: str, result, case_id: str, after: int = None, dedupe_sources: bool = False) -> Optional[dict]:
+    """Build the `build_case_full` payload from the result of `case_full_query`."""
+    if dialect == "postgresql":
+        # One JSON column: `exec` returns the scalars
+        return result.first()
+
+    case_full = None
+    messages = []
+    sources = {}
+    snippets = []
+    last_message_id = after
+    for kind, row_id, key, status, data, created_at, updated_at in result:
+        data = data if isinstance(data, dict) else {}
+        if kind == 0:
+            case_full = {
+                "case_id": key,
+                "status": status,
+                "title": data.get("title"),
+                "messages": messages,
+                "evidence_snippets": snippets,
+                "created_at": created_at.isoformat(),
+                "updated_at": updated_at.isoformat(),
+                "next_cursor": None,
+            }
+        elif kind == 1:
+            messages.append(message_dict(key, case_id, data, created_at))
+            last_message_id = row_id
+        elif kind == 2:
+            sources[key] = data
+        elif dedupe_sources:
+            snippets.append(shared_snippet_dict(key, case_id, status, data, created_at))
+        else:
+            if status is not None:
+                data = {**sources.get(status, {}), **data}
+            snippets.append(snippet_dict(key, case_id, data, created_at))
+
+    if case_full is not None:
+        case_full["next_cursor"] = last_message_id
+        if dedupe_sources:
+            case_full["evidence_sources"] = sources
+    return case_full
+
+
+def message_event(message: Message) -> dict:
+    """Stream event for a message, carrying its cursor. The message must be flushed."""
+    return {"type": "message", "cursor": message.id, "data": message.to_dict()}
+
+
+def evidence_event(snippet: EvidenceSnippet, snippet_data: dict = None) -> dict:
+    """
+    Stream event for an evidence snippet, carrying its own cursor. The snippet must be flushed.
+    Its full data is read from the loaded source unless given.
+    """
+    if snippet_data is None:
+        data = snippet.to_dict()
+    else:
+        data = snippet_dict(snippet.snippet_id, snippet.case_id, snippet_data, snippet.created_at)
+    return {"type": "evidence", "cursor": snippet.id, "data": data}
+
+
+def merge_case_events(messages: list[Message], snippets: list[EvidenceSnippet]) -> list[dict]:
+    """
+    Stream events of messages and evidence snippets in the order they were written.
+    Cursors only order rows of the same table, so the two are merged on
+    created_at, messages first when both were written at the same time.
+    """
+    merged = heapq.merge(
+        ((msg.created_at, 0, msg.id, msg) for msg in messages),
+        ((snip.created_at, 1, snip.id, snip) for snip in snippets),
+    )
+    return [
+        message_event(row) if kind == 0 else evidence_event(row)
+        for _, kind, _, row in merged
+    ]
+
+
+def messages_by_stage_query(case_id: str, stage: str, user_id: str = None):
+    """Statement selecting the messages of a case at a given stage, in insertion order."""
+    return messages_query(case_id, user_id).where(hot_field(Message, "stage") == stage)
+
+
+def snippets_by_source_query(user_id: str, source_id: str, limit: int = 100):
+    """Statement selecting the most recent snippets citing a source across a user's cases."""
+    return (
+        select(EvidenceSnippet)
+        .options(joinedload(EvidenceSnippet.source))
+        .join(ClinicalCase, ClinicalCase.case_id == EvidenceSnippet.case_id)
+        .where(ClinicalCase.user_id == user_id, hot_field(EvidenceSnippet, "source_id") == source_id)
+        .order_by(EvidenceSnippet.id.desc())
+        .limit(limit)
+    )
+
+
+def encode_search_cursor(rank: float, kind: str, row_id: int) -> str:
+    """Opaque cursor pointing just after a search result."""
+    return base64.urlsafe_b64encode(f"{rank!r}|{kind}|{row_id}".encode()).decode()
+
+
+def decode_search_cursor(cursor: str) -> tuple[float, str, int]:
+    """Decode a cursor from `encode_search_cursor`, raises ValueError if it is malformed."""
+    try:
+        rank, kind, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return float(rank), kind, int(row_id)
+    except (UnicodeError, ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+# Delimiters of the matched words in the highlights built by the database,
+# replaced with <mark> tags once the text around them has been HTML-escaped
+HIGHLIGHT_START, HIGHLIGHT_STOP = "\x02", "\x03"
+
+
+def highlight_html(body: Optional[str]) -> Optional[str]:
+    """HTML of a highlight from the database: the text escaped, the matches in <mark>."""
+    if body is None:
+        return None
+    return html.escape(body).replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_STOP, "</mark>")
+
+
+def fts_query(q: str) -> str:
+    """SQLite FTS5 query matching every word of `q`, taking its syntax characters literally."""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in q.split())
+
+
+def _search_hits_query(dialect: str, user_id: str, q: str):
+    """
+    UNION ALL of a user's cases (by title), messages (by text) and evidence
+    snippets (by source text and citation) matching `q`, with their rank.
+    On PostgreSQL `body` is the matched text, on SQLite it is already highlighted
+    between HIGHLIGHT_START and HIGHLIGHT_STOP.
+    """
+    source_text = func.coalesce(EvidenceSource.source_data_json["text"].as_string(), "")
+    source_citation = func.coalesce(EvidenceSource.source_data_json["source_citation"].as_string(), "")
+
+    if dialect == "postgresql":
+        tsquery = func.websearch_to_tsquery(literal_column(f"'{SEARCH_CONFIG}'::regconfig"), q)
+
+        def search(model):
+            vector = model.__table__.c.search_vector
+            return vector.op("@@")(tsquery), cast(func.ts_rank(vector, tsquery), Float)
+
+        case_match, case_rank = search(ClinicalCase)
+        message_match, message_rank = search(Message)
+        source_match, source_rank = search(EvidenceSource)
+        case_body = hot_field(ClinicalCase, "title")
+        message_body = Message.message_data_json["text"].as_string()
+        source_body = source_text + " " + source_citation
+        case_from = ClinicalCase.__table__
+        message_from = Message.__table__
+        source_from = EvidenceSource.__table__
+    else:
+        match = fts_query(q)
+
+        def search(table_name: str):
+            fts_table, key, _ = SQLITE_SEARCH_TABLES[table_name]
+            reference = literal_column(fts_table)
+            return (
+                table(fts_table, column(key)),
+                reference.op("MATCH")(match),
+                -func.bm25(reference),
+                # The indexed text is the last column
+                func.snippet(reference, 0 if key == "rowid" else 1, HIGHLIGHT_START, HIGHLIGHT_STOP, "...", 16),
+            )
+
+        cases_fts, case_match, case_rank, case_body = search("cases")
+        messages_fts, message_match, message_rank, message_body = search("messages")
+        sources_fts, source_match, source_rank, source_body = search("evidence_sources")
+        case_from = cases_fts.join(ClinicalCase, ClinicalCase.id == cases_fts.c.rowid)
+        message_from = messages_fts.join(Message, Message.id == messages_fts.c.rowid)
+        source_from = sources_fts.join(EvidenceSource, EvidenceSource.source_hash == sources_fts.c.source_hash)
+
+    case_hits = select(
+        literal_column("'case'", String).label("kind"), ClinicalCase.id.label("row_id"), ClinicalCase.case_id.label("case_id"),
+        ClinicalCase.case_id.label("key"), case_rank.label("rank"), case_body.label("body"),
+    ).select_from(case_from).where(ClinicalCase.user_id == user_id, case_match)
+    message_hits = select(
+        literal_column("'message'", String), Message.id, Message.case_id, Message.message_id, message_rank, message_body,
+    ).select_from(message_from).where(Message.user_id == user_id, message_match)
+    # A source matches once, and is a hit for every snippet of the user citing it
+    evidence_hits = select(
+        literal_column("'evidence'", String), EvidenceSnippet.id, EvidenceSnippet.case_id, EvidenceSnippet.snippet_id, source_rank, source_body,
+    ).select_from(
+        source_from
+        .join(EvidenceSnippet, EvidenceSnippet.source_hash == EvidenceSource.source_hash)
+        .join(ClinicalCase, ClinicalCase.case_id == EvidenceSnippet.case_id)
+    ).where(ClinicalCase.user_id == user_id, source_match)
+    return union_all(case_hits, message_hits, evidence_hits)
+
+
+def search_query(dialect: str, user_id: str, q: str, limit: int = 20, cursor: str = None):
+    """
+    Statement selecting one page of a user's search results, best first.
+
+    Pages are resolved by keyset on (rank, kind, row id), and one extra row is
+    selected to tell whether there is a next page. On PostgreSQL the matches
+    are highlighted with ts_headline on the page only.
+    """
+    hits = _search_hits_query(dialect, user_id, q).subquery("hits")
+    statement = select(*hits.c)
+    if cursor:
+        rank, kind, row_id = decode_search_cursor(cursor)
+        statement = statement.where(or_(
+            hits.c.rank < rank,
+            and_(hits.c.rank == rank, tuple_(hits.c.kind, hits.c.row_id) > tuple_(kind, row_id)),
+        ))
+    statement = statement.order_by(hits.c.rank.desc(), hits.c.kind, hits.c.row_id).limit(limit + 1)
+    if dialect != "postgresql":
+        return statement
+
+    page = statement.subquery("page")
+    tsquery = func.websearch_to_tsquery(literal_column(f"'{SEARCH_CONFIG}'::regconfig"), q)
+    highlight = func.ts_headline(
+        literal_column(f"'{SEARCH_CONFIG}'::regconfig"), page.c.body, tsquery,
+        f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxWords=32, MinWords=12, MaxFragments=2",
+    )
+    return select(
+        page.c.kind, page.c.row_id, page.c.case_id, page.c.key, page.c.rank, highlight.label("body"),
+    ).order_by(page.c.rank.desc(), page.c.kind, page.c.row_id)
+
+
+def build_search_results(rows: list, limit: int) -> tuple[list[dict], Optional[str]]:
+    """Search results from `search_query` rows, and the cursor of the next page."""
+    results = [
+        {
+            "kind": row.kind,
+            "case_id": row.case_id,
+            "id": row.key,
+            "rank": row.rank,
+            "highlight": highlight_html(row.body),
+        }
+        for row in rows[:limit]
+    ]
+    cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        cursor = encode_search_cursor(last.rank, last.kind, last.row_id)
+    return results, cursor
+
+
+def archivable_cases_query(finished_before: datetime, limit: int = 100):
+    """Statement selecting the cases that ended (COMPLETED or ERROR) before a time, oldest first."""
+    return (
+        select(ClinicalCase.case_id, ClinicalCase.user_id, ClinicalCase.updated_at)
+        .where(ClinicalCase.status.in_(("COMPLETED", "ERROR")), ClinicalCase.updated_at < finished_before)
+        .order_by(ClinicalCase.updated_at, ClinicalCase.id)
+        .limit(limit)
+    )
+
+
+def export_cases_query(user_id: str, statuses: list[str] = None, since: datetime = None, until: datetime = None):
+    """
+    Statement selecting a user's cases for export, oldest first, optionally
+    filtered by status and by creation time (`since` inclusive, `until` exclusive).
+    Only columns are selected: exports are too large to build ORM objects for.
+    """
+    statement = select(
+        ClinicalCase.case_id,
+        ClinicalCase.status,
+        ClinicalCase.data_json,
+        ClinicalCase.created_at,
+        ClinicalCase.updated_at,
+    ).where(ClinicalCase.user_id == user_id)
+    if statuses:
+        statement = statement.where(ClinicalCase.status.in_(statuses))
+    if since is not None:
+        statement = statement.where(ClinicalCase.created_at >= since)
+    if until is not None:
+        statement = statement.where(ClinicalCase.created_at < until)
+    return statement.order_by(ClinicalCase.created_at, ClinicalCase.id)
+
+
+def cases_messages_query(case_ids: list[str]):
+    """Statement selecting the messages of several cases, each case's in insertion order."""
+    return (
+        select(Message.case_id, Message.id, Message.message_id, Message.message_data_json, Message.created_at)
+        .where(Message.case_id.in_(case_ids))
+        .order_by(Message.case_id, Message.id)
+    )
+
+
+def cases_snippets_query(case_ids: list[str]):
+    """Statement selecting the evidence snippets of several cases with their source data, each case's in insertion order."""
+    return (
+        select(
+            EvidenceSnippet.case_id,
+            EvidenceSnippet.snippet_id,
+            EvidenceSnippet.snippet_data_json,
+            EvidenceSnippet.created_at,
+            EvidenceSource.source_data_json,
+        )
+        .outerjoin(EvidenceSource, EvidenceSource.source_hash == EvidenceSnippet.source_hash)
+        .where(EvidenceSnippet.case_id.in_(case_ids))
+        .order_by(EvidenceSnippet.case_id, EvidenceSnippet.id)
+    )
+
+
+def build_export_batch(cases: list, messages: list, snippets: list) -> list[dict]:
+    """`get_case_full` payloads of a batch of cases, from the rows of their export queries."""
+    case_messages = defaultdict(list)
+    last_message_ids = {}
+    for row in messages:
+        data = row.message_data_json if isinstance(row.message_data_json, dict) else {}
+        case_messages[row.case_id].append(message_dict(row.message_id, row.case_id, data, row.created_at))
+        last_message_ids[row.case_id] = row.id
+    case_snippets = defaultdict(list)
+    for row in snippets:
+        data = row.snippet_data_json if isinstance(row.snippet_data_json, dict) else {}
+        if row.source_data_json is not None:
+            data = {**row.source_data_json, **data}
+        case_snippets[row.case_id].append(snippet_dict(row.snippet_id, row.case_id, data, row.created_at))
+    return [
+        {
+            "case_id": case.case_id,
+            "status": case.status,
+            "title": case.data_json.get("title") if isinstance(case.data_json, dict) else None,
+            "messages": case_messages[case.case_id],
+            "evidence_snippets": case_snippets[case.case_id],
+            "created_at": case.created_at.isoformat(),
+            "updated_at": case.updated_at.isoformat(),
+            "next_cursor": last_message_ids.get(case.case_id),
+        }
+        for case in cases
+    ]
 
 
 def create_case(db: Session, case_id: str, user_id: str, title: str = None) -> ClinicalCase:
@@ -133,15 +1069,69 @@ def create_case(db: Session, case_id: str, user_id: str, title: str = None) -> C
         "id": case.id
     }
     db.expunge(case)
+    events.init_case(case_id, user_id)
     return case
 
 
+def create_cases_bulk(db: Session, user_id: str, cases: list[tuple[str, str]]) -> list[ClinicalCase]:
+    """
+    Create many clinical cases in a single multi-row INSERT and transaction.
+
+    Args:
+        cases: (case_id, title) pairs, in order
+    """
+    if not cases:
+        return []
+    created_at = datetime.utcnow()
+    rows = [
+        ClinicalCase(
+            case_id=case_id,
+            user_id=user_id,
+            status="CREATED",
+            data_json={"title": title},
+            created_at=created_at,
+            updated_at=created_at
+        )
+        for case_id, title in cases
+    ]
+    db.connection().execute(insert(ClinicalCase.__table__), [row.model_dump(exclude={"id"}) for row in rows])
+    db.commit()
+    events.init_cases([row.case_id for row in rows], user_id)
+    return rows
+
+
+def delete_case(db: Session, case_id: str, updated_at: datetime, last_message_id: Optional[int], last_snippet_id: Optional[int]) -> bool:
+    """
+    Delete a case with its messages and evidence snippets in one transaction,
+    unless it was updated after `updated_at` or has messages or snippets after
+    `last_message_id` and `last_snippet_id` (None when it had none), which do
+    not touch the case row. Returns whether it was deleted.
+    Evidence sources are shared between cases and are kept.
+    """
+    # No message or snippet can be added until the deletes are committed: on
+    # PostgreSQL FOR UPDATE blocks their foreign key checks, SQLite has no row
+    # locks and a no-op UPDATE takes its database write lock
+    if db.bind.dialect.name == "sqlite":
+        db.execute(update(ClinicalCase).where(ClinicalCase.case_id == case_id).values(updated_at=ClinicalCase.updated_at))
+    locked = db.exec(case_query(case_id).where(ClinicalCase.updated_at == updated_at).with_for_update()).first()
+    last_ids = (
+        db.exec(select(func.max(Message.id)).where(Message.case_id == case_id)).one(),
+        db.exec(select(func.max(EvidenceSnippet.id)).where(EvidenceSnippet.case_id == case_id)).one(),
+    ) if locked is not None else None
+    if last_ids != (last_message_id, last_snippet_id):
+        db.rollback()
+        return False
+    db.execute(delete(EvidenceSnippet).where(EvidenceSnippet.case_id == case_id))
+    db.execute(delete(Message).where(Message.case_id == case_id))
+    db.execute(delete(ClinicalCase).where(ClinicalCase.case_id == case_id))
+    db.commit()
+    return True
+
+
+@retry_on_disconnect
 def get_case(db: Session, case_id: str, user_id: str = None) -> Optional[ClinicalCase]:
     """Get a clinical case by ID, optionally filtered by user_id."""
-    statement = select(ClinicalCase).where(ClinicalCase.case_id == case_id)
-    if user_id:
-        statement = statement.where(ClinicalCase.user_id == user_id)
-    case = db.exec(statement).first()
+    case = db.exec(case_query(case_id, user_id)).first()
     if case:
         # Access attributes to load them before session closes
         _ = case.case_id
@@ -156,13 +1146,13 @@ def get_case(db: Session, case_id: str, user_id: str = None) -> Optional[Clinica
 
 def update_case_status(db: Session, case_id: str, status: str):
     """Update the status of a case."""
-    statement = select(ClinicalCase).where(ClinicalCase.case_id == case_id)
-    case = db.exec(statement).first()
+    case = db.exec(case_query(case_id)).first()
     if case:
         case.status = status
         case.updated_at = datetime.utcnow()
         db.add(case)
         db.commit()
+        events.publish(case_id, {"type": "status", "status": status})
 
 
 def add_message(db: Session, case_id: str, user_id: str, message_id: str, message_data: dict):
@@ -174,73 +1164,258 @@ def add_message(db: Session, case_id: str, user_id: str, message_id: str, messag
         message_data_json=message_data
     )
     db.add(message)
+    # Flush to get the id, and serialize before commit, which would expire the instance
+    db.flush()
+    event = message_event(message)
     db.commit()
+    events.publish(case_id, event)
 
 
 def add_evidence_snippet(db: Session, case_id: str, snippet_id: str, snippet_data: dict):
-    """Add an evidence snippet to a case."""
+    """Add an evidence snippet to a case, storing its source once across cases."""
+    source, data = split_snippet_data(snippet_data)
     snippet = EvidenceSnippet(
         snippet_id=snippet_id,
         case_id=case_id,
-        snippet_data_json=snippet_data
+        source_hash=source["source_hash"] if source else None,
+        snippet_data_json=data
     )
+    if source:
+        connection = db.connection()
+        connection.execute(source_upsert(connection.dialect.name), [source])
     db.add(snippet)
+    db.flush()
+    event = evidence_event(snippet, snippet_data)
     db.commit()
+    events.publish(case_id, event)
 
 
-def get_case_full(db: Session, case_id: str, user_id: str = None) -> Optional[dict]:
-    """Get full case data including messages and evidence snippets, optionally filtered by user_id."""
-    statement = select(ClinicalCase).where(ClinicalCase.case_id == case_id)
-    if user_id:
-        statement = statement.where(ClinicalCase.user_id == user_id)
-    case = db.exec(statement).first()
+def add_messages_bulk(db: Session, case_id: str, user_id: str, messages: list[tuple[str, dict]]):
+    """
+    Add many messages to a case in a single multi-row INSERT and transaction.
+
+    Args:
+        messages: (message_id, message_data) pairs, in order
+    """
+    if not messages:
+        return
+    created_at = datetime.utcnow()
+    rows = [
+        Message(
+            message_id=message_id,
+            case_id=case_id,
+            user_id=user_id,
+            message_data_json=message_data,
+            created_at=created_at
+        )
+        for message_id, message_data in messages
+    ]
+    ids = db.scalars(
+        insert(Message).returning(Message.id, sort_by_parameter_order=True),
+        [row.model_dump(exclude={"id"}) for row in rows]
+    ).all()
+    db.commit()
+    for row, id in zip(rows, ids):
+        row.id = id
+    events.publish_many(case_id, [message_event(row) for row in rows])
+
+
+def add_evidence_snippets_bulk(db: Session, case_id: str, snippets: list[tuple[str, dict]]):
+    """
+    Add many evidence snippets to a case in a single multi-row INSERT and transaction.
+
+    Args:
+        snippets: (snippet_id, snippet_data) pairs, in order
+    """
+    if not snippets:
+        return
+    created_at = datetime.utcnow()
+    sources, rows = evidence_snippet_rows(case_id, snippets, created_at)
+    connection = db.connection()
+    if sources:
+        connection.execute(source_upsert(connection.dialect.name), sources)
+    ids = db.scalars(
+        insert(EvidenceSnippet).returning(EvidenceSnippet.id, sort_by_parameter_order=True),
+        [row.model_dump(exclude={"id"}) for row in rows]
+    ).all()
+    db.commit()
+    for row, id in zip(rows, ids):
+        row.id = id
+    events.publish_many(case_id, [
+        evidence_event(row, snippet_data) for row, (_, snippet_data) in zip(rows, snippets)
+    ])
+
+
+def evidence_snippet_rows(case_id: str, snippets: list[tuple[str, dict]], created_at: datetime) -> tuple[list[dict], list[EvidenceSnippet]]:
+    """The distinct `evidence_sources` rows and the unsaved `evidence_snippets` rows of a batch of snippets."""
+    sources, rows = [], []
+    for snippet_id, snippet_data in snippets:
+        source, data = split_snippet_data(snippet_data)
+        sources.append(source)
+        rows.append(EvidenceSnippet(
+            snippet_id=snippet_id,
+            case_id=case_id,
+            source_hash=source["source_hash"] if source else None,
+            snippet_data_json=data,
+            created_at=created_at
+        ))
+    return unique_sources(sources), rows
+
+
+@retry_on_disconnect
+def get_case_full(db: Session, case_id: str, user_id: str = None, after: int = None, dedupe_sources: bool = False) -> Optional[dict]:
+    """
+    Get full case data including messages and evidence snippets, optionally filtered by user_id.
+    With an `after` cursor only the messages inserted after it are included.
+    With `dedupe_sources` each evidence source is included once, in `evidence_sources`.
+    Cases that were moved to the archive are read from there, given their `user_id`.
+    """
+    case_full = get_hot_case_full(db, case_id, user_id, after, dedupe_sources)
+    if case_full is None:
+        case_full = get_archived_case_full(case_id, user_id, after, dedupe_sources)
+    return case_full
+
+
+def get_hot_case_full(db: Session, case_id: str, user_id: str = None, after: int = None, dedupe_sources: bool = False) -> Optional[dict]:
+    """`get_case_full` from the database tables only."""
+    if CASE_HYDRATION == "query":
+        dialect = db.bind.dialect.name
+        result = db.exec(case_full_query(dialect, case_id, user_id, after, dedupe_sources))
+        return case_full_from_result(dialect, result, case_id, after, dedupe_sources)
+
+    case = db.exec(case_query(case_id, user_id)).first()
     if not case:
         return None
 
-    # Get messages
-    messages_statement = select(Message).where(Message.case_id == case_id).order_by(Message.created_at)
-    if user_id:
-        messages_statement = messages_statement.where(Message.user_id == user_id)
-    messages = db.exec(messages_statement).all()
+    messages = db.exec(messages_query(case_id, user_id, after)).all()
+    snippets = db.exec(snippets_query(case_id)).all()
+    return build_case_full(case, messages, snippets, after, dedupe_sources)
 
-    # Get snippets
-    snippets_statement = select(EvidenceSnippet).where(EvidenceSnippet.case_id == case_id).order_by(EvidenceSnippet.created_at)
-    snippets = db.exec(snippets_statement).all()
 
-    return {
-        "case_id": case.case_id,
-        "status": case.status,
-        "title": case.data_json.get("title") if isinstance(case.data_json, dict) else None,
-        "messages": [msg.to_dict() for msg in messages],
-        "evidence_snippets": [snip.to_dict() for snip in snippets],
-        "created_at": case.created_at.isoformat(),
-        "updated_at": case.updated_at.isoformat(),
-    }
+def get_archived_case_full(case_id: str, user_id: Optional[str], after: int = None, dedupe_sources: bool = False) -> Optional[dict]:
+    """
+    `get_case_full` from the archive only, None if the case is not archived.
+    Archived cases are filed under their owner, so none is found without `user_id`.
+    """
+    if user_id is None:
+        return None
+    case_full = archive.load_case(case_id, user_id, after)
+    if case_full is not None and dedupe_sources:
+        case_full = dedupe_case_sources(case_full)
+    return case_full
+
+
+def dedupe_case_sources(case_full: dict) -> dict:
+    """Turn a `get_case_full` payload into its `dedupe_sources` shape."""
+    sources = {}
+    snippets = []
+    for snippet in case_full["evidence_snippets"]:
+        if snippet["text"] is None:
+            snippets.append({**snippet, "source_hash": None})
+            continue
+        source_data = {"source_id": snippet["source_id"], **{key: snippet[key] for key in SOURCE_FIELDS}}
+        source_hash = evidence_source_hash(source_data)
+        sources.setdefault(source_hash, source_data)
+        snippets.append({
+            "snippet_id": snippet["snippet_id"],
+            "case_id": snippet["case_id"],
+            "index": snippet["index"],
+            "source_id": snippet["source_id"],
+            "source_hash": source_hash,
+            "created_at": snippet["created_at"],
+        })
+    return {**case_full, "evidence_snippets": snippets, "evidence_sources": sources}
+
+
+@retry_on_disconnect
+def get_messages_after(db: Session, case_id: str, user_id: str = None, after: int = None) -> tuple[list, Optional[int]]:
+    """
+    Get the messages of a case inserted after the `after` cursor, optionally filtered by user_id.
+    Returns the messages and the cursor to pass on the next call.
+    """
+    messages = db.exec(messages_query(case_id, user_id, after)).all()
+    return [msg.to_dict() for msg in messages], next_cursor(messages, after)
 
 
+@retry_on_disconnect
+def get_message_events(db: Session, case_id: str, user_id: str = None, after: int = None) -> list[dict]:
+    """Stream events for the messages of a case inserted after the `after` cursor."""
+    messages = db.exec(messages_query(case_id, user_id, after)).all()
+    return [message_event(msg) for msg in messages]
+
+
+@retry_on_disconnect
+def get_case_events(db: Session, case_id: str, user_id: str = None, after: int = None, evidence_after: int = None) -> list[dict]:
+    """
+    Stream events for the messages inserted after the `after` cursor and the
+    evidence snippets inserted after the `evidence_after` cursor, in the order they were written.
+    """
+    messages = db.exec(messages_query(case_id, user_id, after)).all()
+    snippets = db.exec(snippets_query(case_id, evidence_after)).all()
+    return merge_case_events(messages, snippets)
+
+
+@retry_on_disconnect
 def get_new_messages(db: Session, case_id: str, user_id: str = None, since_message_id: str = None) -> list:
     """Get new messages for a case since a given message ID, optionally filtered by user_id."""
-    statement = select(Message).where(Message.case_id == case_id)
-    if user_id:
-        statement = statement.where(Message.user_id == user_id)
-
-    if since_message_id:
-        # Get messages created after the specified message
-        since_statement = select(Message).where(Message.message_id == since_message_id)
-        since_msg = db.exec(since_statement).first()
-        if since_msg:
-            statement = statement.where(Message.created_at > since_msg.created_at)
-
-    statement = statement.order_by(Message.created_at)
-    messages = db.exec(statement).all()
+    messages = db.exec(new_messages_query(case_id, user_id, since_message_id)).all()
     return [msg.to_dict() for msg in messages]
 
 
+@retry_on_disconnect
 def get_cases(db: Session, user_id: str = None, limit: int = 50) -> list[ClinicalCase]:
     """Get a list of cases ordered by creation time, optionally filtered by user_id."""
-    statement = select(ClinicalCase)
-    if user_id:
-        statement = statement.where(ClinicalCase.user_id == user_id)
-    statement = statement.order_by(ClinicalCase.created_at.desc()).limit(limit)
-    cases = db.exec(statement).all()
+    cases = db.exec(cases_query(user_id, limit)).all()
     return cases
+
+
+@retry_on_disconnect
+def get_case_summaries(db: Session, user_id: str, limit: int = 50, cursor: str = None, statuses: list[str] = None) -> tuple[list[dict], Optional[str]]:
+    """
+    Get one page of a user's case summaries, newest first, optionally filtered by status.
+    Returns the summaries and the cursor of the next page (None on the last page).
+    """
+    rows = db.exec(case_summaries_query(user_id, limit, cursor, statuses)).all()
+    return build_case_summaries(rows, limit)
+
+
+def export_cases(db: Session, user_id: str, statuses: list[str] = None, since: datetime = None, until: datetime = None, batch_size: int = 100) -> Iterator[list[dict]]:
+    """
+    Yield a user's cases as `get_case_full` payloads, oldest first, in batches of `batch_size`.
+
+    Cases are read through a server-side cursor, and the messages and snippets
+    of each batch with one query each, so memory stays bounded by the batch
+    size however many cases are exported. Archived cases are not included.
+    """
+    cases = db.exec(export_cases_query(user_id, statuses, since, until).execution_options(yield_per=batch_size))
+    for batch in cases.partitions():
+        case_ids = [case.case_id for case in batch]
+        messages = db.exec(cases_messages_query(case_ids)).all()
+        snippets = db.exec(cases_snippets_query(case_ids)).all()
+        yield build_export_batch(batch, messages, snippets)
+
+
+@retry_on_disconnect
+def get_messages_by_stage(db: Session, case_id: str, stage: str, user_id: str = None) -> list:
+    """Get the messages of a case at a given stage (thinking, planning, ...), optionally filtered by user_id."""
+    messages = db.exec(messages_by_stage_query(case_id, stage, user_id)).all()
+    return [msg.to_dict() for msg in messages]
+
+
+@retry_on_disconnect
+def get_snippets_by_source(db: Session, user_id: str, source_id: str, limit: int = 100) -> list:
+    """Get the most recent evidence snippets citing a source across all of a user's cases."""
+    snippets = db.exec(snippets_by_source_query(user_id, source_id, limit)).all()
+    return [snip.to_dict() for snip in snippets]
+
+
+@retry_on_disconnect
+def search(db: Session, user_id: str, q: str, limit: int = 20, cursor: str = None) -> tuple[list[dict], Optional[str]]:
+    """
+    Full-text search over a user's case titles, messages and evidence, best match first.
+    Returns one page of results and the cursor of the next page (None on the last page).
+    """
+    if not q.split():
+        return [], None
+    rows = db.exec(search_query(db.bind.dialect.name, user_id, q, limit, cursor)).all()
+    return build_search_results(rows, limit)
@@ -0,0 +1,188 @@
+"""
+Connection pool configuration and instrumentation shared by the sync and async engines.
+
+Pool sizing comes from the environment. With DB_POOLER_MODE=transaction the
+engines are made safe for transaction-mode poolers such as pgbouncer or the
+Supabase pooler on port 6543. Pre-ping is off, because it costs a round-trip
+on every checkout. Read helpers retry once on a dropped connection instead
+(`retry_on_disconnect`). asyncpg prepared statements are not cached, because
+a pooler may hand each transaction a different server connection.
+
+Every checkout is timed, so pool starvation shows up as checkout wait time
+(see `pool_status`).
+
+Engines are created on first use. With DB_POOL_WARMUP the server opens that
+many connections on startup instead (`warm_up`), so the first requests do not
+pay for connecting.
+"""
+import asyncio
+import contextlib
+import functools
+import inspect
+import os
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+load_dotenv()
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))  # Number of connections to maintain
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))  # Connections allowed beyond pool_size
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # Seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))  # Recycle connections after 1 hour
+
+# "session" for direct connections and session poolers, "transaction" for transaction poolers
+DB_POOLER_MODE = os.getenv("DB_POOLER_MODE", "session")
+
+# Connections opened on server startup, at most DB_POOL_SIZE. 0 connects on first use
+DB_POOL_WARMUP = min(int(os.getenv("DB_POOL_WARMUP", "0")), DB_POOL_SIZE)
+
+# Test connections before using them, off by default behind a transaction pooler
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "0" if DB_POOLER_MODE == "transaction" else "1") == "1"
+
+# Upper bounds of the checkout latency histogram buckets, in seconds
+CHECKOUT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float("inf"))
+
+
+class CheckoutStats:
+    """Thread-safe checkout latency histogram of one pool."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bucket_counts = [0] * len(CHECKOUT_BUCKETS)
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.timeouts = 0
+
+    def observe(self, seconds: float):
+        with self.lock:
+            for i, bound in enumerate(CHECKOUT_BUCKETS):
+                if seconds <= bound:
+                    self.bucket_counts[i] += 1
+                    break
+            self.count += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def timed_out(self):
+        with self.lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            # Cumulative counts, as in a Prometheus histogram
+            buckets, cumulative = {}, 0
+            for bound, n in zip(CHECKOUT_BUCKETS, self.bucket_counts):
+                cumulative += n
+                buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+            return {
+                "checkouts": self.count,
+                "wait_seconds_total": self.total_seconds,
+                "wait_seconds_max": self.max_seconds,
+                "timeouts": self.timeouts,
+                "wait_seconds_buckets": buckets,
+            }
+
+
+def instrumented_pool(base: type, stats: CheckoutStats) -> type:
+    """Subclass of a queue pool class that records the time spent waiting for each checkout."""
+
+    class InstrumentedPool(base):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except PoolTimeoutError:
+                stats.timed_out()
+                raise
+            stats.observe(time.perf_counter() - start)
+            return connection
+
+    InstrumentedPool.__name__ = f"Instrumented{base.__name__}"
+    return InstrumentedPool
+
+
+sync_stats = CheckoutStats()
+async_stats = CheckoutStats()
+
+
+def engine_options(is_async: bool = False) -> dict:
+    """Keyword arguments for `create_engine` / `create_async_engine`."""
+    options = dict(
+        echo=False,  # Set to True for debugging
+        poolclass=instrumented_pool(AsyncAdaptedQueuePool if is_async else QueuePool, async_stats if is_async else sync_stats),
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    if is_async and DB_POOLER_MODE == "transaction":
+        # Server connections change between transactions, so prepared
+        # statements must be neither cached nor reused by name
+        options["connect_args"] = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+        }
+    return options
+
+
+async def warm_up(engine, connections: int = DB_POOL_WARMUP):
+    """Open `connections` connections of an async engine at once and return them to its pool."""
+    async with contextlib.AsyncExitStack() as stack:
+        opened = await asyncio.gather(*(stack.enter_async_context(engine.connect()) for _ in range(connections)))
+        await asyncio.gather(*(connection.exec_driver_sql("SELECT 1") for connection in opened))
+
+
+def pool_status(engine, stats: CheckoutStats) -> dict:
+    """Current occupancy and checkout statistics of an engine's pool."""
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pre_ping": DB_POOL_PRE_PING,
+        "pooler_mode": DB_POOLER_MODE,
+        **stats.snapshot(),
+    }
+
+
+def retry_on_disconnect(func):
+    """
+    Retry a read helper once when its pooled connection turned out to be dead.
+
+    Stands in for pre-ping: the failed connection is invalidated by SQLAlchemy
+    and the second attempt checks out a fresh one. Only apply this to reads;
+    a write may have been committed before the connection dropped.
+    """
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(db, *args, **kwargs):
+            try:
+                return await func(db, *args, **kwargs)
+            except DBAPIError as e:
+                if not e.connection_invalidated:
+                    raise
+                print(f"* database connection lost in {func.__name__}, retrying: {e.orig}")
+                await db.rollback()
+                return await func(db, *args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(db, *args, **kwargs):
+        try:
+            return func(db, *args, **kwargs)
+        except DBAPIError as e:
+            if not e.connection_invalidated:
+                raise
+            print(f"* database connection lost in {func.__name__}, retrying: {e.orig}")
+            db.rollback()
+            return func(db, *args, **kwargs)
+    return wrapper
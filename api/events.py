@@ -0,0 +1,252 @@
+"""
+Redis pub/sub fan-out of case events.
+
+Every committed write to a case (message, evidence snippet, status change)
+is published to a per-case channel, so SSE streams can push updates to the
+browser instead of polling the database. The same round-trip drops the
+cached response of the case (see `cache`).
+
+Each event is encoded once, by the writer, and published as a small routing
+header and the encoded event separated by a newline. Subscribers route on the
+header and forward the encoded event to the browser as is.
+
+Message and evidence events are also appended to a bounded per-case replay
+buffer, and the owner and latest status of the case are kept next to it, so a
+stream resuming from a Last-Event-ID can usually be served from Redis alone.
+"""
+import os
+from typing import Optional
+from redis import Redis, RedisError
+from redis import asyncio as aioredis
+from dotenv import load_dotenv
+import serialization
+
+load_dotenv()
+
+# Redis used for pub/sub, defaults to the same instance as the job queue
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Number of recent message and evidence events kept per case for resuming streams
+REPLAY_BUFFER_SIZE = int(os.getenv("REPLAY_BUFFER_SIZE", "500"))
+
+# Replay buffers and case state expire once a case has been idle this long
+REPLAY_BUFFER_TTL_SECONDS = int(os.getenv("REPLAY_BUFFER_TTL_SECONDS", "86400"))
+
+# Events that carry a cursor and are kept in the replay buffer
+REPLAYED_EVENT_TYPES = ("message", "evidence")
+
+_redis: Optional[Redis] = None
+_async_redis: Optional[aioredis.Redis] = None
+
+
+def case_channel(case_id: str) -> str:
+    """Name of the pub/sub channel carrying events for a case."""
+    return f"case:{case_id}:events"
+
+
+def case_response_key(case_id: str) -> str:
+    """Key of the cached serialized response of a case."""
+    return f"case:{case_id}:response"
+
+
+def case_replay_key(case_id: str) -> str:
+    """Key of the list holding the most recent encoded message and evidence events of a case."""
+    return f"case:{case_id}:replay"
+
+
+def case_state_key(case_id: str) -> str:
+    """Key of the hash holding the owner and latest status of a case."""
+    return f"case:{case_id}:state"
+
+
+def get_redis() -> Redis:
+    """Shared sync Redis client used by the publishers."""
+    global _redis
+    if _redis is None:
+        _redis = Redis.from_url(REDIS_URL)
+    return _redis
+
+
+def get_async_redis() -> aioredis.Redis:
+    """Shared asyncio Redis client used by the SSE subscribers."""
+    global _async_redis
+    if _async_redis is None:
+        _async_redis = aioredis.from_url(REDIS_URL)
+    return _async_redis
+
+
+def publish(case_id: str, event: dict):
+    """
+    Publish an event to the case channel.
+
+    Publishing is best effort: the row is already committed, and streams
+    fall back to reading the database when they (re)connect, so a Redis
+    outage must never fail the write.
+    """
+    publish_many(case_id, [event])
+
+
+def encode_event(event: dict) -> bytes:
+    """Wire format of an event: routing header, newline, encoded event."""
+    header = {key: event[key] for key in ("type", "cursor", "status") if key in event}
+    # Encoded JSON never contains a raw newline
+    return serialization.dumps(header) + b"\n" + serialization.dumps(event)
+
+
+def _queue_events(pipeline, case_id: str, case_events: list[dict]):
+    pipeline.delete(case_response_key(case_id))
+    buffered = False
+    for event in case_events:
+        encoded = encode_event(event)
+        pipeline.publish(case_channel(case_id), encoded)
+        if event["type"] in REPLAYED_EVENT_TYPES:
+            pipeline.rpush(case_replay_key(case_id), encoded)
+            buffered = True
+        elif event["type"] == "status":
+            pipeline.hset(case_state_key(case_id), "status", event["status"])
+    if buffered:
+        pipeline.ltrim(case_replay_key(case_id), -REPLAY_BUFFER_SIZE, -1)
+        pipeline.expire(case_replay_key(case_id), REPLAY_BUFFER_TTL_SECONDS)
+    pipeline.expire(case_state_key(case_id), REPLAY_BUFFER_TTL_SECONDS)
+
+
+def _queue_case_state(pipeline, case_id: str, user_id: str, status: str):
+    pipeline.hset(case_state_key(case_id), mapping={"user_id": user_id, "status": status})
+    pipeline.expire(case_state_key(case_id), REPLAY_BUFFER_TTL_SECONDS)
+
+
+def init_case(case_id: str, user_id: str, status: str = "CREATED"):
+    """Record the owner and initial status of a new case, best effort."""
+    init_cases([case_id], user_id, status)
+
+
+def init_cases(case_ids: list[str], user_id: str, status: str = "CREATED"):
+    """Record the owner and initial status of several new cases in one round-trip, best effort."""
+    try:
+        pipeline = get_redis().pipeline(transaction=False)
+        for case_id in case_ids:
+            _queue_case_state(pipeline, case_id, user_id, status)
+        pipeline.execute()
+    except RedisError as e:
+        print(f"* failed to record state of {len(case_ids)} case(s): {e}")
+
+
+async def ainit_case(case_id: str, user_id: str, status: str = "CREATED"):
+    """Async variant of `init_case`."""
+    await ainit_cases([case_id], user_id, status)
+
+
+async def ainit_cases(case_ids: list[str], user_id: str, status: str = "CREATED"):
+    """Async variant of `init_cases`."""
+    try:
+        pipeline = get_async_redis().pipeline(transaction=False)
+        for case_id in case_ids:
+            _queue_case_state(pipeline, case_id, user_id, status)
+        await pipeline.execute()
+    except RedisError as e:
+        print(f"* failed to record state of {len(case_ids)} case(s): {e}")
+
+
+def decode_event(data: bytes) -> tuple[dict, bytes]:
+    """Split the wire format of an event into its routing header and encoded event."""
+    header, payload = data.split(b"\n", 1)
+    return serialization.loads(header), payload
+
+
+def publish_many(case_id: str, case_events: list[dict]):
+    """Publish several events to the case channel, in order, in one round-trip."""
+    try:
+        pipeline = get_redis().pipeline(transaction=False)
+        _queue_events(pipeline, case_id, case_events)
+        pipeline.execute()
+    except RedisError as e:
+        print(f"* failed to publish events for case {case_id}: {e}")
+
+
+async def apublish(case_id: str, event: dict):
+    """Async variant of `publish` for writers running on the event loop."""
+    try:
+        pipeline = get_async_redis().pipeline(transaction=False)
+        _queue_events(pipeline, case_id, [event])
+        await pipeline.execute()
+    except RedisError as e:
+        print(f"* failed to publish event for case {case_id}: {e}")
+
+
+class CaseSubscription:
+    """
+    Async subscription to the events of a single case.
+
+    Usage:
+        async with CaseSubscription(case_id) as sub:
+            received = await sub.get(timeout=1.0)
+            if received:
+                header, payload = received
+    """
+
+    def __init__(self, case_id: str):
+        self.case_id = case_id
+        self.pubsub = None
+
+    async def __aenter__(self) -> "CaseSubscription":
+        self.pubsub = get_async_redis().pubsub(ignore_subscribe_messages=True)
+        await self.pubsub.subscribe(case_channel(self.case_id))
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            await self.pubsub.unsubscribe()
+            await self.pubsub.aclose()
+        except RedisError:
+            pass
+
+    async def get(self, timeout: float = 1.0) -> Optional[tuple[dict, bytes]]:
+        """
+        Wait up to `timeout` seconds for the next event, None if nothing arrived.
+        Returns the routing header (type, and cursor or status) and the encoded event.
+        """
+        message = await self.pubsub.get_message(timeout=timeout)
+        if message is None or message["type"] != "message":
+            return None
+        return decode_event(message["data"])
+
+    async def replay(self, user_id: str, after: int, evidence_after: int = None) -> Optional[tuple[str, list[tuple[dict, bytes]]]]:
+        """
+        Read the case status and the buffered events after a stream position:
+        messages after the `after` cursor and evidence after the `evidence_after` cursor.
+
+        Returns None when Redis cannot answer on its own: the case state is
+        unknown or owned by someone else, or an event at one of the cursors
+        has already been trimmed from the buffer. Cursors are global ids, so
+        only finding those exact events proves nothing in between was dropped.
+        """
+        pipeline = get_async_redis().pipeline(transaction=True)
+        pipeline.hgetall(case_state_key(self.case_id))
+        pipeline.lrange(case_replay_key(self.case_id), 0, -1)
+        state, buffered = await pipeline.execute()
+
+        if state.get(b"user_id", b"").decode() != user_id or b"status" not in state:
+            return None
+
+        # 0 or None: nothing of that type was sent yet
+        seen = {"message": after, "evidence": evidence_after}
+        expected = sum(1 for cursor in seen.values() if cursor)
+        if not expected:
+            return None
+
+        decoded = [decode_event(data) for data in buffered]
+        found = [
+            index for index, (header, _) in enumerate(decoded)
+            if header["cursor"] == seen[header["type"]]
+        ]
+        if len(found) != expected:
+            return None
+
+        # Messages and evidence can reach the buffer slightly out of the order
+        # they were sent in, so resume from the earliest of the two and skip
+        # what was already sent
+        backlog = [
+            (header, payload) for header, payload in decoded[min(found) + 1:]
+            if header["cursor"] > (seen[header["type"]] or 0)
+        ]
+        return state[b"status"].decode(), backlog
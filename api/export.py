@@ -0,0 +1,99 @@
+"""
+Export of a user's cases as NDJSON, for analytics and evaluation pipelines.
+
+Each line is the `get_case_full` payload of one case (the same document as
+GET /api/cases/{case_id}), oldest case first. Output can be gzip-compressed
+as one gzip stream, readable with `gzip -dc` or `pandas.read_json(...,
+lines=True)`.
+
+Cases are read with a server-side cursor and their messages and evidence
+snippets fetched once per batch of cases, so memory stays flat however many
+cases are exported. The same export is served by GET /api/cases/export.
+Archived cases are not included; their documents are already in ARCHIVE_DIR.
+
+Usage:
+    python export.py --user USER_ID [--status COMPLETED] [--since 2025-01-01] [--until 2025-02-01] [--output cases.ndjson.gz]
+"""
+import argparse
+import contextlib
+import sys
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+from dotenv import load_dotenv
+from sqlmodel import Session
+import database
+import serialization
+
+load_dotenv()
+
+# Cases per database round-trip, and per chunk of output
+BATCH_SIZE = 100
+
+# zlib level of gzip output. Level 1 still shrinks case JSON about 5x, at a
+# fifth of the CPU of zlib's default level 6 (about 1.5x larger output)
+GZIP_LEVEL = 1
+
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """A time filter as stored timestamps are: naive, in UTC."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class NDJSONEncoder:
+    """Encodes batches of cases as NDJSON lines, optionally as one continuous gzip stream."""
+
+    def __init__(self, compress: bool = False):
+        # wbits=31 writes a gzip header and trailer around the deflate stream
+        self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+
+    def encode(self, cases: list[dict]) -> bytes:
+        data = b"".join(serialization.dumps(case) + b"\n" for case in cases)
+        return self.compressor.compress(data) if self.compressor else data
+
+    def finish(self) -> bytes:
+        """Remaining output, to write once all batches are encoded."""
+        return self.compressor.flush() if self.compressor else b""
+
+
+def write_export(batches: Iterable[list[dict]], output, compress: bool = False) -> int:
+    """Write batches of cases to a binary file object. Returns the number of cases written."""
+    encoder = NDJSONEncoder(compress)
+    exported = 0
+    for cases in batches:
+        output.write(encoder.encode(cases))
+        exported += len(cases)
+    output.write(encoder.finish())
+    return exported
+
+
+def main():
+    """Export a user's cases to --output, or to stdout."""
+    parser = argparse.ArgumentParser(description="Export a user's cases as NDJSON")
+    parser.add_argument("--user", required=True, help="id of the user whose cases are exported")
+    parser.add_argument("--status", action="append", dest="statuses", help="only export cases with this status, may be repeated")
+    parser.add_argument("--since", type=datetime.fromisoformat, default=None, help="only export cases created at or after this ISO time, UTC unless it has an offset")
+    parser.add_argument("--until", type=datetime.fromisoformat, default=None, help="only export cases created before this ISO time, UTC unless it has an offset")
+    parser.add_argument("--output", default=None, help="file to write, gzip-compressed if it ends in .gz, default: stdout")
+    parser.add_argument("--gzip", action="store_true", help="compress the output, implied by an --output ending in .gz")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="cases per database round-trip")
+    args = parser.parse_args()
+
+    compress = args.gzip or (args.output or "").endswith(".gz")
+    stdout = sys.stdout.buffer
+    # The export goes to stdout unless --output is given, so logs go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        print(f"[Export] Exporting the cases of user {args.user}")
+        started = time.perf_counter()
+        with Session(database.get_engine()) as db, contextlib.ExitStack() as stack:
+            output = stack.enter_context(open(args.output, "wb")) if args.output else stdout
+            batches = database.export_cases(db, args.user, args.statuses, naive_utc(args.since), naive_utc(args.until), args.batch_size)
+            exported = write_export(batches, output, compress)
+        print(f"[Export] Exported {exported} case(s) in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Idempotency keys for endpoints that create resources.
+
+A client that retries a request with the same `Idempotency-Key` header gets
+the stored response of the first attempt instead of creating duplicates.
+Keys are scoped to the user and remember a fingerprint of the request body,
+so reusing a key for a different request is rejected.
+
+A request holds a short pending lease on its key while it runs. The ids of
+the resources it is about to create are recorded under the key before they
+are committed, so if it fails or dies half-way a retry takes over those ids
+(once the lease is released or expired) instead of creating new ones.
+"""
+import hashlib
+import os
+from typing import Optional
+from dotenv import load_dotenv
+from events import get_async_redis
+
+load_dotenv()
+
+# How long a key and its stored response are kept
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# How long a request holds its key before a retry may take over, should it die
+IDEMPOTENCY_PENDING_SECONDS = int(os.getenv("IDEMPOTENCY_PENDING_SECONDS", "60"))
+
+# Outcomes of `claim`
+NEW = "new"  # First use of the key, the caller must `store` or `release` it
+PENDING = "pending"  # The first request with this key is still in progress
+MISMATCH = "mismatch"  # The key was used for a different request
+DONE = "done"  # The response of the first request is returned
+RESUME = "resume"  # An earlier request failed or died, the caller takes over its recorded ids
+
+# KEYS[1]: the key's hash (fingerprint, ids, body), KEYS[2]: its pending lease
+# ARGV[1]: fingerprint, ARGV[2]: TTL of the key, ARGV[3]: TTL of the lease
+CLAIM_SCRIPT = """
+local stored = redis.call('HGET', KEYS[1], 'fingerprint')
+if not stored then
+    redis.call('HSET', KEYS[1], 'fingerprint', ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    redis.call('SET', KEYS[2], 1, 'EX', ARGV[3])
+    return {'new'}
+end
+if stored ~= ARGV[1] then
+    return {'mismatch'}
+end
+local body = redis.call('HGET', KEYS[1], 'body')
+if body then
+    return {'done', body}
+end
+if not redis.call('SET', KEYS[2], 1, 'NX', 'EX', ARGV[3]) then
+    return {'pending'}
+end
+local ids = redis.call('HGET', KEYS[1], 'ids')
+if ids then
+    return {'resume', ids}
+end
+return {'resume'}
+"""
+
+
+def idempotency_key(user_id: str, key: str) -> str:
+    """Redis key of an idempotency key of a user."""
+    return f"idempotency:{user_id}:{key}"
+
+
+def lease_key(user_id: str, key: str) -> str:
+    """Redis key of the pending lease of an idempotency key."""
+    return f"idempotency:{user_id}:{key}:pending"
+
+
+def fingerprint(body: bytes) -> str:
+    """Digest identifying a request body."""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+async def claim(user_id: str, key: str, request_fingerprint: str) -> tuple[str, Optional[bytes]]:
+    """
+    Claim an idempotency key for a request.
+    Returns one of NEW, PENDING, MISMATCH, DONE or RESUME, with the stored
+    response for DONE and the recorded ids (if any) for RESUME.
+    """
+    script = get_async_redis().register_script(CLAIM_SCRIPT)
+    result = await script(
+        keys=[idempotency_key(user_id, key), lease_key(user_id, key)],
+        args=[request_fingerprint, IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_PENDING_SECONDS],
+    )
+    state = result[0].decode()
+    return state, result[1] if len(result) > 1 else None
+
+
+async def record_ids(user_id: str, key: str, ids: bytes):
+    """Record the ids a claimed request is about to create, before it commits them."""
+    await get_async_redis().hset(idempotency_key(user_id, key), "ids", ids)
+
+
+async def store(user_id: str, key: str, body: bytes):
+    """Store the response of a claimed key, returned to later retries."""
+    pipeline = get_async_redis().pipeline(transaction=True)
+    pipeline.hset(idempotency_key(user_id, key), "body", body)
+    pipeline.delete(lease_key(user_id, key))
+    await pipeline.execute()
+
+
+async def release(user_id: str, key: str):
+    """
+    Release a claimed key after the request failed, so it can be retried.
+    Its recorded ids are kept for the retry to take over.
+    """
+    await get_async_redis().delete(lease_key(user_id, key))
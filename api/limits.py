@@ -0,0 +1,251 @@
+"""
+Admission control for streams and case creation.
+
+Limits are kept in Redis, so they hold across uvicorn workers and hosts:
+- open streams, per user and in total. Each stream holds a lease that it
+  refreshes while open, so the slots of streams lost with their process
+  free up on their own. A user reopening a case they already stream
+  replaces the old stream instead of taking a second slot.
+- token buckets per user on creating cases, a token per case, and on
+  opening streams.
+  A stream of a finished case closes right after sending its history, so
+  the cap on open streams alone does not bound how often they are read
+- the depth of the `clinical_cases` queue, checked by the server before
+  creating cases (QUEUE_SHED_DEPTH)
+
+A cap of 0 disables a limit. When Redis cannot be reached requests are let
+through, as every other Redis-backed feature of the API degrades.
+
+Keys:
+- limits:streams - stream ids by lease expiry, all users
+- limits:streams:{user_id} - stream ids of a user by lease expiry
+- limits:stream:{user_id}:{case_id} - id of the user's current stream of a case
+- limits:create:{user_id} - token bucket of a user's case creations
+- limits:open:{user_id} - token bucket of a user's stream opens
+"""
+import os
+import time
+import uuid
+from typing import Optional
+from dotenv import load_dotenv
+from redis import RedisError
+from events import get_async_redis
+
+load_dotenv()
+
+# Open streams per user, and across all users
+STREAM_USER_LIMIT = int(os.getenv("STREAM_USER_LIMIT", "20"))
+STREAM_GLOBAL_LIMIT = int(os.getenv("STREAM_GLOBAL_LIMIT", "5000"))
+
+# A stream's slot is freed this long after its last refresh
+STREAM_LEASE_SECONDS = int(os.getenv("STREAM_LEASE_SECONDS", "60"))
+
+# Open streams refresh their lease this often, in seconds
+STREAM_LEASE_REFRESH_SECONDS = STREAM_LEASE_SECONDS / 3
+
+# Cases a user can create per second on average, and in a burst
+CREATE_CASE_RATE = float(os.getenv("CREATE_CASE_RATE", "1"))
+CREATE_CASE_BURST = int(os.getenv("CREATE_CASE_BURST", "20"))
+
+# Streams a user can open per second on average, and in a burst
+STREAM_OPEN_RATE = float(os.getenv("STREAM_OPEN_RATE", "2"))
+STREAM_OPEN_BURST = int(os.getenv("STREAM_OPEN_BURST", "20"))
+
+# Jobs waiting in the queue beyond which new cases are turned away
+QUEUE_SHED_DEPTH = int(os.getenv("QUEUE_SHED_DEPTH", "5000"))
+
+# Retry-After of rejected streams and of requests shed on queue depth, in seconds
+STREAM_RETRY_AFTER_SECONDS = 5
+QUEUE_RETRY_AFTER_SECONDS = 30
+
+# Outcomes of `acquire_stream`
+OK = "ok"
+USER_LIMIT = "user"  # The user has STREAM_USER_LIMIT streams open
+GLOBAL_LIMIT = "global"  # STREAM_GLOBAL_LIMIT streams are open
+
+# Drops expired leases, then admits a stream under the caps. An earlier
+# stream of the same user and case is replaced and does not count.
+# KEYS: all streams, user streams, current stream of the case
+# ARGV: stream id, now, lease expiry, lease seconds, user cap, global cap
+ACQUIRE_STREAM_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[2])
+local previous = redis.call('GET', KEYS[3])
+local replaced = 0
+if previous and redis.call('ZSCORE', KEYS[2], previous) then
+    replaced = 1
+end
+local user_cap, global_cap = tonumber(ARGV[5]), tonumber(ARGV[6])
+if user_cap > 0 and redis.call('ZCARD', KEYS[2]) - replaced >= user_cap then
+    return 'user'
+end
+if global_cap > 0 and redis.call('ZCARD', KEYS[1]) - replaced >= global_cap then
+    return 'global'
+end
+if previous then
+    redis.call('ZREM', KEYS[1], previous)
+    redis.call('ZREM', KEYS[2], previous)
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+redis.call('SET', KEYS[3], ARGV[1], 'EX', ARGV[4])
+return 'ok'
+"""
+
+# Extends a lease, unless a newer stream of the same user and case replaced it.
+# Returns 0 when replaced.
+# KEYS: as for ACQUIRE_STREAM_SCRIPT
+# ARGV: stream id, lease expiry, lease seconds
+REFRESH_STREAM_SCRIPT = """
+local current = redis.call('GET', KEYS[3])
+if current and current ~= ARGV[1] then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+redis.call('SET', KEYS[3], ARGV[1], 'EX', ARGV[3])
+return 1
+"""
+
+# KEYS: as for ACQUIRE_STREAM_SCRIPT
+# ARGV: stream id
+RELEASE_STREAM_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+if redis.call('GET', KEYS[3]) == ARGV[1] then
+    redis.call('DEL', KEYS[3])
+end
+return 1
+"""
+
+# Refills a bucket for the time since its last use and takes `cost` tokens.
+# A cost above the burst is taken from a full bucket and leaves it in debt,
+# so a large request is not rejected forever but still waits its share.
+# Returns the seconds to wait before the tokens are there, "0" when taken.
+# KEYS: bucket
+# ARGV: now, rate per second, burst, cost
+TOKEN_BUCKET_SCRIPT = """
+local now, rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(state[1]) or burst
+local at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - at) * rate)
+local needed = math.min(cost, burst)
+local wait = 0
+if tokens >= needed then
+    tokens = tokens - cost
+else
+    wait = (needed - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', ARGV[1])
+-- Kept until it is full again, so that a debt is not forgiven
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 1)
+return tostring(wait)
+"""
+
+
+def stream_keys(user_id: str, case_id: str) -> list[str]:
+    """Redis keys of the stream leases of a user's stream of a case."""
+    return ["limits:streams", f"limits:streams:{user_id}", f"limits:stream:{user_id}:{case_id}"]
+
+
+def create_bucket_key(user_id: str) -> str:
+    """Key of the token bucket of a user's case creations."""
+    return f"limits:create:{user_id}"
+
+
+def open_bucket_key(user_id: str) -> str:
+    """Key of the token bucket of a user's stream opens."""
+    return f"limits:open:{user_id}"
+
+
+class StreamLease:
+    """
+    Slot of an open stream. Refresh it well within STREAM_LEASE_SECONDS and
+    release it when the stream ends.
+    """
+
+    def __init__(self, user_id: str, case_id: str, stream_id: Optional[str]):
+        self.keys = stream_keys(user_id, case_id)
+        # None when the stream was let through without Redis
+        self.stream_id = stream_id
+
+    async def refresh(self) -> bool:
+        """Extend the lease. False once a newer stream of the same case replaced this one."""
+        if self.stream_id is None:
+            return True
+        try:
+            script = get_async_redis().register_script(REFRESH_STREAM_SCRIPT)
+            return bool(await script(keys=self.keys, args=[self.stream_id, time.time() + STREAM_LEASE_SECONDS, STREAM_LEASE_SECONDS]))
+        except RedisError as e:
+            print(f"* stream limits unavailable: {e}")
+            return True
+
+    async def release(self):
+        if self.stream_id is None:
+            return
+        try:
+            script = get_async_redis().register_script(RELEASE_STREAM_SCRIPT)
+            await script(keys=self.keys, args=[self.stream_id])
+        except RedisError as e:
+            # The lease expires on its own
+            print(f"* stream limits unavailable: {e}")
+
+
+async def acquire_stream(user_id: str, case_id: str) -> tuple[str, Optional[StreamLease]]:
+    """
+    Admit a stream of a user's case under the stream caps.
+    Returns one of OK, USER_LIMIT or GLOBAL_LIMIT, and the lease for OK.
+    """
+    if not STREAM_USER_LIMIT and not STREAM_GLOBAL_LIMIT:
+        return OK, StreamLease(user_id, case_id, None)
+    stream_id = uuid.uuid4().hex
+    now = time.time()
+    try:
+        script = get_async_redis().register_script(ACQUIRE_STREAM_SCRIPT)
+        outcome = await script(
+            keys=stream_keys(user_id, case_id),
+            args=[stream_id, now, now + STREAM_LEASE_SECONDS, STREAM_LEASE_SECONDS, STREAM_USER_LIMIT, STREAM_GLOBAL_LIMIT],
+        )
+    except RedisError as e:
+        print(f"* stream limits unavailable: {e}")
+        return OK, StreamLease(user_id, case_id, None)
+    outcome = outcome.decode()
+    if outcome != OK:
+        return outcome, None
+    return OK, StreamLease(user_id, case_id, stream_id)
+
+
+async def take_token(key: str, rate: float, burst: int, cost: int = 1) -> Optional[float]:
+    """
+    Take `cost` tokens from a bucket. Returns the seconds to wait when they
+    are not there, else None. A cost above `burst` is taken from a full bucket.
+    """
+    if not rate:
+        return None
+    try:
+        script = get_async_redis().register_script(TOKEN_BUCKET_SCRIPT)
+        wait = float(await script(keys=[key], args=[time.time(), rate, burst, cost]))
+    except RedisError as e:
+        print(f"* rate limits unavailable: {e}")
+        return None
+    return wait if wait > 0 else None
+
+
+async def take_create_token(user_id: str, cases: int = 1) -> Optional[float]:
+    """Take a token per case from a user's case creation bucket, see `take_token`."""
+    return await take_token(create_bucket_key(user_id), CREATE_CASE_RATE, CREATE_CASE_BURST, cases)
+
+
+async def take_open_token(user_id: str) -> Optional[float]:
+    """Take a token from a user's stream open bucket, see `take_token`."""
+    return await take_token(open_bucket_key(user_id), STREAM_OPEN_RATE, STREAM_OPEN_BURST)
+
+
+def queue_overloaded(depth: int) -> bool:
+    """Whether new cases should be turned away at this queue depth."""
+    return bool(QUEUE_SHED_DEPTH) and depth >= QUEUE_SHED_DEPTH
@@ -0,0 +1,269 @@
+"""
+Prometheus metrics for the API server, served on /api/metrics.
+
+Covers the hot paths:
+- request latency per route
+- SQL queries and time spent in the database per request
+- connection pool occupancy and checkout wait time
+- SSE streams, frames and time to the first message
+- depth of the `clinical_cases` queue and job wait and run durations
+- hits and misses of the verified token cache, and the JWKS in use
+- hits and misses of the case response cache
+
+Everything is recorded in process with prometheus_client, and only cheap
+work happens per request: one contextvar lookup and two clock reads per SQL
+statement, and a few histogram updates per request. Queue metrics are read
+from Redis when the endpoint is scraped.
+"""
+import time
+from contextvars import ContextVar
+from typing import Callable, Optional
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+from redis import RedisError
+from rq import Queue
+from rq.job import Job
+from rq.registry import StartedJobRegistry, FailedJobRegistry, FinishedJobRegistry, DeferredJobRegistry, ScheduledJobRegistry
+from sqlalchemy import event
+import db_pool
+
+registry = CollectorRegistry()
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time until the response starts, per route",
+    ["method", "route", "status"], registry=registry,
+)
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements executed per request",
+    ["route"], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100), registry=registry,
+)
+REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds", "Time spent executing SQL per request",
+    ["route"], registry=registry,
+)
+STREAMS_ACTIVE = Gauge("sse_streams_active", "Open case streams", registry=registry)
+STREAM_FRAMES = Counter("sse_frames_total", "Frames sent on case streams", registry=registry)
+STREAM_FIRST_MESSAGE = Histogram(
+    "sse_time_to_first_message_seconds", "Time from opening a case stream to its first message frame",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300), registry=registry,
+)
+JOB_WAIT = Histogram(
+    "rq_job_wait_seconds", "Time jobs spent queued before a worker started them",
+    ["queue"], buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600), registry=registry,
+)
+JOB_RUN = Histogram(
+    "rq_job_run_seconds", "Time workers spent running jobs",
+    ["queue", "status"], buckets=(1, 5, 10, 30, 60, 120, 300, 600), registry=registry,
+)
+
+# SQL statement count and duration of the current request, None outside requests
+_request_sql: ContextVar[Optional[list]] = ContextVar("request_sql", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    request_sql = _request_sql.get()
+    if request_sql is not None:
+        request_sql[0] += 1
+        request_sql[1] += time.perf_counter() - context._metrics_start
+
+
+def instrument_engine(engine):
+    """Count the statements run on a (sync) engine towards the current request."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def uninstrument_engine(engine):
+    """Stop counting the statements of an engine instrumented by `instrument_engine`."""
+    event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+    event.remove(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and SQL usage per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        request_sql = [0, 0.0]
+        token = _request_sql.set(request_sql)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                REQUEST_LATENCY.labels(scope["method"], route_name(scope), status_code).observe(time.perf_counter() - start)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_sql.reset(token)
+            route = route_name(scope)
+            REQUEST_DB_QUERIES.labels(route).observe(request_sql[0])
+            REQUEST_DB_SECONDS.labels(route).observe(request_sql[1])
+
+
+def route_name(scope) -> str:
+    """Path template of the matched route, so label values stay bounded."""
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+
+async def track_stream(frames):
+    """Wrap an SSE frame generator to count its frames and time its first message."""
+    STREAMS_ACTIVE.inc()
+    start = time.perf_counter()
+    waiting_for_message = True
+    try:
+        async for frame in frames:
+            STREAM_FRAMES.inc()
+            # Message frames are "id: <cursor>[.<evidence cursor>]\ndata: {"type":"message",...
+            if waiting_for_message and b'"type":"message"' in frame[:64]:
+                waiting_for_message = False
+                STREAM_FIRST_MESSAGE.observe(time.perf_counter() - start)
+            yield frame
+    finally:
+        STREAMS_ACTIVE.dec()
+
+
+class PoolCollector:
+    """Exports the connection pool status reported by `db_pool`."""
+
+    def __init__(self, pools: dict):
+        # name -> (engine factory, CheckoutStats)
+        self.pools = pools
+
+    def collect(self):
+        checked_out = GaugeMetricFamily("db_pool_checked_out", "Connections checked out of the pool", labels=["pool"])
+        overflow = GaugeMetricFamily("db_pool_overflow", "Connections open beyond the pool size", labels=["pool"])
+        size = GaugeMetricFamily("db_pool_size", "Configured pool size", labels=["pool"])
+        timeouts = GaugeMetricFamily("db_pool_checkout_timeouts", "Checkouts that timed out waiting for a connection", labels=["pool"])
+        wait = HistogramMetricFamily("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", labels=["pool"])
+        for name, (get_engine, stats) in self.pools.items():
+            status = db_pool.pool_status(get_engine(), stats)
+            checked_out.add_metric([name], status["checked_out"])
+            overflow.add_metric([name], max(status["overflow"], 0))
+            size.add_metric([name], status["size"])
+            timeouts.add_metric([name], status["timeouts"])
+            wait.add_metric([name], list(status["wait_seconds_buckets"].items()), status["wait_seconds_total"])
+        return [checked_out, overflow, size, timeouts, wait]
+
+
+class AuthCollector:
+    """Exports the counters of the verified token cache and the state of the JWKS."""
+
+    def __init__(self, get_cache_stats: Callable[[], dict], get_jwks_stats: Callable[[], Optional[dict]]):
+        self.get_cache_stats = get_cache_stats
+        self.get_jwks_stats = get_jwks_stats
+
+    def collect(self):
+        cache = self.get_cache_stats()
+        hits = CounterMetricFamily("jwt_cache_hits", "Tokens found in the verified token cache")
+        hits.add_metric([], cache["hits"])
+        misses = CounterMetricFamily("jwt_cache_misses", "Tokens verified because they were not cached")
+        misses.add_metric([], cache["misses"])
+        size = GaugeMetricFamily("jwt_cache_size", "Entries in the verified token cache", value=cache["size"])
+        families = [hits, misses, size]
+        jwks = self.get_jwks_stats()
+        if jwks is not None:
+            families.append(GaugeMetricFamily("jwks_keys", "Signing keys in the JWKS", value=jwks["keys"]))
+            families.append(GaugeMetricFamily("jwks_load_failures", "Failed JWKS loads since the last good one", value=jwks["failures"]))
+            if jwks["age_seconds"] is not None:
+                families.append(GaugeMetricFamily("jwks_age_seconds", "Age of the JWKS in use", value=jwks["age_seconds"]))
+        return families
+
+
+class CaseCacheCollector:
+    """Exports the hits and misses of the case response cache."""
+
+    def __init__(self, get_stats: Callable[[], dict]):
+        self.get_stats = get_stats
+
+    def collect(self):
+        stats = self.get_stats()
+        hits = CounterMetricFamily("case_cache_hits", "Case responses served from the cache", labels=["tier"])
+        hits.add_metric(["local"], stats["local_hits"])
+        hits.add_metric(["redis"], stats["redis_hits"])
+        hits.add_metric(["etag"], stats["etag_hits"])
+        misses = CounterMetricFamily("case_cache_misses", "Case responses not found in the cache")
+        misses.add_metric([], stats["misses"])
+        return [
+            hits,
+            misses,
+            GaugeMetricFamily("case_cache_hit_ratio", "Share of case cache lookups that hit", value=stats["hit_rate"]),
+            GaugeMetricFamily("case_cache_local_entries", "Case responses in the in-process tier", value=stats["local_size"]),
+        ]
+
+
+class QueueCollector:
+    """Exports the depth of an RQ queue and its registries."""
+
+    def __init__(self, get_queue: Callable[[], Queue]):
+        self.get_queue = get_queue
+
+    def collect(self):
+        depth = GaugeMetricFamily("rq_jobs", "Jobs per state", labels=["queue", "state"])
+        queue = self.get_queue()
+        name = queue.name
+        connection = queue.connection
+        try:
+            depth.add_metric([name, "queued"], queue.count)
+            for state, registry_class in (
+                ("started", StartedJobRegistry),
+                ("deferred", DeferredJobRegistry),
+                ("scheduled", ScheduledJobRegistry),
+                ("failed", FailedJobRegistry),
+            ):
+                depth.add_metric([name, state], registry_class(name, connection=connection).count)
+        except RedisError as e:
+            # The rest of the metrics are still worth scraping
+            print(f"* failed to collect queue metrics: {e}")
+            return []
+        return [depth]
+
+
+class JobDurationTracker:
+    """
+    Observes wait and run durations of the jobs that ended since the last call.
+
+    Finished and failed jobs stay in their registries for their result TTL,
+    so only the ids not seen on the previous call are fetched.
+    """
+
+    def __init__(self, get_queue: Callable[[], Queue]):
+        self.get_queue = get_queue
+        self.seen = set()
+
+    def update(self):
+        queue = self.get_queue()
+        connection = queue.connection
+        ended = {}
+        for status, registry_class in (("finished", FinishedJobRegistry), ("failed", FailedJobRegistry)):
+            for job_id in registry_class(queue.name, connection=connection).get_job_ids():
+                ended[job_id] = status
+
+        new_ids = [job_id for job_id in ended if job_id not in self.seen]
+        for job in Job.fetch_many(new_ids, connection=connection):
+            if job is None or job.started_at is None:
+                continue
+            if job.enqueued_at is not None:
+                JOB_WAIT.labels(queue.name).observe((job.started_at - job.enqueued_at).total_seconds())
+            if job.ended_at is not None:
+                JOB_RUN.labels(queue.name, ended[job.id]).observe((job.ended_at - job.started_at).total_seconds())
+        self.seen = set(ended)
+
+
+def render() -> tuple[bytes, str]:
+    """Metrics in the Prometheus text format and their content type."""
+    return generate_latest(registry), CONTENT_TYPE_LATEST
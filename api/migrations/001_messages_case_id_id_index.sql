@@ -0,0 +1,3 @@
+-- Composite index used by the cursor-based message fetch:
+-- messages of a case with id > cursor, ordered by id.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_case_id_id ON messages (case_id, id);
@@ -0,0 +1,3 @@
+-- Composite index used by the keyset pagination of GET /api/cases:
+-- a user's cases ordered by (created_at, id) descending.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_cases_user_id_created_at_id ON cases (user_id, created_at DESC, id DESC);
@@ -0,0 +1,28 @@
+-- Store the JSON blobs as JSONB and add stored generated columns (with
+-- indexes) for the fields that are filtered and sorted on in SQL.
+-- Rewrites the tables: run it in a maintenance window on large databases.
+
+ALTER TABLE cases ALTER COLUMN data_json TYPE jsonb USING data_json::jsonb;
+ALTER TABLE messages ALTER COLUMN message_data_json TYPE jsonb USING message_data_json::jsonb;
+ALTER TABLE evidence_snippets ALTER COLUMN snippet_data_json TYPE jsonb USING snippet_data_json::jsonb;
+
+ALTER TABLE cases
+    ADD COLUMN IF NOT EXISTS title text GENERATED ALWAYS AS (data_json ->> 'title') STORED;
+
+ALTER TABLE messages
+    ADD COLUMN IF NOT EXISTS message_type text GENERATED ALWAYS AS (message_data_json ->> 'message_type') STORED,
+    ADD COLUMN IF NOT EXISTS stage text GENERATED ALWAYS AS (message_data_json ->> 'stage') STORED,
+    ADD COLUMN IF NOT EXISTS from_id text GENERATED ALWAYS AS (message_data_json ->> 'from_id') STORED;
+
+ALTER TABLE evidence_snippets
+    ADD COLUMN IF NOT EXISTS source_id text GENERATED ALWAYS AS (snippet_data_json ->> 'source_id') STORED,
+    ADD COLUMN IF NOT EXISTS snippet_index bigint GENERATED ALWAYS AS (
+        CASE WHEN jsonb_typeof(snippet_data_json -> 'index') = 'number'
+        THEN (snippet_data_json ->> 'index')::numeric::bigint END
+    ) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_cases_user_id_title ON cases (user_id, title);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_case_id_stage ON messages (case_id, stage);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_case_id_message_type ON messages (case_id, message_type);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_evidence_snippets_source_id ON evidence_snippets (source_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_evidence_snippets_case_id_snippet_index ON evidence_snippets (case_id, snippet_index);
@@ -0,0 +1,50 @@
+-- Store the content of evidence sources once in evidence_sources, keyed by a
+-- hash of the source id, text, type, URL and citation, and reference it from the snippets, which keep
+-- only their case-specific fields (index, source_id).
+-- The backfill rewrites evidence_snippets: run it in a maintenance window on
+-- large databases, and VACUUM FULL the table afterwards to reclaim the space.
+
+CREATE TABLE IF NOT EXISTS evidence_sources (
+    source_hash varchar PRIMARY KEY,
+    source_data_json jsonb,
+    created_at timestamp without time zone NOT NULL
+);
+
+ALTER TABLE evidence_snippets
+    ADD COLUMN IF NOT EXISTS source_hash varchar REFERENCES evidence_sources (source_hash);
+
+-- Same hash as database.evidence_source_hash
+CREATE OR REPLACE FUNCTION pg_temp.evidence_source_hash(snippet_data jsonb) RETURNS varchar AS $$
+    SELECT encode(sha256(convert_to(
+        concat_ws(E'\x1f',
+            coalesce(snippet_data ->> 'source_id', ''),
+            coalesce(snippet_data ->> 'text', ''),
+            coalesce(snippet_data ->> 'source_type', ''),
+            coalesce(snippet_data ->> 'source_url', ''),
+            coalesce(snippet_data ->> 'source_citation', '')
+        ), 'UTF8'
+    )), 'hex')
+$$ LANGUAGE sql IMMUTABLE;
+
+INSERT INTO evidence_sources (source_hash, source_data_json, created_at)
+SELECT DISTINCT ON (1)
+    pg_temp.evidence_source_hash(snippet_data_json),
+    jsonb_build_object(
+        'source_id', snippet_data_json -> 'source_id',
+        'text', snippet_data_json -> 'text',
+        'source_type', snippet_data_json -> 'source_type',
+        'source_url', snippet_data_json -> 'source_url',
+        'source_citation', snippet_data_json -> 'source_citation'
+    ),
+    created_at
+FROM evidence_snippets
+WHERE source_hash IS NULL AND snippet_data_json ->> 'text' IS NOT NULL
+ORDER BY 1, created_at
+ON CONFLICT (source_hash) DO NOTHING;
+
+UPDATE evidence_snippets
+SET source_hash = pg_temp.evidence_source_hash(snippet_data_json),
+    snippet_data_json = snippet_data_json - 'text' - 'source_type' - 'source_url' - 'source_citation'
+WHERE source_hash IS NULL AND snippet_data_json ->> 'text' IS NOT NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_evidence_snippets_source_hash ON evidence_snippets (source_hash);
@@ -0,0 +1,26 @@
+-- Full-text search for /api/search: stored generated tsvector columns with
+-- GIN indexes over case titles, message text and evidence source text and
+-- citations. Must match SEARCH_TEXT in database.py.
+-- Rewrites the tables: run it in a maintenance window on large databases.
+
+ALTER TABLE cases
+    ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        to_tsvector('english'::regconfig, left(coalesce(data_json ->> 'title', ''), 100000))
+    ) STORED;
+
+ALTER TABLE messages
+    ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        to_tsvector('english'::regconfig, left(coalesce(message_data_json ->> 'text', ''), 100000))
+    ) STORED;
+
+ALTER TABLE evidence_sources
+    ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        to_tsvector('english'::regconfig, left(
+            coalesce(source_data_json ->> 'text', '') || ' ' || coalesce(source_data_json ->> 'source_citation', ''),
+            100000
+        ))
+    ) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_cases_search_vector ON cases USING gin (search_vector);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_search_vector ON messages USING gin (search_vector);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_evidence_sources_search_vector ON evidence_sources USING gin (search_vector);
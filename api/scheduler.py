@@ -0,0 +1,343 @@
+"""
+Priority lanes and per-user fair scheduling in front of the `clinical_cases` queue.
+
+Cases are not pushed straight onto the RQ queue. They wait in one of three
+lanes, in this order of priority:
+- interactive: cases created one at a time by a clinician
+- retry: failed cases being retried (up to SCHEDULER_MAX_RETRIES, off by default)
+- batch: cases created in bulk, e.g. evaluation runs
+
+Within a lane, users take turns (round-robin), and a user never has more than
+SCHEDULER_USER_INFLIGHT cases dispatched at once. The interactive lane has a
+higher cap of its own, SCHEDULER_INTERACTIVE_INFLIGHT, so that a clinician's
+batch cases do not hold up the case they are waiting on, while a user
+creating cases one at a time in a loop is still held back. The dispatcher
+(`python scheduler.py`) keeps only a few jobs on the RQ queue, so that these
+decisions are made as late as possible and one user's 2,000 batch cases
+cannot get ahead of everyone else.
+
+State lives in Redis next to the queue:
+- sched:lane:{lane}:ring - users with pending cases in the lane, in turn order
+- sched:lane:{lane}:user:{user_id} - pending case ids of a user, oldest first
+- sched:case:{case_id} - user, lane, question and attempts of a case, and
+  whether its job was enqueued
+- sched:inflight:{user_id} - dispatched cases of a user that have not ended
+- sched:inflight_users - users with dispatched cases
+
+A case is picked and its job enqueued in two steps. If the dispatcher stops
+in between, the next round finds the case in flight without a job and puts it
+back at the front of its user's list.
+
+Usage:
+    python scheduler.py
+"""
+import os
+import time
+from typing import Optional
+from dotenv import load_dotenv
+from redis import Redis
+from rq import Queue
+from rq.job import Job, JobStatus
+
+load_dotenv()
+
+# Route cases through the scheduler, which then needs a running dispatcher
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "0") == "1"
+
+# Lanes in order of priority
+INTERACTIVE = "interactive"
+RETRY = "retry"
+BATCH = "batch"
+LANES = (INTERACTIVE, RETRY, BATCH)
+
+# Dispatched cases per user that have not ended yet
+SCHEDULER_USER_INFLIGHT = int(os.getenv("SCHEDULER_USER_INFLIGHT", "5"))
+
+# The same cap for the interactive lane, counting the user's cases of every lane
+SCHEDULER_INTERACTIVE_INFLIGHT = int(os.getenv("SCHEDULER_INTERACTIVE_INFLIGHT", "10"))
+
+# Jobs kept on the RQ queue, enough to keep every worker busy between dispatches
+SCHEDULER_QUEUE_DEPTH = int(os.getenv("SCHEDULER_QUEUE_DEPTH", "10"))
+
+# Times a failed case is put back on the retry lane
+SCHEDULER_MAX_RETRIES = int(os.getenv("SCHEDULER_MAX_RETRIES", "0"))
+
+# Seconds between two dispatch rounds
+DISPATCH_INTERVAL = 0.2
+
+# Maximum run time of a case processing job, as for directly enqueued jobs
+JOB_TIMEOUT = '10m'
+
+ENDED_JOB_STATUSES = (JobStatus.FINISHED, JobStatus.FAILED, JobStatus.STOPPED, JobStatus.CANCELED)
+
+# Appends cases to a user's list in a lane (or puts them back at its front),
+# entering the user in the ring when they had nothing pending there.
+# KEYS[1]: the lane's ring, KEYS[2]: the user's list in the lane, KEYS[3..]: the cases' hashes
+# ARGV: lane, user_id, "1" to push at the front, then case_id, question pairs
+SUBMIT_SCRIPT = """
+local lane, user, push = ARGV[1], ARGV[2], ARGV[3] == '1' and 'LPUSH' or 'RPUSH'
+if redis.call('LLEN', KEYS[2]) == 0 then
+    redis.call('RPUSH', KEYS[1], user)
+end
+for i = 3, #KEYS do
+    local case_id = ARGV[2 * i - 2]
+    redis.call('HSET', KEYS[i], 'user_id', user, 'lane', lane, 'question', ARGV[2 * i - 1])
+    redis.call('HSETNX', KEYS[i], 'attempts', 0)
+    redis.call('HDEL', KEYS[i], 'dispatched')
+    redis.call(push, KEYS[2], case_id)
+end
+return #KEYS - 2
+"""
+
+# Gives the user at the head of a lane's ring their turn: takes their oldest
+# case unless they are at the in-flight cap. Users rotate to the back of the
+# ring after their turn, and leave it when they have nothing left.
+# KEYS[1]: the lane's ring, KEYS[2]: the user's list in the lane,
+# KEYS[3]: the user's in-flight set, KEYS[4]: the set of users with cases in flight
+# ARGV: user_id, in-flight cap (0 for none)
+TAKE_TURN_SCRIPT = """
+local user, cap = ARGV[1], tonumber(ARGV[2])
+if redis.call('LINDEX', KEYS[1], 0) ~= user then
+    return false
+end
+redis.call('LPOP', KEYS[1])
+if cap > 0 and redis.call('SCARD', KEYS[3]) >= cap then
+    redis.call('RPUSH', KEYS[1], user)
+    return false
+end
+local case_id = redis.call('LPOP', KEYS[2])
+if redis.call('LLEN', KEYS[2]) > 0 then
+    redis.call('RPUSH', KEYS[1], user)
+end
+if not case_id then
+    return false
+end
+redis.call('SADD', KEYS[3], case_id)
+redis.call('SADD', KEYS[4], user)
+return case_id
+"""
+
+INFLIGHT_USERS_KEY = "sched:inflight_users"
+
+
+def ring_key(lane: str) -> str:
+    return f"sched:lane:{lane}:ring"
+
+
+def user_key(lane: str, user_id: str) -> str:
+    return f"sched:lane:{lane}:user:{user_id}"
+
+
+def case_key(case_id: str) -> str:
+    return f"sched:case:{case_id}"
+
+
+def inflight_key(user_id: str) -> str:
+    return f"sched:inflight:{user_id}"
+
+
+class Scheduler:
+    """Fair, lane-based admission of cases onto an RQ queue."""
+
+    def __init__(self, queue: Queue):
+        self.queue = queue
+        self.redis: Redis = queue.connection
+        self.submit_script = self.redis.register_script(SUBMIT_SCRIPT)
+        self.take_turn_script = self.redis.register_script(TAKE_TURN_SCRIPT)
+
+    def submit(self, lane: str, user_id: str, cases: list[tuple[str, str]], front: bool = False):
+        """Add (case_id, question) pairs of a user to a lane, in order, at the back or the `front`."""
+        if not cases:
+            return
+        if front:
+            # Pushed one by one, each ahead of the previous
+            cases = cases[::-1]
+        args = [lane, user_id, "1" if front else "0"]
+        for case_id, question in cases:
+            args += [case_id, question]
+        keys = [ring_key(lane), user_key(lane, user_id), *(case_key(case_id) for case_id, _ in cases)]
+        self.submit_script(keys=keys, args=args)
+
+    def queue_position(self, case_id: str) -> Optional[int]:
+        """Estimated position of a pending case, None once it has been dispatched."""
+        return self.queue_positions([case_id])[0]
+
+    def queue_positions(self, case_ids: list[str]) -> list[Optional[int]]:
+        """
+        Estimated 1-based positions of pending cases, None for those already
+        dispatched: every case in higher priority lanes, the case's
+        predecessors in its user's list, and for every other user of the lane
+        as many cases as get a turn before it. Two round-trips.
+        """
+        pipeline = self.redis.pipeline(transaction=True)
+        for lane in LANES:
+            pipeline.lrange(ring_key(lane), 0, -1)
+        for case_id in case_ids:
+            pipeline.hmget(case_key(case_id), "user_id", "lane")
+        results = pipeline.execute()
+        rings = {lane: [user.decode() for user in ring] for lane, ring in zip(LANES, results)}
+        cases = [
+            (user.decode(), lane.decode()) if user is not None else None
+            for user, lane in results[len(LANES):]
+        ]
+
+        pipeline = self.redis.pipeline(transaction=True)
+        for lane in LANES:
+            for user_id in rings[lane]:
+                pipeline.llen(user_key(lane, user_id))
+        for case_id, case in zip(case_ids, cases):
+            if case is not None:
+                pipeline.lpos(user_key(case[1], case[0]), case_id)
+        results = iter(pipeline.execute())
+        pending = {lane: {user_id: next(results) for user_id in rings[lane]} for lane in LANES}
+
+        positions = []
+        for case in cases:
+            index = next(results) if case is not None else None
+            if index is None:
+                positions.append(None)
+                continue
+            user_id, case_lane = case
+            ahead = index
+            for lane in LANES:
+                if lane == case_lane:
+                    # Users before this one in the ring get one more turn than those after it
+                    turn = rings[lane].index(user_id) if user_id in rings[lane] else 0
+                    for order, (other, count) in enumerate(pending[lane].items()):
+                        if other != user_id:
+                            ahead += min(count, index + 1 if order < turn else index)
+                    break
+                ahead += sum(pending[lane].values())
+            positions.append(ahead + 1)
+        return positions
+
+    def pending_count(self) -> int:
+        """Number of cases waiting in the lanes, not yet dispatched. Two round-trips."""
+        pipeline = self.redis.pipeline(transaction=True)
+        for lane in LANES:
+            pipeline.lrange(ring_key(lane), 0, -1)
+        rings = pipeline.execute()
+        pipeline = self.redis.pipeline(transaction=True)
+        for lane, ring in zip(LANES, rings):
+            for user in ring:
+                pipeline.llen(user_key(lane, user.decode()))
+        return sum(pipeline.execute())
+
+    def is_tracked(self, case_id: str) -> bool:
+        """Whether a case is pending or dispatched and not yet ended."""
+        return bool(self.redis.exists(case_key(case_id)))
+
+    def pick(self) -> Optional[tuple[str, str]]:
+        """
+        Take the next case to dispatch: the first lane with an eligible user,
+        the first user in turn, their oldest case. Users at SCHEDULER_USER_INFLIGHT
+        dispatched cases are skipped, in the interactive lane only once they
+        are at SCHEDULER_INTERACTIVE_INFLIGHT.
+        Returns (case_id, user_id), None when no case is eligible.
+        """
+        for lane in LANES:
+            cap = SCHEDULER_INTERACTIVE_INFLIGHT if lane == INTERACTIVE else SCHEDULER_USER_INFLIGHT
+            ring = ring_key(lane)
+            for _ in range(self.redis.llen(ring)):
+                user = self.redis.lindex(ring, 0)
+                if user is None:
+                    break
+                user_id = user.decode()
+                case_id = self.take_turn_script(
+                    keys=[ring, user_key(lane, user_id), inflight_key(user_id), INFLIGHT_USERS_KEY],
+                    args=[user_id, cap],
+                )
+                if case_id:
+                    return case_id.decode(), user_id
+        return None
+
+    def dispatch(self) -> int:
+        """Move cases onto the RQ queue until it holds SCHEDULER_QUEUE_DEPTH jobs. Returns the number moved."""
+        dispatched = 0
+        while self.queue.count < SCHEDULER_QUEUE_DEPTH:
+            picked = self.pick()
+            if picked is None:
+                break
+            case_id, user_id = picked
+            question = self.redis.hget(case_key(case_id), "question").decode()
+            # The job and the mark that it exists are written in one transaction:
+            # a case in flight without the mark was lost on its way to the queue
+            pipeline = self.redis.pipeline(transaction=True)
+            self.queue.enqueue_many([Queue.prepare_data(
+                'worker.process_case',
+                kwargs=dict(case_id=case_id, user_id=user_id, question=question),
+                job_id=case_id,
+                timeout=JOB_TIMEOUT
+            )], pipeline=pipeline)
+            pipeline.hset(case_key(case_id), "dispatched", 1)
+            pipeline.execute()
+            dispatched += 1
+        return dispatched
+
+    def release_ended(self) -> int:
+        """
+        Drop ended jobs from the in-flight sets, freeing their users' slots.
+        Failed cases go to the retry lane while they have retries left.
+        Returns the number of ended jobs.
+        """
+        ended = 0
+        for user in self.redis.smembers(INFLIGHT_USERS_KEY):
+            user_id = user.decode()
+            inflight = inflight_key(user_id)
+            case_ids = [case_id.decode() for case_id in self.redis.smembers(inflight)]
+            jobs = Job.fetch_many(case_ids, connection=self.redis)
+            for case_id, job in zip(case_ids, jobs):
+                status = job.get_status(refresh=False) if job else None
+                if job is not None and status not in ENDED_JOB_STATUSES:
+                    continue
+                self.redis.srem(inflight, case_id)
+                if job is None and not self.redis.hexists(case_key(case_id), "dispatched"):
+                    # Picked, but the dispatcher stopped before its job was enqueued
+                    self.resubmit(case_id, user_id)
+                    continue
+                ended += 1
+                self.ended(case_id, user_id, status)
+            if not self.redis.scard(inflight):
+                self.redis.srem(INFLIGHT_USERS_KEY, user_id)
+        return ended
+
+    def resubmit(self, case_id: str, user_id: str):
+        """Put a case that was picked but never enqueued back at the front of its user's list."""
+        lane, question = self.redis.hmget(case_key(case_id), "lane", "question")
+        if lane is None:
+            return
+        print(f"[Scheduler] Case {case_id} was never enqueued, putting it back")
+        self.submit(lane.decode(), user_id, [(case_id, question.decode())], front=True)
+
+    def ended(self, case_id: str, user_id: str, status: Optional[JobStatus]):
+        attempts = self.redis.hincrby(case_key(case_id), "attempts", 1)
+        if status == JobStatus.FAILED and attempts <= SCHEDULER_MAX_RETRIES:
+            question = self.redis.hget(case_key(case_id), "question").decode()
+            print(f"[Scheduler] Retrying case {case_id} (attempt {attempts + 1})")
+            # The retry is enqueued under the same job id
+            self.queue.failed_job_registry.remove(case_id)
+            self.submit(RETRY, user_id, [(case_id, question)])
+        else:
+            self.redis.delete(case_key(case_id))
+
+    def run(self):
+        """Dispatch cases until interrupted."""
+        print(f"[Scheduler] Dispatching to '{self.queue.name}', {SCHEDULER_USER_INFLIGHT} in flight per user")
+        while True:
+            self.release_ended()
+            self.dispatch()
+            time.sleep(DISPATCH_INTERVAL)
+
+
+def main():
+    """Run the dispatcher for the clinical_cases queue."""
+    redis_conn = Redis(host='localhost', port=6379, db=0)
+    scheduler = Scheduler(Queue('clinical_cases', connection=redis_conn))
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        print("[Scheduler] Stopped")
+
+
+if __name__ == '__main__':
+    main()
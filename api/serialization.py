@@ -0,0 +1,30 @@
+"""
+JSON encoding shared by the event stream and the REST endpoints.
+
+Set FAST_SERIALIZATION=1 to encode with orjson (when installed), and to let
+the case endpoints write trusted database output directly instead of
+re-validating it through their Pydantic response models.
+"""
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "0") == "1" and orjson is not None
+
+
+def dumps(obj) -> bytes:
+    """Encode an object as compact JSON bytes."""
+    if FAST_SERIALIZATION:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def loads(data: bytes):
+    """Decode JSON bytes or text."""
+    if FAST_SERIALIZATION:
+        return orjson.loads(data)
+    return json.loads(data)
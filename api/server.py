@@ -1,23 +1,56 @@
 """
 API server for clinical case management with streaming support.
 """
-import json
 import asyncio
+import math
+import os
 import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
 from typing import Optional, Annotated
-from fastapi import FastAPI, HTTPException, status, Depends
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, status, Depends, Query, Request, Header
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-from redis import Redis
+from redis import Redis, RedisError
 from rq import Queue
+from rq.exceptions import NoSuchJobError
+from rq.job import Job, JobStatus
+from sqlalchemy.engine import Engine
 from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+import archive
 import database
-from sqlmodel import Session
-from auth import get_current_user, get_user_id
+import async_database
+import db_pool
+import export
+import metrics
+import idempotency
+import limits
+import scheduler
+from auth import get_current_user, get_user_id, get_token_cache_stats, get_jwks_stats
+from events import CaseSubscription
+from cache import case_cache, etag_matches, make_etag, CACHEABLE_STATUSES
+import serialization
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Open DB_POOL_WARMUP database connections on startup, if set.
+    Release pooled connections and the queue's Redis connection on shutdown.
+    """
+    if db_pool.DB_POOL_WARMUP:
+        await db_pool.warm_up(async_database.get_async_engine())
+        print(f"* opened {db_pool.DB_POOL_WARMUP} database connection(s)")
+    yield
+    await async_database.dispose_async_engine()
+    database.dispose_engine()
+    if _redis_conn is not None:
+        _redis_conn.close()
 
 
-app = FastAPI(title="Clinical Case Management API")
+app = FastAPI(title="Clinical Case Management API", lifespan=lifespan)
 
 # Enable CORS
 app.add_middleware(
@@ -28,9 +61,83 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Redis connection for job queue
-redis_conn = Redis(host='localhost', port=6379, db=0)
-job_queue = Queue('clinical_cases', connection=redis_conn)
+# Per-route latency and SQL usage
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Redis connection, job queue and scheduler, created on first use
+_redis_conn: Optional[Redis] = None
+_job_queue: Optional[Queue] = None
+_case_scheduler: Optional[scheduler.Scheduler] = None
+
+
+def get_redis_conn() -> Redis:
+    """Redis connection of the job queue."""
+    global _redis_conn
+    if _redis_conn is None:
+        _redis_conn = Redis(host='localhost', port=6379, db=0)
+    return _redis_conn
+
+
+def get_job_queue() -> Queue:
+    """The `clinical_cases` job queue."""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = Queue('clinical_cases', connection=get_redis_conn())
+    return _job_queue
+
+
+def get_case_scheduler() -> scheduler.Scheduler:
+    """Lanes and per-user fairness in front of the job queue, see `scheduler`."""
+    global _case_scheduler
+    if _case_scheduler is None:
+        _case_scheduler = scheduler.Scheduler(get_job_queue())
+    return _case_scheduler
+
+
+def __getattr__(name: str):
+    # `server.redis_conn`, `server.job_queue` and `server.case_scheduler` are created on first access
+    factories = {"redis_conn": get_redis_conn, "job_queue": get_job_queue, "case_scheduler": get_case_scheduler}
+    if name in factories:
+        return factories[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Metrics of the database engines and the job queue. Statements are counted
+# on every engine, whenever it gets created
+metrics.instrument_engine(Engine)
+metrics.registry.register(metrics.PoolCollector({
+    "async": (lambda: async_database.get_async_engine().sync_engine, db_pool.async_stats),
+    "sync": (database.get_engine, db_pool.sync_stats),
+}))
+metrics.registry.register(metrics.QueueCollector(get_job_queue))
+metrics.registry.register(metrics.AuthCollector(get_token_cache_stats, get_jwks_stats))
+metrics.registry.register(metrics.CaseCacheCollector(case_cache.stats))
+job_durations = metrics.JobDurationTracker(get_job_queue)
+
+# Statuses after which a case no longer changes
+FINAL_STATUSES = ('COMPLETED', 'ERROR')
+
+# Job states in which a case can still change
+ACTIVE_JOB_STATUSES = (JobStatus.QUEUED, JobStatus.STARTED, JobStatus.DEFERRED, JobStatus.SCHEDULED)
+
+# Streams stay open while the case job is active, up to this hard limit
+STREAM_MAX_SECONDS = int(os.getenv("STREAM_MAX_SECONDS", "3600"))
+
+# Idle streams send a comment line this often so proxies keep them open
+STREAM_KEEPALIVE_SECONDS = float(os.getenv("STREAM_KEEPALIVE_SECONDS", "15"))
+
+# How often an idle stream checks that the case job is still active
+JOB_CHECK_SECONDS = 5
+
+# Polling fallback delay per case status, (initial, maximum) in seconds.
+# The delay doubles while nothing changes and resets on new data.
+POLL_INTERVALS = {'PROCESSING': (0.25, 2.0)}
+DEFAULT_POLL_INTERVAL = (1.0, 5.0)
+
+SSE_KEEPALIVE = b": keepalive\n\n"
+
+# Maximum number of cases created by one bulk request
+MAX_BULK_CASES = 1000
 
 
 # Pydantic models for request/response validation
@@ -49,6 +156,15 @@ class CreateCaseResponse(BaseModel):
     title: str
     created_at: str
     job_id: str
+    queue_position: Optional[int] = None
+
+
+class CreateCasesRequest(BaseModel):
+    cases: list[CreateCaseRequest] = Field(..., min_length=1, max_length=MAX_BULK_CASES)
+
+
+class CreateCasesResponse(BaseModel):
+    cases: list[CreateCaseResponse]
 
 
 class CaseResponse(BaseModel):
@@ -59,6 +175,21 @@ class CaseResponse(BaseModel):
     evidence_snippets: list
     created_at: str
     updated_at: str
+    next_cursor: Optional[int] = None
+    evidence_sources: Optional[dict] = None
+
+
+class SearchResult(BaseModel):
+    kind: str
+    case_id: str
+    id: str
+    rank: float
+    highlight: Optional[str]
+
+
+class SearchResponse(BaseModel):
+    results: list[SearchResult]
+    next_cursor: Optional[str] = None
 
 
 class CaseListItem(BaseModel):
@@ -71,21 +202,213 @@ class CaseListItem(BaseModel):
 
 class CaseListResponse(BaseModel):
     cases: list[CaseListItem]
+    next_cursor: Optional[str] = None
     
 
 
-def get_session():
+async def get_session():
     """
-    FastAPI dependency that provides a database session.
-    The session is automatically committed and closed after the request.
+    FastAPI dependency that provides an async database session.
+    The session is automatically closed after the request.
     """
-    with Session(database.engine) as session:
+    async with async_database.async_session() as session:
         yield session
 
 
 # Type alias for FastAPI dependency injection
 # This combines the type hint and dependency in one annotation
-SessionDep = Annotated[Session, Depends(get_session)]
+SessionDep = Annotated[AsyncSession, Depends(get_session)]
+
+
+def sse_frame(event: dict, event_id: Optional[str] = None) -> bytes:
+    """Encode an event as a Server-Sent Events data frame."""
+    return sse_data(serialization.dumps(event), event_id)
+
+
+def sse_data(payload: bytes, event_id: Optional[str] = None) -> bytes:
+    """
+    Wrap an already encoded event in a Server-Sent Events data frame.
+    The `id:` line is the stream position, echoed back as Last-Event-ID on reconnect.
+    """
+    if event_id is None:
+        return b"data: " + payload + b"\n\n"
+    return b"id: %b\ndata: %b\n\n" % (event_id.encode(), payload)
+
+
+def stream_event_id(cursor: Optional[int], evidence_cursor: Optional[int] = None) -> str:
+    """
+    SSE id of a stream position: the cursor of the last message sent, followed
+    by the cursor of the last evidence snippet once one was sent ("42.17").
+    """
+    if evidence_cursor is None:
+        return str(cursor or 0)
+    return f"{cursor or 0}.{evidence_cursor}"
+
+
+def parse_last_event_id(last_event_id: Optional[str]) -> Optional[tuple[int, Optional[int]]]:
+    """
+    Message and evidence cursors to resume a stream from, None for a fresh
+    stream or an unusable id. An id without an evidence cursor means no
+    evidence was sent yet.
+    """
+    if not last_event_id:
+        return None
+    cursor, _, evidence_cursor = last_event_id.partition(".")
+    try:
+        return int(cursor), int(evidence_cursor) if evidence_cursor else None
+    except ValueError:
+        return None
+
+
+def case_job_active(case_id: str) -> bool:
+    """Whether the processing job of a case is still queued or running."""
+    try:
+        job = Job.fetch(case_id, connection=get_redis_conn())
+    except NoSuchJobError:
+        # Not dispatched yet, or being retried
+        return scheduler.SCHEDULER_ENABLED and get_case_scheduler().is_tracked(case_id)
+    return job.get_status(refresh=False) in ACTIVE_JOB_STATUSES
+
+
+def jobless_cases(case_ids: list[str]) -> set[str]:
+    """The cases among `case_ids` that have no queued or running job."""
+    return {case_id for case_id in case_ids if not case_job_active(case_id)}
+
+
+def case_queue_position(case_id: str) -> Optional[int]:
+    """1-based position of a case waiting to be processed, None once a worker picked it up."""
+    if scheduler.SCHEDULER_ENABLED:
+        position = get_case_scheduler().queue_position(case_id)
+        if position is not None:
+            # Jobs already dispatched are picked up first
+            return position + get_job_queue().count
+    position = get_job_queue().get_job_position(case_id)
+    return position + 1 if position is not None else None
+
+
+async def waiting_position(case_id: str, case_status: str) -> Optional[int]:
+    """Queue position of a case that has not been picked up yet, None otherwise."""
+    if case_status != 'CREATED':
+        return None
+    return await asyncio.to_thread(case_queue_position, case_id)
+
+
+def queue_depth() -> int:
+    """Cases waiting for a worker: jobs on the queue and cases held back by the scheduler."""
+    depth = get_job_queue().count
+    if scheduler.SCHEDULER_ENABLED:
+        depth += get_case_scheduler().pending_count()
+    return depth
+
+
+async def check_queue_depth():
+    """Turn new cases away with a 503 while the queue is too deep to take them in time."""
+    if not limits.QUEUE_SHED_DEPTH:
+        return
+    if limits.queue_overloaded(await asyncio.to_thread(queue_depth)):
+        raise HTTPException(
+            status_code=503,
+            detail="Too many cases are waiting to be processed, try again later",
+            headers={"Retry-After": str(limits.QUEUE_RETRY_AFTER_SECONDS)}
+        )
+
+
+async def holding_lease(frames, lease: limits.StreamLease):
+    """Forward the frames of a stream, and free its slot once it ends or the client leaves."""
+    try:
+        async for frame in frames:
+            yield frame
+    finally:
+        await lease.release()
+
+
+async def refresh_stream_lease(lease: Optional[limits.StreamLease]) -> bool:
+    """Extend the lease of an open stream. False once the user reopened the case elsewhere."""
+    return lease is None or await lease.refresh()
+
+
+def status_event(case_status: str, queue_position: Optional[int] = None) -> dict:
+    """Stream event of a case status, with the queue position while the case waits."""
+    event = {'type': 'status', 'status': case_status}
+    if queue_position is not None:
+        event['queue_position'] = queue_position
+    return event
+
+
+async def poll_case_events(
+    case_id: str,
+    user_id: str,
+    cursor: Optional[int] = None,
+    evidence_cursor: Optional[int] = None,
+    last_status: Optional[str] = None,
+    lease: Optional[limits.StreamLease] = None
+):
+    """
+    Fallback stream that polls the database.
+    Only used when the Redis pub/sub channel cannot be reached.
+    """
+    event_id = stream_event_id(cursor, evidence_cursor)
+    loop = asyncio.get_running_loop()
+    started = last_sent = next_job_check = loop.time()
+    next_lease_refresh = started + limits.STREAM_LEASE_REFRESH_SECONDS
+    delay = None
+
+    while loop.time() - started < STREAM_MAX_SECONDS:
+        # Create a new session for each iteration
+        async with async_database.async_session() as db:
+            # Get case status
+            case = await async_database.get_case(db, case_id, user_id)
+            if not case:
+                return
+
+            # Get new messages and evidence since last check (filtered by user_id)
+            new_events = await async_database.get_case_events(db, case_id, user_id, cursor, evidence_cursor)
+
+        # Send new messages and evidence
+        for event in new_events:
+            if event['type'] == 'message':
+                cursor = event['cursor']
+            else:
+                evidence_cursor = event['cursor']
+            event_id = stream_event_id(cursor, evidence_cursor)
+            yield sse_frame(event, event_id)
+
+        # Send status update, only when it changed
+        changed = case.status != last_status
+        if changed:
+            last_status = case.status
+            yield sse_frame({'type': 'status', 'status': case.status}, event_id)
+
+        # If case is completed or errored, send final event and close
+        if case.status in FINAL_STATUSES:
+            yield sse_frame({'type': 'done', 'status': case.status}, event_id)
+            return
+
+        now = loop.time()
+        if new_events or changed:
+            last_sent = now
+        elif now - last_sent >= STREAM_KEEPALIVE_SECONDS:
+            last_sent = now
+            yield SSE_KEEPALIVE
+
+        if now >= next_job_check:
+            next_job_check = now + JOB_CHECK_SECONDS
+            if not await asyncio.to_thread(case_job_active, case_id):
+                break
+
+        if now >= next_lease_refresh:
+            next_lease_refresh = now + limits.STREAM_LEASE_REFRESH_SECONDS
+            if not await refresh_stream_lease(lease):
+                yield sse_frame({'type': 'replaced'}, event_id)
+                return
+
+        # Poll fast while the case is moving, back off while it is idle
+        initial, maximum = POLL_INTERVALS.get(case.status, DEFAULT_POLL_INTERVAL)
+        delay = initial if delay is None or new_events or changed else min(delay * 2, maximum)
+        await asyncio.sleep(delay)
+
+    # Timeout
+    yield sse_frame({'type': 'timeout'}, event_id)
 
 
 @app.get('/api/health', response_model=HealthResponse)
@@ -94,6 +417,39 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get('/api/health/pool')
+async def pool_health(user_id: str = Depends(get_user_id)):
+    """
+    Database connection pool metrics of this process.
+
+    For the async pool used by the endpoints and the sync pool: size,
+    checked-out and overflow connections, and the checkout wait time
+    (total, max, timeouts and a cumulative histogram).
+
+    Requires authentication via JWT token. Unauthenticated scrapers get
+    the same figures from /api/metrics (`db_pool_*`).
+    """
+    return {
+        "async": db_pool.pool_status(async_database.get_async_engine().sync_engine, db_pool.async_stats),
+        "sync": db_pool.pool_status(database.get_engine(), db_pool.sync_stats),
+    }
+
+
+@app.get('/api/metrics')
+async def metrics_endpoint():
+    """Prometheus metrics of this process, in the text exposition format."""
+    def collect():
+        try:
+            job_durations.update()
+        except RedisError as e:
+            print(f"* failed to update job durations: {e}")
+        return metrics.render()
+
+    # Queue metrics are read from Redis with the sync client
+    body, content_type = await asyncio.to_thread(collect)
+    return Response(body, media_type=content_type)
+
+
 @app.post('/api/create_case', response_model=CreateCaseResponse, status_code=status.HTTP_201_CREATED)
 async def create_case_endpoint(
     request: CreateCaseRequest,
@@ -112,10 +468,24 @@ async def create_case_endpoint(
     - status: Current status (CREATED)
     - title: Case title
     - created_at: ISO timestamp
-    - job_id: Job queue identifier
+    - job_id: Job queue identifier, the same as case_id
+    - queue_position: Position of the case in the queue, 1 is next
+
+    Each user can create CREATE_CASE_BURST cases at once and CREATE_CASE_RATE
+    per second after that, beyond which requests get a 429. While the queue
+    holds QUEUE_SHED_DEPTH cases new ones get a 503. Both carry a Retry-After header.
 
     Requires authentication via JWT token.
     """
+    retry_after = await limits.take_create_token(user_id)
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many cases created, slow down",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+    await check_queue_depth()
+
     question = request.question
     title = request.title or (question[:100] if question else "Untitled Case")
 
@@ -123,23 +493,205 @@ async def create_case_endpoint(
     case_id = str(uuid.uuid4())
 
     # Create case in database with user_id
-    case = database.create_case(db, case_id, user_id, title)
-
-    # Enqueue job for processing
-    job = job_queue.enqueue(
-        'worker.process_case',
-        case_id=case_id,
-        user_id=user_id,
-        question=question,
-        job_timeout='10m'
-    )
+    case = await async_database.create_case(db, case_id, user_id, title)
+
+    # Enqueue job for processing, through the interactive lane when scheduling is on
+    if scheduler.SCHEDULER_ENABLED:
+        await asyncio.to_thread(get_case_scheduler().submit, scheduler.INTERACTIVE, user_id, [(case_id, question)])
+    else:
+        get_job_queue().enqueue(
+            'worker.process_case',
+            case_id=case_id,
+            user_id=user_id,
+            question=question,
+            job_id=case_id,
+            job_timeout=scheduler.JOB_TIMEOUT
+        )
+    queue_position = await asyncio.to_thread(case_queue_position, case_id)
 
     return CreateCaseResponse(
         case_id=case.case_id,
         status=case.status,
         title=case.data_json.get("title"),
         created_at=case.created_at.isoformat(),
-        job_id=job.id
+        job_id=case_id,
+        queue_position=queue_position
+    )
+
+
+def enqueue_cases(user_id: str, cases: list[tuple[str, str]]) -> list[Optional[int]]:
+    """
+    Enqueue the processing jobs of several (case_id, question) pairs in one Redis pipeline,
+    through the batch lane when scheduling is on. Returns their queue positions.
+    """
+    job_queue = get_job_queue()
+    if scheduler.SCHEDULER_ENABLED:
+        case_scheduler = get_case_scheduler()
+        case_scheduler.submit(scheduler.BATCH, user_id, cases)
+        queued = job_queue.count
+        positions = case_scheduler.queue_positions([case_id for case_id, _ in cases])
+        return [position + queued if position is not None else None for position in positions]
+
+    job_queue.enqueue_many([
+        Queue.prepare_data(
+            'worker.process_case',
+            kwargs=dict(case_id=case_id, user_id=user_id, question=question),
+            job_id=case_id,
+            timeout=scheduler.JOB_TIMEOUT
+        )
+        for case_id, question in cases
+    ])
+    # The jobs were appended to the end of the queue, in order
+    first = job_queue.count - len(cases) + 1
+    return [first + i for i in range(len(cases))]
+
+
+@app.post('/api/create_cases', response_model=CreateCasesResponse, status_code=status.HTTP_201_CREATED)
+async def create_cases_endpoint(
+    request: CreateCasesRequest,
+    db: SessionDep,
+    user_id: str = Depends(get_user_id),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """
+    Create many clinical cases at once and enqueue their processing jobs.
+
+    All cases are inserted in one transaction and all jobs are enqueued in
+    one Redis round-trip. With scheduling on they go to the batch lane, so
+    they do not hold up interactive cases.
+
+    Request body:
+    - cases: List of {question, title} as for POST /api/create_case (1-1000)
+
+    Headers:
+    - Idempotency-Key: Optional, a retry with the same key and body returns
+      the original response instead of creating the cases again. A retry of
+      a request that failed half-way creates and enqueues the cases under
+      the ids recorded by the first attempt
+
+    Response:
+    - cases: Created cases in request order, as returned by POST /api/create_case
+
+    Each case takes a token from the user's case creation bucket, see POST
+    /api/create_case; without them the request gets a 429. While the queue
+    holds QUEUE_SHED_DEPTH cases it gets a 503. Both carry a Retry-After
+    header, and the request can be retried with the same Idempotency-Key.
+
+    Requires authentication via JWT token.
+    """
+    recorded_ids = None
+    if idempotency_key:
+        state, stored = await idempotency.claim(
+            user_id, idempotency_key, idempotency.fingerprint(request.model_dump_json().encode())
+        )
+        if state == idempotency.DONE:
+            return Response(stored, status_code=status.HTTP_201_CREATED, media_type='application/json')
+        if state == idempotency.PENDING:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        if state == idempotency.MISMATCH:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if state == idempotency.RESUME and stored:
+            recorded_ids = serialization.loads(stored)
+
+    try:
+        if recorded_ids is None:
+            # A retry of a request that recorded its ids was charged by it
+            retry_after = await limits.take_create_token(user_id, len(request.cases))
+            if retry_after is not None:
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many cases created, slow down",
+                    headers={"Retry-After": str(math.ceil(retry_after))}
+                )
+        await check_queue_depth()
+        case_ids = recorded_ids or [str(uuid.uuid4()) for _ in request.cases]
+        questions = [(case_id, item.question) for case_id, item in zip(case_ids, request.cases)]
+        titles = [item.title or (item.question[:100] if item.question else "Untitled Case") for item in request.cases]
+
+        # The cases are inserted in one transaction: either all or none of
+        # the recorded ids were committed by the first attempt
+        cases = await async_database.get_cases_by_id(db, case_ids, user_id) if recorded_ids else []
+        if cases:
+            # Only the cases whose job was lost with the first attempt are enqueued again
+            lost = await asyncio.to_thread(jobless_cases, [case.case_id for case in cases if case.status == 'CREATED'])
+            to_enqueue = [(case_id, question) for case_id, question in questions if case_id in lost]
+        else:
+            if idempotency_key:
+                await idempotency.record_ids(user_id, idempotency_key, serialization.dumps(case_ids))
+            # Create all cases in one transaction, then enqueue all jobs
+            cases = await async_database.create_cases_bulk(
+                db, user_id, [(case_id, title) for (case_id, _), title in zip(questions, titles)]
+            )
+            to_enqueue = questions
+        queue_positions = await asyncio.to_thread(enqueue_cases, user_id, to_enqueue) if to_enqueue else []
+        positions = dict(zip((case_id for case_id, _ in to_enqueue), queue_positions))
+
+        body = CreateCasesResponse(cases=[
+            CreateCaseResponse(
+                case_id=case.case_id,
+                status=case.status,
+                title=case.data_json.get("title"),
+                created_at=case.created_at.isoformat(),
+                job_id=case.case_id,
+                queue_position=positions.get(case.case_id)
+            )
+            for case in cases
+        ]).model_dump_json().encode()
+    except BaseException:
+        if idempotency_key:
+            await idempotency.release(user_id, idempotency_key)
+        raise
+
+    if idempotency_key:
+        await idempotency.store(user_id, idempotency_key, body)
+    return Response(body, status_code=status.HTTP_201_CREATED, media_type='application/json')
+
+
+@app.get('/api/cases/export')
+async def export_cases_endpoint(
+    statuses: Optional[list[str]] = Query(None, alias="status"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    compress: bool = Query(False, alias="gzip"),
+    user_id: str = Depends(get_user_id)
+):
+    """
+    Export the authenticated user's cases as NDJSON, oldest first.
+
+    Query parameters:
+    - status: Only export cases with this status, may be repeated
+    - since: Only export cases created at or after this ISO time
+    - until: Only export cases created before this ISO time
+    - gzip: Compress the export as one gzip stream (default false)
+
+    Response: one `get_case_full` payload per line, as returned by
+    GET /api/cases/{case_id}, streamed as the cases are read. Archived cases
+    are not included.
+
+    Note: We don't use SessionDep here because the session would close
+    before the generator finishes.
+
+    Requires authentication via JWT token.
+    """
+    encoder = export.NDJSONEncoder(compress)
+
+    async def generate():
+        async with async_database.async_session() as db:
+            batches = async_database.export_cases(
+                db, user_id, statuses, export.naive_utc(since), export.naive_utc(until), export.BATCH_SIZE
+            )
+            async for cases in batches:
+                # Encoding and compressing a batch takes a few milliseconds, off the event loop
+                chunk = await asyncio.to_thread(encoder.encode, cases)
+                if chunk:
+                    yield chunk
+        yield encoder.finish()
+
+    filename = 'cases.ndjson.gz' if compress else 'cases.ndjson'
+    return StreamingResponse(
+        generate(),
+        media_type='application/gzip' if compress else 'application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
     )
 
 
@@ -147,11 +699,19 @@ async def create_case_endpoint(
 async def get_case_endpoint(
     case_id: str,
     db: SessionDep,
+    request: Request,
+    after: Optional[int] = None,
+    dedupe_sources: bool = False,
     user_id: str = Depends(get_user_id)
 ):
     """
     Get full case data including all messages and evidence snippets.
 
+    Query parameters:
+    - after: Optional cursor, only messages inserted after it are returned
+    - dedupe_sources: Send each evidence source once, in `evidence_sources`
+      keyed by `source_hash`, instead of repeating it in every snippet
+
     Response:
     - case_id: Unique identifier
     - status: CREATED|PROCESSING|COMPLETED|ERROR
@@ -160,37 +720,102 @@ async def get_case_endpoint(
     - evidence_snippets: List of evidence snippets
     - created_at: ISO timestamp
     - updated_at: ISO timestamp
+    - next_cursor: Cursor to pass as `after` to fetch only newer messages
+    - evidence_sources: Sources by hash, only with `dedupe_sources`
+
+    Responses carry an ETag; a request whose If-None-Match matches it (by
+    weak comparison, or `*`) gets a 304. Finished cases are served from the
+    response cache.
 
     Requires authentication via JWT token.
     Only returns cases belonging to the authenticated user.
     """
-    case_data = database.get_case_full(db, case_id, user_id)
-
-    if not case_data:
-        raise HTTPException(status_code=404, detail="Case not found")
-
-    return case_data
+    if_none_match = request.headers.get('if-none-match')
+
+    # Only the default response shape is cached
+    cacheable = after is None and not dedupe_sources
+    if cacheable:
+        etag = await case_cache.get_etag(case_id, user_id)
+        if etag is not None:
+            if etag_matches(if_none_match, etag):
+                case_cache.count_etag_hit()
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+            body = await case_cache.get_body(case_id, etag)
+            if body is not None:
+                return Response(body, media_type='application/json', headers={'ETag': etag})
+
+    if serialization.FAST_SERIALIZATION:
+        # Trusted database output, encoded without re-validation
+        case_json = await async_database.get_case_full_json(db, case_id, user_id, after, dedupe_sources)
+        if not case_json:
+            raise HTTPException(status_code=404, detail="Case not found")
+        case_status, body = case_json
+    else:
+        case_data = await async_database.get_case_full(db, case_id, user_id, after, dedupe_sources)
+        if not case_data:
+            raise HTTPException(status_code=404, detail="Case not found")
+        case_status = case_data['status']
+        body = CaseResponse.model_validate(case_data).model_dump_json(exclude_unset=True).encode()
+
+    etag = make_etag(body)
+    if cacheable and case_status in CACHEABLE_STATUSES:
+        await case_cache.put(case_id, user_id, etag, body)
+
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    return Response(body, media_type='application/json', headers={'ETag': etag})
 
 
 @app.get('/api/cases/{case_id}/stream')
 async def stream_case_endpoint(
     case_id: str,
     token: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None),
 ):
     """
     Server-Sent Events endpoint for streaming case updates.
 
-    This endpoint keeps the connection open and sends new messages
-    as they are added to the database by the worker.
+    This endpoint keeps the connection open and sends new messages and
+    evidence snippets as they are added to the database by the worker.
 
     SSE format:
-    data: {"type": "message", "data": {...}}
+    id: 42
+    data: {"type": "message", "cursor": 42, "data": {...}}
 
+    id: 42.17
+    data: {"type": "evidence", "cursor": 17, "data": {...}}
+
+    id: 42.17
     data: {"type": "status", "status": "COMPLETED"}
 
+    The database is read once on connect to catch up on history, after
+    which new messages, evidence and status changes are pushed from the
+    per-case Redis channel. If Redis is unavailable the stream polls the database.
+
+    Messages and evidence snippets have cursors of their own. Every frame
+    carries the stream position as its `id`: the cursor of the last message
+    sent, followed by the cursor of the last evidence snippet once one was sent.
+    A reconnecting EventSource sends it back as Last-Event-ID and the stream
+    resumes after it, from the Redis replay buffer when it still holds those
+    events, otherwise from the database. Each message and snippet is sent once.
+
+    While the case waits to be picked up, status frames carry its
+    `queue_position`, updated as it moves up the queue.
+
+    A user can have STREAM_USER_LIMIT streams open and open STREAM_OPEN_RATE
+    per second (STREAM_OPEN_BURST at once), and the API STREAM_GLOBAL_LIMIT
+    in total; streams beyond that are refused with 429 (user) or 503 (global)
+    and a Retry-After header. Opening a case that the user already streams
+    replaces the older stream, which ends with a `replaced` event.
+
+    Status frames are only sent when the status changes, and an idle stream
+    gets a `: keepalive` comment line every STREAM_KEEPALIVE_SECONDS. The
+    stream stays open while the case job is queued or running, and ends with
+    a timeout event once the job is gone without the case finishing.
+
     Note: We don't use SessionDep here because the session would close
-    before the generator finishes. Instead, we create a new session for
-    each database query.
+    before the generator finishes. Instead, we open a new async session
+    for each database read.
 
     Requires authentication via JWT token (passed as query parameter 'token').
     Only streams cases belonging to the authenticated user.
@@ -204,62 +829,158 @@ async def stream_case_endpoint(
         raise HTTPException(status_code=401, detail="Missing authentication token")
 
     try:
-        payload = verify_jwt_token(token)
+        # Off the event loop: an unknown signing key waits for the JWKS to reload
+        payload = await asyncio.to_thread(verify_jwt_token, token)
         user_id = payload["sub"]
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Invalid token: {str(e)}")
+    resume_from = parse_last_event_id(last_event_id)
+
+    retry_after = await limits.take_open_token(user_id)
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many streams opened, slow down",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+    outcome, lease = await limits.acquire_stream(user_id, case_id)
+    if outcome == limits.USER_LIMIT:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many open streams",
+            headers={"Retry-After": str(limits.STREAM_RETRY_AFTER_SECONDS)}
+        )
+    if outcome == limits.GLOBAL_LIMIT:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many open streams, try again later",
+            headers={"Retry-After": str(limits.STREAM_RETRY_AFTER_SECONDS)}
+        )
+
     async def generate():
-        # Verify case exists and belongs to user
-        from sqlmodel import Session
-        with Session(database.engine) as db:
-            case = database.get_case(db, case_id, user_id)
-            if not case:
-                yield f"data: {json.dumps({'type': 'error', 'message': 'Case not found'})}\n\n"
+        cursor, evidence_cursor = resume_from or (None, None)
+        case_status = None
+
+        def event_id() -> str:
+            return stream_event_id(cursor, evidence_cursor)
+
+        try:
+            async with CaseSubscription(case_id) as subscription:
+                # Resume from the replay buffer when it reaches back far enough
+                replay = None
+                if resume_from is not None:
+                    replay = await subscription.replay(user_id, cursor, evidence_cursor)
+
+                if replay is not None:
+                    case_status, backlog = replay
+                    queue_position = await waiting_position(case_id, case_status)
+                    yield sse_frame(status_event(case_status, queue_position), event_id())
+                    for header, payload in backlog:
+                        if header['type'] == 'message':
+                            cursor = header['cursor']
+                        else:
+                            evidence_cursor = header['cursor']
+                        yield sse_data(payload, event_id())
+
+                else:
+                    # Catch up on history once. The subscription is already open,
+                    # so nothing committed after this read can be missed.
+                    async with async_database.async_session() as db:
+                        case = await async_database.get_case(db, case_id, user_id)
+                        if case:
+                            history = await async_database.get_case_events(db, case_id, user_id, cursor, evidence_cursor)
+
+                    if case:
+                        case_status = case.status
+                    else:
+                        # Archived cases have ended, their history is all there is to send
+                        archived = await asyncio.to_thread(archive.load_case_events, case_id, user_id, cursor, evidence_cursor)
+                        if archived is None:
+                            yield sse_frame({'type': 'error', 'message': 'Case not found'})
+                            return
+                        case_status, history = archived
+
+                    queue_position = await waiting_position(case_id, case_status)
+                    yield sse_frame(status_event(case_status, queue_position), event_id())
+                    for event in history:
+                        if event['type'] == 'message':
+                            cursor = event['cursor']
+                        else:
+                            evidence_cursor = event['cursor']
+                        yield sse_frame(event, event_id())
+
+                if case_status in FINAL_STATUSES:
+                    yield sse_frame({'type': 'done', 'status': case_status}, event_id())
+                    return
+
+                # From here on the worker pushes everything through Redis
+                loop = asyncio.get_running_loop()
+                started = last_sent = next_job_check = loop.time()
+                next_lease_refresh = started + limits.STREAM_LEASE_REFRESH_SECONDS
+                while loop.time() - started < STREAM_MAX_SECONDS:
+                    received = await subscription.get(timeout=1.0)
+                    now = loop.time()
+                    if now >= next_lease_refresh:
+                        next_lease_refresh = now + limits.STREAM_LEASE_REFRESH_SECONDS
+                        if not await refresh_stream_lease(lease):
+                            yield sse_frame({'type': 'replaced'}, event_id())
+                            return
+                    if received is None:
+                        if now >= next_job_check:
+                            next_job_check = now + JOB_CHECK_SECONDS
+                            if not await asyncio.to_thread(case_job_active, case_id):
+                                break
+                            # Tell a waiting case how far it has moved up
+                            position = await waiting_position(case_id, case_status)
+                            if position is not None and position != queue_position:
+                                queue_position = position
+                                last_sent = now
+                                yield sse_frame(status_event(case_status, queue_position), event_id())
+                        if now - last_sent >= STREAM_KEEPALIVE_SECONDS:
+                            last_sent = now
+                            yield SSE_KEEPALIVE
+                        continue
+
+                    # Events arrive encoded by the writer and are forwarded as is
+                    header, payload = received
+                    if header['type'] == 'message':
+                        # Already sent as part of the history
+                        if cursor is not None and header['cursor'] <= cursor:
+                            continue
+                        cursor = header['cursor']
+                        last_sent = now
+                        yield sse_data(payload, event_id())
+
+                    elif header['type'] == 'evidence':
+                        if evidence_cursor is not None and header['cursor'] <= evidence_cursor:
+                            continue
+                        evidence_cursor = header['cursor']
+                        last_sent = now
+                        yield sse_data(payload, event_id())
+
+                    elif header['type'] == 'status':
+                        if header['status'] == case_status:
+                            continue
+                        case_status = header['status']
+                        last_sent = now
+                        yield sse_data(payload, event_id())
+                        if case_status in FINAL_STATUSES:
+                            yield sse_frame({'type': 'done', 'status': case_status}, event_id())
+                            return
+
+                yield sse_frame({'type': 'timeout'}, event_id())
                 return
 
-            # Send initial status
-            yield f"data: {json.dumps({'type': 'status', 'status': case.status})}\n\n"
-
-        last_message_id = None
-        max_iterations = 300  # 5 minutes max (300 * 1 second)
-        iteration = 0
-
-        while iteration < max_iterations:
-            # Create a new session for each iteration
-            with Session(database.engine) as db:
-                # Get case status
-                case = database.get_case(db, case_id, user_id)
-                if not case:
-                    break
-
-                # Get new messages since last check (filtered by user_id)
-                new_messages = database.get_new_messages(db, case_id, user_id, last_message_id)
-
-                # Send new messages
-                for msg in new_messages:
-                    yield f"data: {json.dumps({'type': 'message', 'data': msg})}\n\n"
-                    last_message_id = msg['message_id']
+        except RedisError as e:
+            print(f"* pub/sub unavailable for case {case_id}, falling back to polling: {e}")
 
-                # Send status update
-                yield f"data: {json.dumps({'type': 'status', 'status': case.status})}\n\n"
-
-                # If case is completed or errored, send final event and close
-                if case.status in ['COMPLETED', 'ERROR']:
-                    yield f"data: {json.dumps({'type': 'done', 'status': case.status})}\n\n"
-                    break
-
-            # Wait before next check
-            await asyncio.sleep(1)
-            iteration += 1
-
-        # Timeout or completion
-        if iteration >= max_iterations:
-            yield f"data: {json.dumps({'type': 'timeout'})}\n\n"
+        async for frame in poll_case_events(case_id, user_id, cursor, evidence_cursor, case_status, lease):
+            yield frame
 
     return StreamingResponse(
-        generate(),
+        metrics.track_stream(holding_lease(generate(), lease)),
         media_type='text/event-stream',
         headers={
             'Cache-Control': 'no-cache',
@@ -271,20 +992,80 @@ async def stream_case_endpoint(
 @app.get('/api/cases', response_model=CaseListResponse)
 async def list_cases_endpoint(
     db: SessionDep,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    statuses: Optional[list[str]] = Query(None, alias="status"),
     user_id: str = Depends(get_user_id)
 ):
     """
-    List all cases for the authenticated user.
+    List the cases of the authenticated user, newest first, one page at a time.
+
+    Query parameters:
+    - cursor: `next_cursor` of the previous page, omit for the first page
+    - limit: Page size (1-200, default 50)
+    - status: Only list cases with this status, may be repeated
 
     Response:
     - cases: List of case summaries
+    - next_cursor: Cursor of the next page, null on the last page
 
     Requires authentication via JWT token.
     Only returns cases belonging to the authenticated user.
     """
-    cases = database.get_cases(db, user_id, limit=50)
+    try:
+        cases, next_cursor = await async_database.get_case_summaries(db, user_id, limit, cursor, statuses)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if serialization.FAST_SERIALIZATION:
+        # Trusted database output, encoded without re-validation
+        body = serialization.dumps({'cases': cases, 'next_cursor': next_cursor})
+        return Response(body, media_type='application/json')
+
     return CaseListResponse(
-        cases=[CaseListItem(**case.to_dict()) for case in cases]
+        cases=[CaseListItem(**case) for case in cases],
+        next_cursor=next_cursor
+    )
+
+
+@app.get('/api/search', response_model=SearchResponse)
+async def search_endpoint(
+    db: SessionDep,
+    q: str = Query(..., min_length=1, max_length=500),
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    user_id: str = Depends(get_user_id)
+):
+    """
+    Full-text search over the authenticated user's cases, best match first.
+
+    Query parameters:
+    - q: Words to search for in case titles, messages and evidence sources
+    - cursor: `next_cursor` of the previous page, omit for the first page
+    - limit: Page size (1-100, default 20)
+
+    Response:
+    - results: List of matches, each with its kind (case, message or
+      evidence), case_id, id (case, message or snippet id), rank and a
+      highlight of the matched text, HTML-escaped, with the words wrapped in <mark>
+    - next_cursor: Cursor of the next page, null on the last page
+
+    Requires authentication via JWT token.
+    Only searches cases belonging to the authenticated user.
+    """
+    try:
+        results, next_cursor = await async_database.search(db, user_id, q, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if serialization.FAST_SERIALIZATION:
+        # Trusted database output, encoded without re-validation
+        body = serialization.dumps({'results': results, 'next_cursor': next_cursor})
+        return Response(body, media_type='application/json')
+
+    return SearchResponse(
+        results=[SearchResult(**result) for result in results],
+        next_cursor=next_cursor
     )
 
 
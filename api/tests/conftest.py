@@ -0,0 +1,116 @@
+"""
+Shared fixtures: a scratch SQLite database for the session, fakeredis per
+test, an HTTP client calling `server.app` in process, and a factory of cases.
+
+Set TEST_DATABASE_URL to run the tests against an empty scratch PostgreSQL
+database instead. Its tables are created, and dropped at the end.
+"""
+import os
+import tempfile
+import time
+import uuid
+
+# The application modules read their settings on import
+_scratch = tempfile.mkdtemp(prefix="api-tests-")
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL") or f"sqlite:///{os.path.join(_scratch, 'test.db')}"
+os.environ["SUPABASE_JWT_SECRET"] = "test-secret-" + "x" * 32
+os.environ["SUPABASE_JWKS_URL"] = ""
+
+import fakeredis
+import httpx
+import jwt
+import pytest
+from rq import Queue
+from sqlmodel import Session
+import async_database
+import database
+import events
+import server
+
+
+@pytest.fixture(scope="session", autouse=True)
+def tables():
+    database.init_db()
+    yield
+    if database.database_dialect == "postgresql":
+        database.SQLModel.metadata.drop_all(database.get_engine())
+    database.dispose_engine()
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def redis():
+    """A fresh fakeredis behind the publishers, the streams and the job queue."""
+    fake_server = fakeredis.FakeServer()
+    events._redis = fakeredis.FakeRedis(server=fake_server)
+    events._async_redis = fakeredis.FakeAsyncRedis(server=fake_server)
+    server._redis_conn = fakeredis.FakeRedis(server=fake_server)
+    server._job_queue = Queue("clinical_cases", connection=server._redis_conn)
+    server._case_scheduler = None
+    yield events._redis
+    events._redis = events._async_redis = None
+    server._redis_conn = server._job_queue = None
+
+
+@pytest.fixture
+async def client(redis):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as http:
+        yield http
+    # Pooled aiosqlite connections belong to this test's event loop
+    await async_database.dispose_async_engine()
+
+
+@pytest.fixture
+def user_id() -> str:
+    return f"user-{uuid.uuid4()}"
+
+
+SOURCE = {"source_id": "PMID1", "text": "aspirin trial", "source_type": "pubmed", "source_url": "https://example.org/1"}
+
+
+@pytest.fixture
+def make_case(redis, user_id):
+    """
+    Factory of cases of the test's user, written through the `database`
+    helpers as the worker writes them. `make_case(title, messages, snippets,
+    status)` returns the new case id. Messages are "{case_id}-m{i}", and the
+    snippets "{case_id}-s{i}", citing SOURCE, are spread over the messages.
+    With a `status`, the case is set PROCESSING before its rows and `status`
+    after them.
+    """
+    def make(title: str, messages: int = 0, snippets: int = 0, status: str = None) -> str:
+        case_id = str(uuid.uuid4())
+        every = max(1, messages // snippets) if snippets else 0
+        with Session(database.get_engine()) as db:
+            database.create_case(db, case_id, user_id, title)
+            if status:
+                database.update_case_status(db, case_id, "PROCESSING")
+            written = 0
+            for i in range(messages):
+                database.add_message(db, case_id, user_id, f"{case_id}-m{i}", {"text": f"message {i}", "stage": "thinking", "message_type": "AGENT"})
+                if every and i % every == every - 1 and written < snippets:
+                    database.add_evidence_snippet(db, case_id, f"{case_id}-s{written}", {**SOURCE, "index": written})
+                    written += 1
+            for index in range(written, snippets):
+                database.add_evidence_snippet(db, case_id, f"{case_id}-s{index}", {**SOURCE, "index": index})
+            if status:
+                database.update_case_status(db, case_id, status)
+        return case_id
+
+    return make
+
+
+def make_token(user_id: str) -> str:
+    return jwt.encode(
+        {"sub": user_id, "aud": "authenticated", "exp": int(time.time()) + 3600},
+        os.environ["SUPABASE_JWT_SECRET"],
+        algorithm="HS256",
+    )
+
+
+def auth_headers(user_id: str) -> dict:
+    return {"Authorization": f"Bearer {make_token(user_id)}"}
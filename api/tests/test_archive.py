@@ -0,0 +1,89 @@
+"""
+The archiver never deletes rows it did not archive, archived cases are only
+read by their owner, and documents of older formats are still read.
+"""
+import gzip
+import json
+import uuid
+from datetime import datetime, timedelta
+import pytest
+from sqlmodel import Session
+import archive
+import archiver
+import database
+
+
+@pytest.fixture(autouse=True)
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def case_id(make_case) -> str:
+    return make_case("archived", messages=1, snippets=1, status="COMPLETED")
+
+
+def ended_at(case_id: str) -> datetime:
+    with Session(database.get_engine()) as db:
+        return database.get_case(db, case_id).updated_at
+
+
+@pytest.mark.parametrize("late_write", ["message", "snippet"])
+def test_rows_written_after_the_read_are_not_deleted(case_id, user_id, monkeypatch, late_write):
+    write_case = archive.write_case
+
+    def write_then_add_row(*args):
+        path = write_case(*args)
+        # A late write by the worker touches the rows, not the case
+        with Session(database.get_engine()) as db:
+            if late_write == "message":
+                database.add_message(db, case_id, user_id, f"{case_id}-m1", {"text": "late", "stage": "final", "message_type": "AGENT"})
+            else:
+                database.add_evidence_snippet(db, case_id, f"{case_id}-s1", {"source_id": "PMID2", "text": "late", "index": 1})
+        return path
+
+    monkeypatch.setattr(archive, "write_case", write_then_add_row)
+    assert not archiver.archive_case(case_id, user_id, ended_at(case_id))
+    assert archive.case_file(case_id, user_id) is None
+    with Session(database.get_engine()) as db:
+        case_full = database.get_hot_case_full(db, case_id)
+    assert len(case_full["messages"]) + len(case_full["evidence_snippets"]) == 3
+
+
+def test_archived_case_is_only_read_by_its_owner(case_id, user_id):
+    assert archiver.archive_case(case_id, user_id, ended_at(case_id))
+    with Session(database.get_engine()) as db:
+        assert database.get_hot_case_full(db, case_id) is None
+        assert database.get_case_full(db, case_id, user_id)["messages"][0]["text"] == "message 0"
+        assert database.get_case_full(db, case_id, f"other-{user_id}") is None
+        assert database.get_case_full(db, case_id) is None
+
+
+def test_case_updated_since_selected_is_not_archived(case_id, user_id):
+    assert not archiver.archive_case(case_id, user_id, ended_at(case_id) - timedelta(seconds=1))
+    assert archive.case_file(case_id, user_id) is None
+
+
+def test_format_1_documents_stream_all_their_snippets(archive_dir, user_id):
+    # As written before snippet cursors were recorded
+    case_id = str(uuid.uuid4())
+    message = {"message_id": "m0", "case_id": case_id, "text": "done", "created_at": "2026-01-01T00:00:00"}
+    snippets = [
+        {"snippet_id": f"s{i}", "case_id": case_id, "index": i, "text": f"source {i}", "created_at": f"2026-01-01T00:00:0{i}"}
+        for i in range(2)
+    ]
+    document = {
+        "format": 1, "user_id": user_id, "archived_at": "2026-04-01T00:00:00",
+        "case": {"case_id": case_id, "status": "COMPLETED", "messages": [message], "evidence_snippets": snippets},
+        "message_cursors": [7],
+    }
+    (archive_dir / user_id).mkdir()
+    (archive_dir / user_id / f"{case_id}.json.gz").write_bytes(gzip.compress(json.dumps(document).encode()))
+
+    status, events = archive.load_case_events(case_id, user_id)
+    assert status == "COMPLETED"
+    assert [(event["type"], event["cursor"]) for event in events] == [("message", 7), ("evidence", 1), ("evidence", 2)]
+    # A cursor from before the case was archived is a snippet id of the hot table
+    _, events = archive.load_case_events(case_id, user_id, after=7, evidence_after=950)
+    assert [event["data"]["snippet_id"] for event in events] == ["s0", "s1"]
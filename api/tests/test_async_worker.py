@@ -0,0 +1,99 @@
+"""
+Sync jobs of the async worker run on its threads, holding their slot until
+they return, or with `processes` in child processes killed on timeout.
+"""
+import os
+import time
+import uuid
+import pytest
+from rq import Queue
+from rq.job import JobStatus
+from rq.registry import FailedJobRegistry
+from sqlmodel import Session
+import async_worker
+import database
+
+
+def write_pid_and_sleep(path: str, seconds: float):
+    with open(path, "w") as pid_file:
+        pid_file.write(str(os.getpid()))
+    time.sleep(seconds)
+
+
+def fail():
+    raise ValueError("agent crashed")
+
+
+def sleep_then_complete(case_id: str, seconds: float, path: str):
+    time.sleep(seconds)
+    with Session(database.get_engine()) as db:
+        database.update_case_status(db, case_id, "COMPLETED")
+    with open(path, "w") as time_file:
+        time_file.write(str(time.time()))
+
+
+def write_time(path: str):
+    with open(path, "w") as time_file:
+        time_file.write(str(time.time()))
+
+
+@pytest.fixture
+def queue(redis) -> Queue:
+    return Queue("test-async-worker", connection=redis)
+
+
+@pytest.mark.anyio
+async def test_sync_jobs_run_on_threads_of_the_worker(queue, tmp_path, capsys):
+    finished = queue.enqueue(write_pid_and_sleep, str(tmp_path / "ok"), 0)
+    failed = queue.enqueue(fail)
+    await async_worker.AsyncCaseWorker(queue, concurrency=2).run(burst=True)
+
+    assert finished.get_status() == JobStatus.FINISHED
+    assert int((tmp_path / "ok").read_text()) == os.getpid()
+    assert failed.get_status() == JobStatus.FAILED
+    assert f"Job {failed.id} failed: ValueError: agent crashed" in capsys.readouterr().out
+
+
+@pytest.mark.anyio
+async def test_timed_out_sync_job_holds_its_slot_until_it_returns(queue, tmp_path, user_id):
+    case_id = str(uuid.uuid4())
+    with Session(database.get_engine()) as db:
+        database.create_case(db, case_id, user_id, "slow")
+    slow = queue.enqueue(sleep_then_complete, case_id=case_id, seconds=3, path=str(tmp_path / "slow"), job_timeout=1)
+    queue.enqueue(write_time, str(tmp_path / "next"))
+    await async_worker.AsyncCaseWorker(queue, concurrency=1).run(burst=True)
+
+    assert slow.get_status() == JobStatus.FAILED
+    # The next job only started once the thread was done
+    assert float((tmp_path / "next").read_text()) >= float((tmp_path / "slow").read_text())
+    # The status set by the thread after the timeout was overwritten
+    with Session(database.get_engine()) as db:
+        assert database.get_case(db, case_id).status == "ERROR"
+
+
+@pytest.mark.anyio
+async def test_sync_jobs_run_in_child_processes(queue, tmp_path, capsys):
+    finished = queue.enqueue(write_pid_and_sleep, str(tmp_path / "ok"), 0)
+    failed = queue.enqueue(fail)
+    await async_worker.AsyncCaseWorker(queue, concurrency=2, processes=True).run(burst=True)
+
+    assert finished.get_status() == JobStatus.FINISHED
+    assert int((tmp_path / "ok").read_text()) != os.getpid()
+    assert failed.get_status() == JobStatus.FAILED
+    # The reason is the last line of the child's traceback
+    assert f"Job {failed.id} failed: ValueError: agent crashed" in capsys.readouterr().out
+
+
+@pytest.mark.anyio
+async def test_timed_out_sync_job_is_killed(queue, tmp_path):
+    pid_path = tmp_path / "slow"
+    job = queue.enqueue(write_pid_and_sleep, str(pid_path), 60, job_timeout=3)
+    start = time.monotonic()
+    await async_worker.AsyncCaseWorker(queue, concurrency=1, processes=True).run(burst=True)
+
+    assert time.monotonic() - start < 30
+    assert job.get_status() == JobStatus.FAILED
+    assert job.id in FailedJobRegistry(queue=queue).get_job_ids()
+    # The slot was only given back once the process was gone
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pid_path.read_text()), 0)
@@ -0,0 +1,101 @@
+"""JWKS reloads in the background, keeps its last good keys and backs off on failure."""
+import json
+import threading
+import time
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+import auth
+from conftest import auth_headers
+
+
+def write_jwks(path, private_key, kid: str):
+    public = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    path.write_text(json.dumps({"keys": [{**public, "kid": kid, "alg": "RS256", "use": "sig"}]}))
+
+
+@pytest.fixture
+def private_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def test_failed_reload_keeps_last_good_keys(tmp_path, private_key, monkeypatch):
+    monkeypatch.setattr(auth, "JWKS_RETRY_SECONDS", 5.0)
+    path = tmp_path / "jwks.json"
+    write_jwks(path, private_key, "k1")
+    key_set = auth.JWKSKeySet(str(path), refresh_seconds=600)
+    key_set.refresh()
+    assert key_set.retry_delay() == 600
+
+    path.unlink()
+    key_set.refresh()
+    key_set.refresh()
+    assert key_set.failures == 2
+    assert set(key_set.keys) == {"k1"}
+    assert key_set.retry_delay() == 10
+
+    write_jwks(path, private_key, "k1")
+    key_set.refresh()
+    assert key_set.failures == 0 and key_set.retry_delay() == 600
+
+
+def test_backoff_is_capped_at_the_refresh_period(monkeypatch):
+    monkeypatch.setattr(auth, "JWKS_RETRY_SECONDS", 5.0)
+    key_set = auth.JWKSKeySet("/nonexistent/jwks.json", refresh_seconds=60)
+    key_set.failures = 10
+    assert key_set.retry_delay() == 60
+
+
+def test_get_key_does_not_reload_on_the_request_path(tmp_path, private_key):
+    path = tmp_path / "jwks.json"
+    write_jwks(path, private_key, "k1")
+    key_set = auth.JWKSKeySet(str(path), refresh_seconds=600)
+    loads = []
+    fetch = key_set.fetch
+    key_set.fetch = lambda: loads.append(threading.current_thread().name) or fetch()
+
+    # The first token waits for the initial load by the refresh thread
+    assert key_set.get_key("k1").key_id == "k1"
+    assert loads == ["jwks-refresh"]
+
+    # An unknown key id right after a load fails without reloading
+    start = time.monotonic()
+    with pytest.raises(jwt.InvalidTokenError):
+        key_set.get_key("k2")
+    assert time.monotonic() - start < 0.5
+    assert loads == ["jwks-refresh"]
+
+    # A rotation once the minute is over wakes the thread
+    write_jwks(path, private_key, "k2")
+    key_set.last_attempt -= 61
+    assert key_set.get_key("k2").key_id == "k2"
+    assert loads == ["jwks-refresh", "jwks-refresh"]
+
+
+def test_rs256_token_verifies_against_the_jwks(tmp_path, private_key, monkeypatch):
+    path = tmp_path / "jwks.json"
+    write_jwks(path, private_key, "k1")
+    monkeypatch.setattr(auth, "jwks", auth.JWKSKeySet(str(path), refresh_seconds=600))
+    token = jwt.encode(
+        {"sub": "u1", "aud": "authenticated", "exp": int(time.time()) + 60},
+        private_key, algorithm="RS256", headers={"kid": "k1"},
+    )
+    assert auth.verify_jwt_token(token)["sub"] == "u1"
+    hits = auth.get_token_cache_stats()["hits"]
+    assert auth.verify_jwt_token(token)["sub"] == "u1"
+    assert auth.get_token_cache_stats()["hits"] == hits + 1
+
+
+@pytest.mark.anyio
+async def test_metrics_export_token_cache_counters(client):
+    body = (await client.get("/api/metrics")).text
+    assert "jwt_cache_hits_total" in body
+    assert "jwt_cache_misses_total" in body
+
+
+@pytest.mark.anyio
+async def test_pool_health_requires_a_token(client, user_id):
+    assert (await client.get("/api/health/pool")).status_code in (401, 403)
+    response = await client.get("/api/health/pool", headers=auth_headers(user_id))
+    assert response.status_code == 200
+    assert set(response.json()) == {"async", "sync"}
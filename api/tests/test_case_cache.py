@@ -0,0 +1,46 @@
+"""Conditional case reads: If-None-Match by weak comparison, and cache metrics."""
+import pytest
+from cache import case_cache, etag_matches
+from conftest import auth_headers
+
+
+@pytest.fixture
+def case_id(make_case) -> str:
+    return make_case("cached", messages=1, status="COMPLETED")
+
+
+@pytest.mark.parametrize("header, matches", [
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"x", W/"abc"', True),
+    ('"x","abc"', True),
+    ("*", True),
+    ('"x", "y"', False),
+    ('"abcd"', False),
+    (None, False),
+    ("", False),
+])
+def test_etag_matches(header, matches):
+    assert etag_matches(header, '"abc"') is matches
+
+
+@pytest.mark.anyio
+async def test_conditional_get_of_cached_case(client, case_id, user_id):
+    headers = auth_headers(user_id)
+    response = await client.get(f"/api/cases/{case_id}", headers=headers)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    # The first read filled the cache, these are served from it
+    for if_none_match in (etag, f"W/{etag}", f'"stale", {etag}', "*"):
+        response = await client.get(f"/api/cases/{case_id}", headers={**headers, "If-None-Match": if_none_match})
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+    response = await client.get(f"/api/cases/{case_id}", headers={**headers, "If-None-Match": '"stale"'})
+    assert response.status_code == 200 and response.headers["etag"] == etag
+
+    stats = case_cache.stats()
+    assert stats["etag_hits"] >= 4
+    body = (await client.get("/api/metrics")).text
+    assert 'case_cache_hits_total{tier="local"}' in body
+    assert "case_cache_hit_ratio" in body
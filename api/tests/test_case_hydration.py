@@ -0,0 +1,30 @@
+"""CASE_HYDRATION=query returns the same case document as the ORM path."""
+import pytest
+from sqlmodel import Session
+import database
+
+
+@pytest.fixture
+def case_id(make_case) -> str:
+    case_id = make_case("hydration", messages=20, snippets=3, status="COMPLETED")
+    with Session(database.get_engine()) as db:
+        database.add_evidence_snippet(db, case_id, f"{case_id}-plain", {"text": "no source id"})
+    return case_id
+
+
+@pytest.mark.parametrize("dedupe_sources", [False, True])
+def test_query_and_orm_hydration_match(case_id, user_id, monkeypatch, dedupe_sources):
+    with Session(database.get_engine()) as db:
+        _, cursor = database.get_messages_after(db, case_id, user_id)
+        documents = {}
+        for mode in ("query", "orm"):
+            monkeypatch.setattr(database, "CASE_HYDRATION", mode)
+            documents[mode] = [
+                database.get_case_full(db, case_id, user_id, after, dedupe_sources)
+                for after in (None, cursor - 5, cursor)
+            ]
+            documents[mode].append(database.get_case_full(db, case_id, "someone-else", dedupe_sources=dedupe_sources))
+    assert documents["query"] == documents["orm"]
+    assert len(documents["query"][0]["messages"]) == 20
+    assert len(documents["query"][1]["messages"]) == 5
+    assert documents["query"][3] is None
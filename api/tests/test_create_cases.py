@@ -0,0 +1,89 @@
+"""POST /api/create_cases with an Idempotency-Key never creates a case twice."""
+import json
+import pytest
+from redis import RedisError
+from sqlmodel import Session, select
+import async_database
+import database
+import idempotency
+import server
+from conftest import auth_headers
+
+BODY = {"cases": [{"question": f"question {i}"} for i in range(3)]}
+
+
+def user_case_ids(user_id: str) -> set[str]:
+    with Session(database.get_engine()) as db:
+        return set(db.exec(select(database.ClinicalCase.case_id).where(database.ClinicalCase.user_id == user_id)).all())
+
+
+def queued_ids() -> set[str]:
+    return set(server.get_job_queue().job_ids)
+
+
+async def create_cases(client, user_id: str, key: str = "key-1"):
+    return await client.post("/api/create_cases", json=BODY, headers={**auth_headers(user_id), "Idempotency-Key": key})
+
+
+@pytest.mark.anyio
+async def test_retry_returns_the_stored_response(client, user_id):
+    first = await create_cases(client, user_id)
+    assert first.status_code == 201
+    retry = await create_cases(client, user_id)
+    assert retry.status_code == 201 and retry.content == first.content
+    assert len(user_case_ids(user_id)) == 3
+
+
+@pytest.mark.anyio
+async def test_retry_after_failed_enqueue_reuses_the_committed_cases(client, user_id, monkeypatch):
+    enqueue_cases = server.enqueue_cases
+
+    def failing(*args):
+        raise RedisError("connection lost")
+
+    monkeypatch.setattr(server, "enqueue_cases", failing)
+    with pytest.raises(RedisError):
+        await create_cases(client, user_id)
+    committed = user_case_ids(user_id)
+    assert len(committed) == 3 and not queued_ids() & committed
+
+    monkeypatch.setattr(server, "enqueue_cases", enqueue_cases)
+    retry = await create_cases(client, user_id)
+    assert retry.status_code == 201
+    assert [case["case_id"] for case in retry.json()["cases"]] == [
+        case_id for case_id in server.get_job_queue().job_ids if case_id in committed
+    ]
+    assert user_case_ids(user_id) == committed
+    assert queued_ids() >= committed
+
+
+@pytest.mark.anyio
+async def test_retry_after_failed_insert_creates_the_recorded_ids(client, redis, user_id, monkeypatch):
+    create_cases_bulk = async_database.create_cases_bulk
+
+    async def failing(*args):
+        raise RedisError("connection lost")
+
+    monkeypatch.setattr(async_database, "create_cases_bulk", failing)
+    with pytest.raises(RedisError):
+        await create_cases(client, user_id)
+    assert not user_case_ids(user_id)
+    recorded = json.loads(redis.hget(idempotency.idempotency_key(user_id, "key-1"), "ids"))
+
+    monkeypatch.setattr(async_database, "create_cases_bulk", create_cases_bulk)
+    retry = await create_cases(client, user_id)
+    assert [case["case_id"] for case in retry.json()["cases"]] == recorded
+    assert user_case_ids(user_id) == set(recorded)
+
+
+@pytest.mark.anyio
+async def test_pending_key_is_taken_over_once_its_lease_expires(redis, user_id):
+    assert (await idempotency.claim(user_id, "key-2", "f1"))[0] == idempotency.NEW
+    await idempotency.record_ids(user_id, "key-2", b'["a","b"]')
+    assert (await idempotency.claim(user_id, "key-2", "f1"))[0] == idempotency.PENDING
+    assert (await idempotency.claim(user_id, "key-2", "f2"))[0] == idempotency.MISMATCH
+
+    assert 0 < redis.ttl(idempotency.lease_key(user_id, "key-2")) <= idempotency.IDEMPOTENCY_PENDING_SECONDS
+    redis.delete(idempotency.lease_key(user_id, "key-2"))
+    assert await idempotency.claim(user_id, "key-2", "f1") == (idempotency.RESUME, b'["a","b"]')
+    assert (await idempotency.claim(user_id, "key-2", "f1"))[0] == idempotency.PENDING
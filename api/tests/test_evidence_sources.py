@@ -0,0 +1,34 @@
+"""Evidence sources are stored once, and a snippet reads back exactly what was written for it."""
+import uuid
+import pytest
+from sqlmodel import Session, select
+import database
+
+SOURCE = {"source_id": "PMID1", "text": "aspirin trial", "source_type": "pubmed", "source_url": "https://example.org/1", "source_citation": "A et al. 2020"}
+
+
+@pytest.fixture
+def case_ids(redis, user_id) -> list[str]:
+    case_ids = [str(uuid.uuid4()) for _ in range(3)]
+    with Session(database.get_engine()) as db:
+        for case_id in case_ids:
+            database.create_case(db, case_id, user_id, "sources")
+        database.add_evidence_snippet(db, case_ids[0], f"{case_ids[0]}-s0", {**SOURCE, "index": 0})
+        database.add_evidence_snippets_bulk(db, case_ids[1], [(f"{case_ids[1]}-s0", {**SOURCE, "index": 0})])
+        # Same id and text, cited from another edition
+        database.add_evidence_snippet(db, case_ids[2], f"{case_ids[2]}-s0", {
+            **SOURCE, "index": 0, "source_url": "https://example.org/2", "source_citation": "A et al. 2021",
+        })
+    return case_ids
+
+
+def test_sources_differing_in_url_or_citation_are_not_merged(case_ids, user_id):
+    with Session(database.get_engine()) as db:
+        snippets = [database.get_case_full(db, case_id, user_id)["evidence_snippets"][0] for case_id in case_ids]
+        hashes = set(db.exec(select(database.EvidenceSnippet.source_hash).where(database.EvidenceSnippet.case_id.in_(case_ids))).all())
+    assert [(snippet["source_url"], snippet["source_citation"]) for snippet in snippets] == [
+        ("https://example.org/1", "A et al. 2020"),
+        ("https://example.org/1", "A et al. 2020"),
+        ("https://example.org/2", "A et al. 2021"),
+    ]
+    assert len(hashes) == 2
@@ -0,0 +1,96 @@
+"""
+Case creation limits: every case of a bulk request takes a token, and a
+client flooding the API does not slow down the other users.
+"""
+import asyncio
+import time
+import pytest
+import limits
+from conftest import auth_headers
+
+
+@pytest.fixture
+def create_limits(monkeypatch):
+    monkeypatch.setattr(limits, "CREATE_CASE_RATE", 0.5)
+    monkeypatch.setattr(limits, "CREATE_CASE_BURST", 5)
+
+
+def bulk_body(count: int) -> dict:
+    return {"cases": [{"question": f"question {i}"} for i in range(count)]}
+
+
+@pytest.mark.anyio
+async def test_bulk_request_takes_a_token_per_case(client, user_id, create_limits):
+    response = await client.post("/api/create_cases", json=bulk_body(5), headers=auth_headers(user_id))
+    assert response.status_code == 201
+    response = await client.post("/api/create_case", json={"question": "one more"}, headers=auth_headers(user_id))
+    assert response.status_code == 429
+    assert 1 <= int(response.headers["Retry-After"]) <= 2
+
+
+@pytest.mark.anyio
+async def test_bulk_request_over_the_burst_leaves_a_debt(client, user_id, create_limits):
+    # Let through from a full bucket, never rejected for good
+    response = await client.post("/api/create_cases", json=bulk_body(8), headers=auth_headers(user_id))
+    assert response.status_code == 201
+    response = await client.post("/api/create_cases", json=bulk_body(2), headers=auth_headers(f"other-{user_id}"))
+    assert response.status_code == 201
+    # 3 tokens owed and 1 needed: 8 seconds at 0.5 per second
+    response = await client.post("/api/create_case", json={"question": "one more"}, headers=auth_headers(user_id))
+    assert response.status_code == 429
+    assert 7 <= int(response.headers["Retry-After"]) <= 8
+
+
+def p99(latencies: list[float]) -> float:
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+
+
+async def normal_user(client, user_id: str, requests: int) -> list[float]:
+    """Latencies of a user creating a case and listing their cases, with a pause in between."""
+    headers = auth_headers(user_id)
+    latencies = []
+    for i in range(requests):
+        started = time.perf_counter()
+        if i % 5 == 0:
+            response = await client.post("/api/create_case", json={"question": f"question {i}"}, headers=headers)
+            assert response.status_code == 201
+        else:
+            response = await client.get("/api/cases", headers=headers)
+            assert response.status_code == 200
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.01)
+    return latencies
+
+
+async def flood(client, user_id: str, stop: asyncio.Event) -> dict[int, int]:
+    """Create cases without pause until stopped. Returns the responses by status."""
+    body, headers = bulk_body(20), auth_headers(user_id)
+    statuses = {}
+    while not stop.is_set():
+        response = await client.post("/api/create_cases", json=body, headers=headers)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    return statuses
+
+
+@pytest.mark.anyio
+async def test_flood_does_not_slow_down_other_users(client, user_id, monkeypatch):
+    monkeypatch.setattr(limits, "CREATE_CASE_RATE", 1)
+    monkeypatch.setattr(limits, "CREATE_CASE_BURST", 20)
+    users = [f"{user_id}-{i}" for i in range(3)]
+    # Warm up the routes and the connection pool
+    await asyncio.gather(*(normal_user(client, user, 2) for user in users))
+
+    quiet = sum(await asyncio.gather(*(normal_user(client, user, 40) for user in users)), [])
+
+    stop = asyncio.Event()
+    flooder = asyncio.create_task(flood(client, f"flooder-{user_id}", stop))
+    flooded = sum(await asyncio.gather(*(normal_user(client, user, 40) for user in users)), [])
+    stop.set()
+    statuses = await flooder
+
+    # The flooder's first request emptied its bucket, the others were turned away
+    assert statuses[201] == 1
+    assert statuses[429] > len(flooded)
+    # Rejections are cheap, yet share the event loop with the other users
+    assert p99(flooded) < 2 * p99(quiet) + 0.05, (p99(quiet), p99(flooded))
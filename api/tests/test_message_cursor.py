@@ -0,0 +1,70 @@
+"""Messages are read after an autoincrement-id cursor, so messages sharing a timestamp are never lost or repeated."""
+import uuid
+from datetime import datetime
+import pytest
+from sqlmodel import Session
+import database
+from conftest import auth_headers
+
+
+def add_messages_at(case_id: str, user_id: str, created_at: datetime, count: int) -> list[str]:
+    """Insert `count` messages all stamped `created_at`, in one transaction. Returns their ids."""
+    message_ids = [f"{case_id}-m{uuid.uuid4()}" for _ in range(count)]
+    with Session(database.get_engine()) as db:
+        for message_id in message_ids:
+            db.add(database.Message(
+                message_id=message_id, case_id=case_id, user_id=user_id,
+                message_data_json={"text": message_id}, created_at=created_at,
+            ))
+        db.commit()
+    return message_ids
+
+
+@pytest.fixture
+def case_id(make_case) -> str:
+    return make_case("cursor")
+
+
+def test_messages_after_cursor_with_tied_timestamps(case_id, user_id):
+    tied = datetime(2025, 1, 1, 12, 0, 0)
+    written = add_messages_at(case_id, user_id, tied, 5)
+    read = []
+    with Session(database.get_engine()) as db:
+        messages, cursor = database.get_messages_after(db, case_id, user_id)
+        read += [message["message_id"] for message in messages]
+
+        # More messages with the very same timestamp, written after the read
+        written += add_messages_at(case_id, user_id, tied, 5)
+        messages, cursor = database.get_messages_after(db, case_id, user_id, cursor)
+        read += [message["message_id"] for message in messages]
+
+        messages, unchanged = database.get_messages_after(db, case_id, user_id, cursor)
+    assert read == written
+    assert messages == [] and unchanged == cursor
+
+
+def test_next_cursor_is_the_last_id():
+    messages = [database.Message(id=id, message_id=str(id), case_id="c", user_id="u") for id in (3, 7)]
+    assert database.next_cursor(messages, after=2) == 7
+    assert database.next_cursor([], after=2) == 2
+    assert database.next_cursor([], after=None) is None
+
+
+@pytest.mark.anyio
+async def test_case_endpoint_after_cursor(client, case_id, user_id):
+    tied = datetime(2025, 1, 1, 12, 0, 0)
+    written = add_messages_at(case_id, user_id, tied, 3)
+    response = await client.get(f"/api/cases/{case_id}", headers=auth_headers(user_id))
+    assert response.status_code == 200
+    first = response.json()
+    assert [message["message_id"] for message in first["messages"]] == written
+
+    more = add_messages_at(case_id, user_id, tied, 3)
+    response = await client.get(f"/api/cases/{case_id}", params={"after": first["next_cursor"]}, headers=auth_headers(user_id))
+    second = response.json()
+    assert [message["message_id"] for message in second["messages"]] == more
+    assert second["next_cursor"] > first["next_cursor"]
+
+    response = await client.get(f"/api/cases/{case_id}", params={"after": second["next_cursor"]}, headers=auth_headers(user_id))
+    assert response.json()["messages"] == []
+    assert response.json()["next_cursor"] == second["next_cursor"]
@@ -0,0 +1,54 @@
+"""Lanes, turns and in-flight caps of the scheduler, and cases lost between pick and enqueue."""
+import pytest
+from rq import Queue
+import scheduler
+
+
+@pytest.fixture
+def case_scheduler(redis, monkeypatch) -> scheduler.Scheduler:
+    monkeypatch.setattr(scheduler, "SCHEDULER_USER_INFLIGHT", 2)
+    monkeypatch.setattr(scheduler, "SCHEDULER_INTERACTIVE_INFLIGHT", 3)
+    monkeypatch.setattr(scheduler, "SCHEDULER_QUEUE_DEPTH", 100)
+    return scheduler.Scheduler(Queue("test-scheduler", connection=redis))
+
+
+def cases(user_id: str, count: int) -> list[tuple[str, str]]:
+    return [(f"{user_id}-{i}", f"question {i}") for i in range(count)]
+
+
+def test_users_take_turns_under_the_cap(case_scheduler):
+    case_scheduler.submit(scheduler.BATCH, "a", cases("a", 5))
+    case_scheduler.submit(scheduler.BATCH, "b", cases("b", 1))
+    assert case_scheduler.queue_positions(["a-0", "b-0", "a-1", "a-4"]) == [1, 2, 3, 6]
+
+    assert case_scheduler.dispatch() == 3
+    assert case_scheduler.queue.job_ids == ["a-0", "b-0", "a-1"]
+    assert case_scheduler.queue_positions(["a-0", "a-2"]) == [None, 1]
+    assert case_scheduler.pending_count() == 3
+
+
+def test_interactive_lane_has_a_higher_cap(case_scheduler):
+    case_scheduler.submit(scheduler.BATCH, "a", cases("a", 3))
+    assert case_scheduler.dispatch() == 2
+    # At the cap with batch cases, the user's interactive case still goes first
+    case_scheduler.submit(scheduler.INTERACTIVE, "a", [("a-live-0", "question"), ("a-live-1", "question")])
+    assert case_scheduler.queue_position("a-live-0") == 1
+    assert case_scheduler.dispatch() == 1
+    assert case_scheduler.queue.job_ids[-1] == "a-live-0"
+    # Then the interactive lane is at its cap too, and other users go ahead
+    case_scheduler.submit(scheduler.INTERACTIVE, "b", [("b-live", "question")])
+    assert case_scheduler.dispatch() == 1
+    assert case_scheduler.queue.job_ids[-1] == "b-live"
+    assert case_scheduler.queue_positions(["a-live-1", "a-2"]) == [1, 2]
+
+
+def test_picked_case_without_job_is_resubmitted(case_scheduler):
+    case_scheduler.submit(scheduler.BATCH, "a", cases("a", 2))
+    # The dispatcher stops after the pick, before the job is enqueued
+    assert case_scheduler.pick() == ("a-0", "a")
+    assert case_scheduler.release_ended() == 0
+    assert case_scheduler.queue_positions(["a-0", "a-1"]) == [1, 2]
+
+    assert case_scheduler.dispatch() == 2
+    assert case_scheduler.queue.job_ids == ["a-0", "a-1"]
+    assert case_scheduler.release_ended() == 0
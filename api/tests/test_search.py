@@ -0,0 +1,80 @@
+"""GET /api/search: scoped to the user, paginated, and highlights safe to render as HTML."""
+import uuid
+import pytest
+from sqlmodel import Session, create_engine
+import database
+from conftest import auth_headers
+
+
+@pytest.fixture
+def word() -> str:
+    """A word no other test writes, so that results only come from this test."""
+    return "zq" + uuid.uuid4().hex[:10]
+
+
+@pytest.fixture
+def case_id(redis, user_id, word) -> str:
+    case_id = str(uuid.uuid4())
+    source = {
+        "source_id": f"PMID-{word}", "text": f"<img src=x onerror=alert(1)> {word} reduces mortality",
+        "source_type": "pubmed", "source_url": "https://example.org/1", "source_citation": "A et al. 2020",
+    }
+    with Session(database.get_engine()) as db:
+        database.create_case(db, case_id, user_id, f"Chest pain, {word} & <b>heparin</b>")
+        database.add_message(db, case_id, user_id, f"{case_id}-m0", {"text": f"Start {word} if troponin < 0.04 & <i>rising</i>", "stage": "final", "message_type": "AGENT"})
+        database.add_evidence_snippet(db, case_id, f"{case_id}-s0", {**source, "index": 0})
+        # Another user's case with the same words
+        database.create_case(db, str(uuid.uuid4()), f"other-{user_id}", f"Chest pain, {word}")
+    return case_id
+
+
+async def search_all(client, user_id: str, q: str, limit: int) -> list[dict]:
+    results, cursor = [], None
+    while True:
+        params = {"q": q, "limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = await client.get("/api/search", params=params, headers=auth_headers(user_id))
+        assert response.status_code == 200
+        page = response.json()
+        results += page["results"]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return results
+
+
+@pytest.mark.anyio
+async def test_search_pages_through_the_users_matches(client, case_id, user_id, word):
+    results = await search_all(client, user_id, word, limit=1)
+    assert sorted(result["kind"] for result in results) == ["case", "evidence", "message"]
+    assert {result["case_id"] for result in results} == {case_id}
+    ranks = [result["rank"] for result in results]
+    assert ranks == sorted(ranks, reverse=True)
+
+
+@pytest.mark.anyio
+async def test_highlights_escape_the_matched_text(client, case_id, user_id, word):
+    highlights = {result["kind"]: result["highlight"] for result in await search_all(client, user_id, word, limit=20)}
+    for highlight in highlights.values():
+        assert f"<mark>{word}</mark>" in highlight
+        assert "<" not in highlight.replace("<mark>", "").replace("</mark>", "")
+    # PostgreSQL drops the tags from highlights, SQLite escapes them
+    assert "&amp;" in highlights["case"]
+    assert "troponin &lt; 0.04 &amp;" in highlights["message"]
+
+
+@pytest.mark.skipif(database.database_dialect != "sqlite", reason="SQLite FTS5 tables")
+def test_search_index_with_an_older_layout_is_rebuilt(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    database.SQLModel.metadata.create_all(engine)
+    with engine.begin() as connection:
+        # Evidence sources indexed by their implicit rowid, which VACUUM may renumber
+        connection.exec_driver_sql("CREATE VIRTUAL TABLE evidence_sources_fts USING fts5(body, tokenize = 'porter unicode61')")
+        connection.exec_driver_sql("CREATE TRIGGER evidence_sources_fts_insert AFTER INSERT ON evidence_sources BEGIN SELECT 1; END")
+        connection.exec_driver_sql(
+            "INSERT INTO evidence_sources (source_hash, source_data_json, created_at) VALUES ('h1', '{\"text\": \"aspirin\"}', '2026-01-01')"
+        )
+        database.init_search_index(connection)
+        database.init_search_index(connection)
+        assert connection.exec_driver_sql(
+            "SELECT source_hash FROM evidence_sources_fts WHERE evidence_sources_fts MATCH 'aspirin'"
+        ).scalars().all() == ["h1"]
+    engine.dispose()
@@ -0,0 +1,24 @@
+"""Importing the application in a fresh process connects to nothing, even with no database or Redis up."""
+import os
+import subprocess
+import sys
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHECK = """
+import async_database, database, events, server
+assert database._engine is None and async_database._async_engine is None
+assert server._redis_conn is None and server._job_queue is None
+assert events._redis is None and events._async_redis is None
+"""
+
+
+def test_import_creates_no_engine_or_redis_client():
+    env = {
+        **os.environ,
+        # Nothing listens on port 1
+        "DATABASE_URL": "postgresql://nobody@127.0.0.1:1/none",
+        "REDIS_URL": "redis://127.0.0.1:1/0",
+    }
+    result = subprocess.run([sys.executable, "-c", CHECK], cwd=API_DIR, env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
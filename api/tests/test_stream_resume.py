@@ -0,0 +1,93 @@
+"""
+A stream cut mid-way and resumed with Last-Event-ID ("42.17") sends each
+message and snippet once, from the Redis replay buffer or from the database.
+"""
+import json
+import pytest
+import async_database
+import events
+from conftest import make_token
+
+
+@pytest.fixture
+def case_id(make_case) -> str:
+    return make_case("resume", messages=10, snippets=3, status="COMPLETED")
+
+
+def parse_frames(body: bytes) -> list[tuple[str, dict, int]]:
+    """(id, event, size in bytes) of each frame of a stream."""
+    frames = []
+    for chunk in body.split(b"\n\n"):
+        if not chunk or chunk.startswith(b":"):
+            continue
+        fields = dict(line.split(b": ", 1) for line in chunk.split(b"\n"))
+        frames.append((fields[b"id"].decode(), json.loads(fields[b"data"]), len(chunk) + 2))
+    return frames
+
+
+def rows(frames) -> list[tuple[str, int]]:
+    return [(event["type"], event["cursor"]) for _, event, _ in frames if event["type"] in ("message", "evidence")]
+
+
+def row_bytes(frames) -> int:
+    return sum(size for _, event, size in frames if event["type"] in ("message", "evidence"))
+
+
+async def read_stream(client, case_id: str, user_id: str, last_event_id: str = None) -> list[tuple[str, dict, int]]:
+    headers = {"Last-Event-ID": last_event_id} if last_event_id else {}
+    response = await client.get(f"/api/cases/{case_id}/stream", params={"token": make_token(user_id)}, headers=headers)
+    assert response.status_code == 200
+    return parse_frames(response.content)
+
+
+@pytest.fixture
+def history_reads(monkeypatch) -> list:
+    """Calls of the database catch-up read, which a replay from Redis skips."""
+    calls = []
+    get_case_events = async_database.get_case_events
+
+    async def counting(*args, **kwargs):
+        calls.append(args)
+        return await get_case_events(*args, **kwargs)
+
+    monkeypatch.setattr(async_database, "get_case_events", counting)
+    return calls
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("source", ["replay", "database"])
+async def test_resume_sends_nothing_twice(client, redis, case_id, user_id, history_reads, source):
+    full = await read_stream(client, case_id, user_id)
+    sent = rows(full)
+    assert len(sent) == 13
+
+    # The connection drops right after the second snippet, at a "42.17" id
+    cut = [index for index, (_, event, _) in enumerate(full) if event["type"] == "evidence"][1]
+    last_event_id = full[cut][0]
+    assert "." in last_event_id
+    received = rows(full[:cut + 1])
+
+    if source == "database":
+        redis.delete(events.case_replay_key(case_id))
+    history_reads.clear()
+    resumed = await read_stream(client, case_id, user_id, last_event_id)
+    assert bool(history_reads) == (source == "database")
+
+    assert received + rows(resumed) == sent
+    # Not a byte of the rows received before the cut is sent again, only a
+    # status frame up front and the done frame
+    assert row_bytes(resumed) == row_bytes(full[cut + 1:])
+    assert [event for _, event, _ in resumed if event["type"] not in ("message", "evidence")] == [
+        {"type": "status", "status": "COMPLETED"},
+        {"type": "done", "status": "COMPLETED"},
+    ]
+
+
+@pytest.mark.anyio
+async def test_resume_before_any_snippet(client, case_id, user_id, history_reads):
+    full = await read_stream(client, case_id, user_id)
+    # Cut after the first message, before any snippet: a plain "42" id
+    cut = next(index for index, (_, event, _) in enumerate(full) if event["type"] == "message")
+    assert "." not in full[cut][0]
+    resumed = await read_stream(client, case_id, user_id, full[cut][0])
+    assert rows(full[:cut + 1]) + rows(resumed) == rows(full)
@@ -0,0 +1,70 @@
+"""A failed flush keeps its rows pending and the caller hears about it."""
+import threading
+import pytest
+from sqlmodel import Session
+import database
+from write_buffer import CaseWriteBuffer
+
+
+@pytest.fixture
+def case_id(make_case) -> str:
+    return make_case("buffer")
+
+
+def stored_message_ids(case_id: str, user_id: str) -> list[str]:
+    with Session(database.get_engine()) as db:
+        messages, _ = database.get_messages_after(db, case_id, user_id)
+    return [message["message_id"] for message in messages]
+
+
+def failing_once(monkeypatch, flushed: threading.Event = None):
+    """Make the next bulk message insert fail."""
+    add_messages_bulk = database.add_messages_bulk
+    calls = []
+
+    def add(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            if flushed:
+                flushed.set()
+            raise RuntimeError("database is down")
+        return add_messages_bulk(*args)
+
+    monkeypatch.setattr(database, "add_messages_bulk", add)
+
+
+def test_failed_timer_flush_keeps_rows_and_raises_on_next_call(case_id, user_id, monkeypatch):
+    flushed = threading.Event()
+    failing_once(monkeypatch, flushed)
+    buffer = CaseWriteBuffer(case_id, user_id, max_rows=100, max_delay=0.01)
+    buffer.add_message(f"{case_id}-m1", {"text": "one"})
+    assert flushed.wait(timeout=5)
+    with buffer.lock:
+        assert [message_id for message_id, _ in buffer.messages] == [f"{case_id}-m1"]
+
+    with pytest.raises(RuntimeError, match="database is down"):
+        buffer.add_message(f"{case_id}-m2", {"text": "two"})
+    buffer.add_message(f"{case_id}-m2", {"text": "two"})
+    buffer.update_case_status("COMPLETED")
+    assert stored_message_ids(case_id, user_id) == [f"{case_id}-m1", f"{case_id}-m2"]
+
+
+def test_failed_flush_raises_and_retries(case_id, user_id, monkeypatch):
+    failing_once(monkeypatch)
+    buffer = CaseWriteBuffer(case_id, user_id, max_rows=100, max_delay=60)
+    buffer.add_message(f"{case_id}-m1", {"text": "one"})
+    buffer.add_evidence_snippet(f"{case_id}-s1", {"text": "evidence"})
+    with pytest.raises(RuntimeError):
+        buffer.flush()
+    assert stored_message_ids(case_id, user_id) == []
+    buffer.close()
+    assert stored_message_ids(case_id, user_id) == [f"{case_id}-m1"]
+    with Session(database.get_engine()) as db:
+        assert [event["type"] for event in database.get_case_events(db, case_id, user_id)] == ["message", "evidence"]
+
+
+def test_size_threshold_flushes(case_id, user_id):
+    with CaseWriteBuffer(case_id, user_id, max_rows=3, max_delay=60) as buffer:
+        for i in range(3):
+            buffer.add_message(f"{case_id}-m{i}", {"text": str(i)})
+        assert stored_message_ids(case_id, user_id) == [f"{case_id}-m{i}" for i in range(3)]
@@ -0,0 +1,121 @@
+"""
+Buffered writes of agent output for the worker.
+
+An agent run streams dozens of messages and hundreds of evidence snippets.
+Writing each one in its own transaction costs a commit (and an fsync) per row,
+so the worker buffers them per case and writes them with the bulk helpers in
+`database` once enough rows are pending or enough time has passed.
+"""
+import threading
+from typing import Optional
+from sqlmodel import Session
+import database
+
+
+class CaseWriteBuffer:
+    """
+    Write buffer for the output of one case.
+
+    Pending rows are flushed when `max_rows` are buffered or `max_delay`
+    seconds after the first pending row, whichever comes first. Status
+    changes always flush first, so a stream never shows a status ahead of
+    the messages that preceded it.
+
+    Rows that fail to be written stay pending and are retried by the next
+    flush. When a flush on the timer fails, its error is raised by the next
+    call to `add_message`, `add_evidence_snippet` or `update_case_status`
+    unless a flush succeeded since, so the caller learns about it.
+
+    Usage:
+        with CaseWriteBuffer(case_id, user_id) as buffer:
+            buffer.update_case_status("PROCESSING")
+            buffer.add_message(message_id, message_data)
+            buffer.add_evidence_snippet(snippet_id, snippet_data)
+            buffer.update_case_status("COMPLETED")
+    """
+
+    def __init__(self, case_id: str, user_id: str, max_rows: int = 50, max_delay: float = 0.1):
+        self.case_id = case_id
+        self.user_id = user_id
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.messages: list[tuple[str, dict]] = []
+        self.snippets: list[tuple[str, dict]] = []
+        self.lock = threading.RLock()
+        self.timer = None
+        # Error of the last flush on the timer, raised by the next call
+        self.error: Optional[Exception] = None
+
+    def __enter__(self) -> "CaseWriteBuffer":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add_message(self, message_id: str, message_data: dict):
+        """Buffer a message of the case."""
+        with self.lock:
+            self._raise_timer_error()
+            self.messages.append((message_id, message_data))
+            self._schedule()
+
+    def add_evidence_snippet(self, snippet_id: str, snippet_data: dict):
+        """Buffer an evidence snippet of the case."""
+        with self.lock:
+            self._raise_timer_error()
+            self.snippets.append((snippet_id, snippet_data))
+            self._schedule()
+
+    def update_case_status(self, status: str):
+        """Flush the pending rows, then update the status of the case."""
+        with self.lock:
+            self._raise_timer_error()
+            self.flush()
+            with Session(database.get_engine()) as db:
+                database.update_case_status(db, self.case_id, status)
+
+    def flush(self):
+        """Write all pending rows in one transaction per table. Rows that could not be written stay pending."""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.messages:
+                with Session(database.get_engine()) as db:
+                    database.add_messages_bulk(db, self.case_id, self.user_id, self.messages)
+                self.messages = []
+            if self.snippets:
+                with Session(database.get_engine()) as db:
+                    database.add_evidence_snippets_bulk(db, self.case_id, self.snippets)
+                self.snippets = []
+            self.error = None
+
+    def close(self):
+        """Flush what is left, the buffer can't be used afterwards."""
+        self.flush()
+
+    def _schedule(self):
+        # Size threshold reached: write now
+        if len(self.messages) + len(self.snippets) >= self.max_rows:
+            self.flush()
+        # First pending row: write at the latest after max_delay
+        elif self.timer is None:
+            self.timer = threading.Timer(self.max_delay, self._flush_on_timer)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _flush_on_timer(self):
+        with self.lock:
+            # Cancelled while waiting for the lock, the rows were written since
+            if self.timer is None or self.timer is not threading.current_thread():
+                return
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"* failed to flush writes for case {self.case_id}, keeping them pending: {e}")
+                self.error = e
+
+    def _raise_timer_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error